@@ -0,0 +1,213 @@
+# ann.py — IVF (inverted file) approximate nearest-neighbour index over a store.Index
+#
+# Spherical k-means centroids partition the rows into nlist lists; a query scores the
+# centroids, then exactly scores only the rows of its nprobe closest lists.
+# Files live next to the vector segments under their own name (manifest["ann"]["name"]):
+#   ivfcent.<name>.npy  [nlist, D] float32 unit centroids
+#   ivfrows.<name>.npy  [N] int64 global row ids grouped by list (ascending within a list)
+#   ivfoffs.<name>.npy  [nlist+1] int64 list boundaries into ivfrows
+# An incremental ingest only assigns its appended rows to the existing centroids (extend);
+# the centroids are retrained after a compaction (row ids change), once the index has grown
+# by ANN_RETRAIN_GROWTH since training, or once the appended rows fit the centroids worse than
+# the training rows by ANN_RETRAIN_DRIFT mean cosine (new material the lists do not cover).
+import os, time
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "50000"))   # build + use IVF at/above this size
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))             # 0 -> ~sqrt(N)
+ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "1.0"))   # retrain past this growth fraction
+ANN_RETRAIN_DRIFT = float(os.getenv("ANN_RETRAIN_DRIFT", "0.05"))     # retrain past this loss of fit
+TRAIN_PER_LIST = 64
+BLOCK_ROWS = 65536
+
+def _files(outdir: Path, name: str) -> Dict[str, Path]:
+    return {
+        "cent": outdir / f"ivfcent.{name}.npy",
+        "rows": outdir / f"ivfrows.{name}.npy",
+        "offs": outdir / f"ivfoffs.{name}.npy",
+    }
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-12)
+
+def _assign(x: np.ndarray, cent: np.ndarray) -> np.ndarray:
+    return np.argmax(x @ cent.T, axis=1)
+
+def kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit rows; returns [k, D] unit centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    cent = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        a = _assign(x, cent)
+        order = np.argsort(a, kind="stable")
+        counts = np.bincount(a, minlength=k)
+        sums = np.zeros_like(cent)
+        nz = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nz]
+        sums[nz] = np.add.reduceat(x[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:   # re-seed empty lists from random points
+            sums[empty] = x[rng.choice(len(x), empty.size, replace=False)]
+        cent = _unit(sums).astype(np.float32)
+    return cent
+
+def _assign_rows(idx, cent: np.ndarray, start: int, stop: int) -> Tuple[np.ndarray, float]:
+    """List of each row in [start, stop) and the sum of their cosines to the chosen centroid."""
+    assign, fit = np.empty(stop - start, dtype=np.int64), 0.0
+    for a in range(start, stop, BLOCK_ROWS):
+        b = min(stop, a + BLOCK_ROWS)
+        cs = idx.rows_f32(slice(a, b)) @ cent.T
+        assign[a - start:b - start] = np.argmax(cs, axis=1)
+        fit += float(cs.max(axis=1).sum())
+    return assign, fit
+
+def _write(outdir: Path, name: str, cent: np.ndarray, rows: np.ndarray, offs: np.ndarray):
+    files = _files(outdir, name)
+    for key, arr in (("cent", cent), ("rows", rows), ("offs", offs.astype(np.int64))):
+        with open(files[key], "wb") as f:
+            np.save(f, arr)
+
+def build(idx, outdir: Path, name: str, nlist: int = 0, seed: int = 0) -> Dict:
+    """Train on a sample of idx, assign every row, write the list files; returns a manifest header."""
+    n = len(idx)
+    nlist = nlist or ANN_NLIST or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, min(n, nlist * TRAIN_PER_LIST), replace=False))
+    cent = kmeans(_unit(idx.rows_f32(sample)), nlist, seed=seed)
+
+    assign, fit = _assign_rows(idx, cent, 0, n)
+    rows = np.argsort(assign, kind="stable")
+    offs = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(cent)))])
+    _write(outdir, name, cent, rows, offs)
+    return {"kind": "ivf", "nlist": int(len(cent)), "rows": int(n),
+            "trained": int(n), "fit": fit / max(1, n), "added_fit": None}
+
+def extend(idx, outdir: Path, prev: Dict, name: str) -> Dict | None:
+    """Assign the rows appended since prev (a header of an IVF in outdir) to its centroids and
+    write the merged lists under name; returns the new header, or None when the centroids
+    should be retrained instead (see the module comment)."""
+    n, start = len(idx), prev["rows"]
+    trained = prev.get("trained")
+    if trained is None or n > trained * (1 + ANN_RETRAIN_GROWTH):
+        return None
+    old = IVF.load(outdir, prev["name"])
+    assign, fit = _assign_rows(idx, old.cent, start, n)
+    added = n - trained
+    added_fit = ((prev["added_fit"] or 0.0) * (start - trained) + fit) / max(1, added)
+    if added and prev["fit"] - added_fit > ANN_RETRAIN_DRIFT:
+        return None
+    # old rows keep their lists (and come first in each, so every list stays ascending)
+    nlist = len(old.cent)
+    lists = np.concatenate([np.repeat(np.arange(nlist), np.diff(old.offs)), assign])
+    order = np.argsort(lists, kind="stable")
+    rows = np.concatenate([np.asarray(old.rows), np.arange(start, n, dtype=np.int64)])[order]
+    offs = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=nlist))])
+    _write(outdir, name, old.cent, rows, offs)
+    return {**prev, "rows": int(n), "added_fit": added_fit if added else None}
+
+class IVF:
+    def __init__(self, cent: np.ndarray, rows: np.ndarray, offs: np.ndarray):
+        self.cent, self.rows, self.offs = cent, rows, offs
+
+    @classmethod
+    def load(cls, outdir: Path, name: str) -> "IVF":
+        f = _files(outdir, name)
+        return cls(np.load(f["cent"]), np.load(f["rows"], mmap_mode="r"), np.load(f["offs"]))
+
+    def search(self, idx, Q: np.ndarray, k: int, nprobe: int = ANN_NPROBE,
+               alive: np.ndarray | None = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Per query (ids, scores) of the best k rows among the nprobe closest lists."""
+        nprobe = max(1, min(nprobe, len(self.cent)))
+        cs = Q @ self.cent.T                                         # [B, nlist]
+        probe = np.argpartition(-cs, nprobe - 1, axis=1)[:, :nprobe]
+        out = []
+        for q, lists in zip(Q, probe):
+            cand = np.concatenate([self.rows[self.offs[c]:self.offs[c + 1]] for c in lists])
+            cand.sort()                                              # sequential page access
+            if alive is not None:
+                cand = cand[alive[cand]]
+            if cand.size == 0:
+                out.append((cand, np.zeros(0, dtype=np.float32))); continue
+            s = idx.rows_f32(cand) @ q
+            kk = min(k, cand.size)
+            top = np.argpartition(-s, kk - 1)[:kk]
+            top = top[np.argsort(-s[top])]
+            out.append((cand[top], s[top]))
+        return out
+
+# --- recall@k vs latency report against exact search
+
+def report(idx, k: int = 10, n_queries: int = 200, nprobes=(1, 2, 4, 8, 16, 32, 64),
+           nlist: int = 0, seed: int = 0) -> Dict:
+    import tempfile
+    rng = np.random.default_rng(seed)
+    n = len(idx)
+    # queries: perturbed copies of indexed rows (stand-ins for real questions)
+    qids = rng.choice(n, min(n, n_queries), replace=False)
+    Q = _unit(idx.rows_f32(np.sort(qids)) + rng.normal(0, 0.02, (len(qids), idx.dim))).astype(np.float32)
+
+    exact, exact_ms = [], []
+    for q in Q:
+        t0 = time.perf_counter()
+        s = idx.scores(q)
+        top = np.argpartition(-s, k - 1)[:k]
+        exact_ms.append((time.perf_counter() - t0) * 1e3)
+        exact.append(set(top.tolist()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        hdr = build(idx, Path(tmp), "report", nlist=nlist, seed=seed)
+        build_s = time.perf_counter() - t0
+        ivf = IVF.load(Path(tmp), "report")
+        rows = []
+        for nprobe in nprobes:
+            if nprobe > hdr["nlist"]: break
+            ms, rec = [], []
+            for q, truth in zip(Q, exact):
+                t0 = time.perf_counter()
+                ids, _ = ivf.search(idx, q[None, :], k, nprobe=nprobe)[0]
+                ms.append((time.perf_counter() - t0) * 1e3)
+                rec.append(len(truth & set(ids.tolist())) / k)
+            rows.append({"nprobe": nprobe, "recall": float(np.mean(rec)),
+                         "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95))})
+        del ivf
+    return {"rows": n, "dim": idx.dim, "k": k, "nlist": hdr["nlist"], "build_s": build_s,
+            "exact_p50_ms": float(np.percentile(exact_ms, 50)),
+            "exact_p95_ms": float(np.percentile(exact_ms, 95)), "ivf": rows}
+
+def _synthetic(n: int, dim: int, seed: int = 0):
+    import store
+    rng = np.random.default_rng(seed)
+    centers = _unit(rng.normal(size=(max(1, n // 500), dim)))
+    x = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 0.05, (n, dim))
+    return store.Index([store.Segment(_unit(x).astype(np.float32), meta_list=[])])
+
+if __name__ == "__main__":
+    import argparse, json
+    ap = argparse.ArgumentParser(description="IVF recall@k vs latency against exact search")
+    ap.add_argument("--synthetic", type=int, default=0, help="use N random clustered rows instead of a course index")
+    ap.add_argument("--course", default="default", help="course whose index to measure")
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--json", help="also write the report here")
+    args = ap.parse_args()
+    if args.synthetic:
+        idx = _synthetic(args.synthetic, args.dim)
+    else:
+        import store, courses
+        idx = store.open_index(store.current_dir(courses.index_root(args.course)))
+    r = report(idx, k=args.k, n_queries=args.queries, nlist=args.nlist)
+    print(f"rows={r['rows']} dim={r['dim']} nlist={r['nlist']} build={r['build_s']:.1f}s "
+          f"exact p50={r['exact_p50_ms']:.2f}ms p95={r['exact_p95_ms']:.2f}ms")
+    print(f"{'nprobe':>6} {'recall@' + str(r['k']):>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in r["ivf"]:
+        print(f"{row['nprobe']:>6} {row['recall']:>9.3f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, indent=1)
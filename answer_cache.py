@@ -0,0 +1,185 @@
+# answer_cache.py — persistent semantic cache for rag.answer (SQLite)
+#
+# Lookup order: exact normalized query text, then the nearest cached query embedding
+# with cosine >= ANSWER_CACHE_SIM. Entries are tied to the index version (the manifest
+# mtime) and a scope "<course>|<chat model>|<embedding model>"; anything a course wrote
+# against another version or models is dropped on its next lookup, other courses' entries
+# are left alone. TTL and an entry cap bound the store.
+# Lookups only read: the purge runs when a course's (scope, version) changes and on a timer,
+# and hit times are kept in memory and written with the next insert (which evicts by them).
+import os, re, json, sqlite3, threading, time
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+
+APP = Path(__file__).resolve().parent
+CACHE_PATH = Path(os.getenv("ANSWER_CACHE_PATH", APP / "data" / "cache" / "answers.sqlite"))
+CACHE_SIM = float(os.getenv("ANSWER_CACHE_SIM", "0.95"))          # cosine for a near-duplicate hit
+CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL_H", "168")) * 3600  # seconds; 0 disables expiry
+CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "5000"))            # entries; 0 disables the cache
+PURGE_EVERY = 300   # seconds between TTL sweeps (expired rows are never served meanwhile)
+
+_WS = re.compile(r"\s+")
+
+def normalize(query: str) -> str:
+    return _WS.sub(" ", query).strip().lower().rstrip("?.! ")
+
+class AnswerCache:
+    """(answer, retrieved chunk ids) keyed by query text and embedding, per index version."""
+
+    def __init__(self, path: Path = CACHE_PATH, sim: float = CACHE_SIM, ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.sim, self.ttl, self.max_entries = sim, ttl, max_entries
+        self.hits = self.semantic_hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ans ("
+            " id INTEGER PRIMARY KEY, scope TEXT NOT NULL, version REAL NOT NULL,"
+            " norm TEXT NOT NULL, query TEXT NOT NULL, vec BLOB, answer TEXT NOT NULL,"
+            " ctx TEXT NOT NULL, created REAL NOT NULL, atime REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ans_norm ON ans(scope, version, norm)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ans_atime ON ans(atime)")
+        self._db.commit()
+        # in-memory copies of the query vectors per (scope, version): (max id, ids [n], vecs [n, D])
+        self._mats: Dict[Tuple[str, float], Tuple] = {}
+        self._current: Dict[str, Tuple[str, float]] = {}   # course prefix -> (scope, version) purged for
+        self._swept = 0.0                                   # time of the last TTL sweep
+        self._touched: Dict[int, float] = {}                # row id -> atime not yet written
+
+    def _purge(self, scope: str, version: float):
+        course = scope.split("|", 1)[0] + "|"
+        stale = self._current.get(course) != (scope, version)
+        sweep = bool(self.ttl) and time.time() - self._swept >= PURGE_EVERY
+        if not stale and not sweep:
+            return
+        if stale:
+            # entries of the same course under other index versions (or models) can never match again
+            self._db.execute("DELETE FROM ans WHERE substr(scope, 1, ?)=? AND (version<>? OR scope<>?)",
+                             (len(course), course, version, scope))
+            self._current[course] = (scope, version)
+            for key in [k for k in self._mats if k[0].startswith(course) and k != (scope, version)]:
+                del self._mats[key]
+        if sweep:
+            self._db.execute("DELETE FROM ans WHERE created<?", (time.time() - self.ttl,))
+            self._swept = time.time()
+        self._flush_atimes()
+        self._db.commit()
+
+    def _flush_atimes(self):
+        # caller commits
+        if self._touched:
+            self._db.executemany("UPDATE ans SET atime=? WHERE id=?", [(t, i) for i, t in self._touched.items()])
+            self._touched.clear()
+
+    def _matrix(self, scope: str, version: float) -> Tuple[np.ndarray, np.ndarray]:
+        top = self._db.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM ans WHERE scope=? AND version=?", (scope, version)).fetchone()[0]
+        mat = self._mats.get((scope, version))
+        if mat is None or mat[0] != top:
+            rows = self._db.execute(
+                "SELECT id, vec FROM ans WHERE scope=? AND version=? AND vec IS NOT NULL",
+                (scope, version)).fetchall()
+            mat = (top, np.array([r[0] for r in rows], dtype=np.int64),
+                   np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+                   if rows else np.zeros((0, 0), dtype=np.float32))
+            self._mats[(scope, version)] = mat
+        return mat[1], mat[2]
+
+    def _fetch(self, row_id: int) -> Tuple[str, List[Dict], str] | None:
+        row = self._db.execute("SELECT answer, ctx, query, created FROM ans WHERE id=?", (row_id,)).fetchone()
+        if row is None or (self.ttl and row[3] < time.time() - self.ttl):
+            return None
+        self._touched[row_id] = time.time()   # written by the next insert or purge
+        return row[0], json.loads(row[1]), row[2]
+
+    def lookup_exact(self, scope: str, version: float, query: str):
+        """(answer, ctx refs, cached query) for the same normalized query, else None."""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            self._purge(scope, version)
+            row = self._db.execute(
+                "SELECT id FROM ans WHERE scope=? AND version=? AND norm=? ORDER BY id DESC LIMIT 1",
+                (scope, version, normalize(query))).fetchone()
+            hit = self._fetch(row[0]) if row else None
+        if hit: self.hits += 1
+        return hit
+
+    def lookup_similar(self, scope: str, version: float, vec: np.ndarray):
+        """Best cached entry whose query embedding has cosine >= sim with vec, else None."""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            ids, vecs = self._matrix(scope, version)
+            hit = None
+            if len(ids) and vecs.shape[1] == len(vec):
+                sims = vecs @ vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.sim:
+                    hit = self._fetch(int(ids[best]))
+        if hit:
+            self.hits += 1; self.semantic_hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def put(self, scope: str, version: float, query: str, vec: np.ndarray | None,
+            answer: str, refs: List[Dict]):
+        if not self.max_entries:
+            return
+        now = time.time()
+        blob = None if vec is None else np.asarray(vec, dtype=np.float32).tobytes()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO ans (scope, version, norm, query, vec, answer, ctx, created, atime)"
+                " VALUES (?,?,?,?,?,?,?,?,?)",
+                (scope, version, normalize(query), query, blob, answer, json.dumps(refs), now, now))
+            self._flush_atimes()   # before evicting, so recent hits are not the ones dropped
+            over = self._db.execute("SELECT COUNT(*) FROM ans").fetchone()[0] - self.max_entries
+            if over > 0:   # least recently used first
+                self._db.execute(
+                    "DELETE FROM ans WHERE id IN (SELECT id FROM ans ORDER BY atime LIMIT ?)", (over,))
+                self._mats.clear()
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM ans")
+            self._db.commit()
+            self._mats.clear(); self._touched.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM ans").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": entries,
+        }
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = AnswerCache()
+        return _CACHE
+
+if __name__ == "__main__":
+    import sys
+    c = get_answer_cache()
+    if "--clear" in sys.argv[1:]:
+        c.clear()
+        print("Cleared answer cache")
+    print(json.dumps(c.stats(), indent=1))
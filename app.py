@@ -1,75 +1,133 @@
-import sys, subprocess, traceback
+import traceback, time, logging
+from contextlib import nullcontext
 import streamlit as st
-import subprocess
-from pathlib import Path
 from dotenv import load_dotenv
-from rag import answer, reload_index
+from rag import answer_stream, preload
 from quiz import make_quiz
+from ingest import start_reindex, current_job
+import tracing, courses
 
 load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
 st.set_page_config(page_title="Learning Coach", page_icon="📚", layout="wide")
 
+@st.cache_resource
+def _preload(course: str):
+    # once per server process and course: open the index while the page renders
+    return preload(course)
+
 st.title("Personalized Learning Coach")
 st.caption("Upload course materials → Chat with citations → Generate quizzes. Everything runs locally except the LLM.")
 
+@st.fragment(run_every=1.0)
+def reindex_status():
+    job = current_job()
+    if job is None:
+        return
+    if job.running:
+        frac = job.files_done / job.files_total if job.files_total else 0.0
+        st.progress(frac, text=f"Indexing {job.course} ({job.stage}): {job.files_done}/{job.files_total} files, "
+                               f"{job.rows} chunks embedded")
+    elif job.error is not None:
+        st.error(f"❌ Reindex of {job.course} failed: {job.error}")
+    else:
+        st.success(f"✅ Reindex of {job.course} complete in {job.finished - job.started:.0f}s. Index reloaded.")
+    with st.expander("Reindex log"):
+        st.text("\n".join(job.lines[-200:]))
+
 with st.sidebar:
+    st.header("Course")
+    with st.form("new_course_form", clear_on_submit=True):
+        new_course = st.text_input("New course", placeholder="e.g. stats-101")
+        if st.form_submit_button("Add course") and new_course.strip():
+            try:
+                courses.sources_dir(new_course.strip()).mkdir(parents=True, exist_ok=True)
+                st.session_state.course = new_course.strip()
+            except ValueError as e:
+                st.error(str(e))
+    course = st.selectbox("Course", courses.list_courses(), key="course")
+    _preload(course)
+
     st.header("Upload")
     up = st.file_uploader("PDF/MD/TXT", type=["pdf","md","markdown","txt"], accept_multiple_files=True)
     if up:
-        SRC = Path("data/sources"); SRC.mkdir(parents=True, exist_ok=True)
+        SRC = courses.sources_dir(course); SRC.mkdir(parents=True, exist_ok=True)
         for f in up:
             (SRC / f.name).write_bytes(f.read())
-        st.success(f"Saved {len(up)} file(s). Click **Reindex** below.")
+        st.success(f"Saved {len(up)} file(s) to {course}. Click **Reindex** below.")
     if st.button("Reindex"):
-        with st.spinner("Indexing your materials…"):
-            proc = subprocess.run(
-                [sys.executable, "ingest.py"],
-                capture_output=True,
-                text=True
-            )
-            # Show logs either way
-            st.text((proc.stdout or "") + (proc.stderr or ""))
-
-            if proc.returncode != 0:
-                st.error(f"❌ Reindex failed (exit {proc.returncode}). See logs above.")
-            else:
-                try:
-                    reload_index()   # hot-reload in-memory vectors
-                    st.success("✅ Reindex complete. Index reloaded.")
-                except Exception as e:
-                    st.error(f"Index reload failed: {e}")
-                    st.code(traceback.format_exc())
+        # runs in this process; chat and quizzes keep using the current index until it is swapped
+        start_reindex(course=course)
+    reindex_status()
     st.markdown("---")
+    st.checkbox("Show timings", key="show_timings", help="Per-stage latency of each answer and quiz")
     st.caption("Tip: After adding or changing files, click **Reindex**.")
 
+def timing_scope():
+    return tracing.collect() if st.session_state.get("show_timings") else nullcontext([])
+
+def show_timings(spans):
+    if not spans or not st.session_state.get("show_timings"):
+        return
+    depth, rows = {}, []
+    for r in sorted(spans, key=lambda r: r["ts"] - r["ms"] / 1e3):
+        depth[r["id"]] = depth.get(r["parent"], -1) + 1
+        extra = {k: v for k, v in r.items() if k not in ("ts", "trace", "id", "parent", "name", "ms")}
+        rows.append({"stage": "\u2003" * depth[r["id"]] + r["name"], "ms": round(r["ms"], 1),
+                     "details": ", ".join(f"{k}={v}" for k, v in extra.items())})
+    with st.expander("⏱ Timings"):
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+
 # --- Chat (form + state) ---
 st.subheader("💬 Ask about your course")
 if "chat_answer" not in st.session_state:
     st.session_state.chat_answer = None
     st.session_state.chat_ctx = []
+    st.session_state.chat_timings = []
 
 with st.form("chat_form", clear_on_submit=False):
     q = st.text_input("Your question", placeholder="e.g., Explain backpropagation with a small numeric example.")
     ask = st.form_submit_button("Ask")
 
+def show_ctx(ctx):
+    with st.expander("Show context chunks"):
+        for c in ctx:
+            st.write(f"- **{c['source']}** (#{c['chunk']})")
+            st.write((c['text'][:600] + '…') if len(c['text'])>600 else c['text'])
+
+def timed(stream, t0, box):
+    # note time-to-first-token next to the answer once the first delta arrives
+    for i, delta in enumerate(stream):
+        if i == 0:
+            box.caption(f"First token after {time.perf_counter() - t0:.1f}s")
+        yield delta
+
 if ask and q:
     try:
-        with st.spinner("Thinking…"):
-            ans, ctx = answer(q)
-        st.session_state.chat_answer = ans
-        st.session_state.chat_ctx = ctx
+        with timing_scope() as spans:
+            t0 = time.perf_counter()
+            with st.spinner("Searching your materials…"):
+                stream, ctx = answer_stream(q, course)
+            st.session_state.chat_ctx = ctx
+            # citations are known as soon as retrieval finishes — show them before the answer
+            st.caption("Sources: " + ", ".join(f"{c['source']} #{c['chunk']}" for c in ctx))
+            if ctx and ctx[0].get("cached"):
+                st.caption(f"⚡ Cached answer to a similar question: “{ctx[0]['cached_query']}”")
+            ttft_box = st.empty()
+            st.session_state.chat_answer = st.write_stream(timed(stream, t0, ttft_box))
+        st.session_state.chat_timings = list(spans)
+        show_ctx(ctx)
+        show_timings(spans)
     except Exception as e:
         import traceback
         st.error(f"❌ Error while answering: {e}")
         st.code(traceback.format_exc())
 
 # Show result if present
-if st.session_state.chat_answer:
+elif st.session_state.chat_answer:
     st.markdown(st.session_state.chat_answer)
-    with st.expander("Show context chunks"):
-        for c in st.session_state.chat_ctx:
-            st.write(f"- **{c['source']}** (#{c['chunk']})")
-            st.write((c['text'][:600] + '…') if len(c['text'])>600 else c['text'])
+    show_ctx(st.session_state.chat_ctx)
+    show_timings(st.session_state.chat_timings)
 
 # --- 📝 Quiz Generator (MCQ only) ---
 st.subheader("Quiz Generator")
@@ -83,6 +141,8 @@ if "quiz_results" not in st.session_state:
     st.session_state.quiz_results = {}
 if "quiz_preview" not in st.session_state:
     st.session_state.quiz_preview = False  # Preview toggle state
+if "quiz_seen" not in st.session_state:
+    st.session_state.quiz_seen = {}        # course -> bank question ids already served this session
 
 with st.form("quiz_setup_form", clear_on_submit=False):
     c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
@@ -101,8 +161,10 @@ if gen:
         st.warning("Please enter a topic or chapter.")
     else:
         try:
-            with st.spinner("Generating Quiz"):
-                quiz = make_quiz(topic, n=int(n), difficulty=diff)
+            with st.spinner("Generating Quiz"), timing_scope() as spans:
+                quiz = make_quiz(topic, n=int(n), difficulty=diff, course=course,
+                                 seen=st.session_state.quiz_seen.setdefault(course, set()))
+            st.session_state.quiz_timings = list(spans)
             # force MCQ only and optionally shuffle choices
             import random
             filtered = []
@@ -121,6 +183,7 @@ if gen:
 
 quiz = st.session_state.quiz_data
 if quiz and quiz.get("questions"):
+    show_timings(st.session_state.get("quiz_timings"))
     st.markdown("### Take the quiz")
 
     # Top row: Preview toggle only (no extra options)
@@ -0,0 +1,317 @@
+# bench.py — offline end-to-end benchmarks (no network: OpenAI is replaced by fake_openai.py)
+#
+#   python bench.py --sizes 1k 10k 100k [--out data/bench/results.json] [--baseline old.json]
+#
+# For each corpus size a synthetic course is written to a scratch data directory: Markdown
+# files whose sections are short enough to become exactly one chunk each, with sentences drawn
+# from per-topic vocabularies so that topical queries have a right answer. A fresh process
+# ingests it (read -> chunk -> embed -> write, BM25 and IVF as configured) and a second fresh
+# process loads the index and runs queries, so each peak RSS belongs to one stage only.
+# Another fresh process measures cold start: process start -> first answer (tracing.milestone).
+# Results go to one JSON file; --baseline compares against an earlier one.
+import os, sys, json, time, shutil, platform, subprocess, tempfile
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+APP = Path(__file__).resolve().parent
+OUT_PATH = APP / "data" / "bench" / "results.json"
+CHUNKS_PER_FILE = 2000
+REGRESSION = 0.20   # --baseline flags metrics that got this much worse
+
+# --- synthetic corpus
+
+_SYL = ["ka", "lo", "mi", "ra", "te", "vu", "sen", "dor", "pha", "qui", "zel", "bro", "tan", "gim", "ox", "ul"]
+
+def _vocab(n: int, rng) -> np.ndarray:
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(_SYL, rng.integers(2, 5))))
+    return np.array(sorted(words))
+
+def _topics(n_chunks: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vocab = _vocab(20000, rng)
+    n_topics = max(8, n_chunks // 200)
+    # each topic draws from its own 80 words plus a shared pool of 400 common words
+    common = vocab[:400]
+    own = [vocab[400 + rng.choice(len(vocab) - 400, 80, replace=False)] for _ in range(n_topics)]
+    return rng, common, own
+
+def _sentence(rng, common, own) -> str:
+    n = int(rng.integers(6, 14))
+    pick = np.where(rng.random(n) < 0.6, own[rng.integers(0, len(own), n)], common[rng.integers(0, len(common), n)])
+    return " ".join(pick).capitalize() + "."
+
+def write_corpus(src: Path, n_chunks: int, words_per_chunk: int, seed: int = 0) -> Dict:
+    """n_chunks Markdown sections of ~words_per_chunk words over CHUNKS_PER_FILE-section files.
+
+    The topic of every section is saved beside src as topics.npy (see _note_id).
+    """
+    rng, common, own = _topics(n_chunks, seed)
+    src.mkdir(parents=True, exist_ok=True)
+    n_bytes, topic_of = 0, np.empty(n_chunks, dtype=np.int32)
+    for f in range(0, n_chunks, CHUNKS_PER_FILE):
+        parts = []
+        for i in range(f, min(n_chunks, f + CHUNKS_PER_FILE)):
+            t = topic_of[i] = int(rng.integers(0, len(own)))
+            body, words = [], 0
+            while words < words_per_chunk:
+                s = _sentence(rng, common, own[t]); body.append(s); words += s.count(" ") + 1
+            parts.append(f"## Topic {t} note {i}\n\n{' '.join(body)}\n")
+        text = "\n".join(parts)
+        (src / f"course_{f // CHUNKS_PER_FILE:04d}.md").write_text(text, encoding="utf-8")
+        n_bytes += len(text)
+    np.save(src.parent / "topics.npy", topic_of)
+    return {"files": -(-n_chunks // CHUNKS_PER_FILE), "topics": len(own), "mb": n_bytes / 2**20}
+
+def _note_id(hit: Dict) -> int:
+    # course_0003.md chunk 17 -> section 3 * CHUNKS_PER_FILE + 17 (one chunk per section)
+    return int(hit["source"][7:11]) * CHUNKS_PER_FILE + int(hit["chunk"])
+
+def queries(n_chunks: int, n: int, seed: int = 0) -> List[Dict]:
+    """[{"q", "topic"}]: a few words of one topic's vocabulary, like a short student question."""
+    _, common, own = _topics(n_chunks, seed)
+    rng = np.random.default_rng(seed + 1)
+    out = []
+    for _ in range(n):
+        t = int(rng.integers(0, len(own)))
+        words = list(own[t][rng.choice(len(own[t]), int(rng.integers(3, 7)), replace=False)])
+        out.append({"q": "what is " + " ".join(words), "topic": t})
+    return out
+
+# --- measurements (run in worker processes)
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / 2**20 if sys.platform == "darwin" else r / 2**10   # bytes on macOS, KiB on Linux
+
+def _pcts(ms: List[float]) -> Dict:
+    return {"p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99)),
+            "mean_ms": float(np.mean(ms))}
+
+def _setup(root: Path, args):
+    """Point the app's paths and OpenAI client at the scratch root and the fake."""
+    import ingest, courses, fake_openai
+    courses.DATA = root   # default course: root/sources -> root/simple
+    ingest.EXTRACT_CACHE = root / "cache" / "extract"
+    return fake_openai.install(dim=args.dim, embed_latency_ms=args.embed_latency_ms,
+                               embed_item_ms=args.embed_item_ms, chat_latency_ms=args.chat_latency_ms,
+                               chat_token_ms=args.chat_token_ms)
+
+def stage_ingest(root: Path, args) -> Dict:
+    fake = _setup(root, args)
+    import ingest, store, courses
+    t0 = time.perf_counter()
+    ingest.upsert_files()
+    dt = time.perf_counter() - t0
+    man = ingest.load_manifest()
+    rows = man["rows"]
+    vdir = store.current_dir(courses.index_root())
+    disk = sum(p.stat().st_size for p in vdir.iterdir() if p.is_file())
+    return {"rows": rows, "seconds": dt, "chunks_per_s": rows / dt if dt else 0.0,
+            "segments": len(store.segment_headers(man)), "ann": bool(man.get("ann")),
+            "embed_requests": fake.embeddings.calls, "index_mb": disk / 2**20,
+            "peak_rss_mb": peak_rss_mb()}
+
+def stage_query(root: Path, args) -> Dict:
+    _setup(root, args)
+    import rag
+    qs = queries(args.chunks, args.queries)
+    topic_of = np.load(root / "topics.npy")
+    t0 = time.perf_counter()
+    idx = rag._load_index()
+    load_s = time.perf_counter() - t0
+    rss_loaded = peak_rss_mb()
+    rag._embed_queries([x["q"] for x in qs])   # query embedding is measured by ingest; keep it out
+    out = {"load_s": load_s, "rows": len(idx), "ivf": idx.ivf is not None,
+           "bm25": idx.bm25 is not None, "peak_rss_loaded_mb": rss_loaded}
+    for name, exact in (("retrieve", False), ("retrieve_exact", True)):
+        ms, on_topic = [], []
+        for x in qs:
+            t = time.perf_counter()
+            hits = rag.retrieve(x["q"], k=args.k, exact=exact)
+            ms.append((time.perf_counter() - t) * 1e3)
+            on_topic.append(np.mean([topic_of[_note_id(h)] == x["topic"] for h in hits]) if hits else 0.0)
+        out[name] = {**_pcts(ms), "on_topic": float(np.mean(on_topic))}
+    if args.answers:
+        ms = []
+        for x in qs[:args.answers]:
+            t = time.perf_counter()
+            rag.answer(x["q"])
+            ms.append((time.perf_counter() - t) * 1e3)
+        out["answer"] = _pcts(ms)
+    out["peak_rss_mb"] = peak_rss_mb()
+    return out
+
+def stage_coldstart(root: Path, args) -> Dict:
+    """Process start -> first answer, the way the app starts: preload the index, then a question."""
+    import tracing
+    _setup(root, args)
+    import rag
+    imported = time.time() - tracing.STARTED
+    rag.preload()
+    rag.answer(args.question)
+    return {"import_s": imported, "first_answer_s": tracing.MILESTONES["first_answer"],
+            "index_ready_s": tracing.MILESTONES.get("index_ready"), "peak_rss_mb": peak_rss_mb()}
+
+# --- driver
+
+def _size(s: str) -> int:
+    s = s.lower()
+    mult = {"k": 1000, "m": 1000000}.get(s[-1], 1)
+    return int(float(s.rstrip("km")) * mult)
+
+def _worker_env(root: Path, args) -> Dict:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "sk-offline",
+        "EMBED_CACHE_PATH": str(root / "cache" / "embeddings.sqlite"),
+        "ANSWER_CACHE_PATH": str(root / "cache" / "answers.sqlite"),
+        "ANSWER_CACHE_MAX": "0",            # every answer() goes through retrieval + chat
+        "QUIZ_BANK_PATH": str(root / "cache" / "quiz_bank.sqlite"),
+        "TRACE_PATH": str(root / "traces" / "trace.jsonl"),
+        "CHUNK_TOKENS": str(args.chunk_tokens),
+        "CHUNK_OVERLAP": "0",
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+def _run_stage(stage: str, root: Path, args) -> Dict:
+    out = root / f"{stage}.json"
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--stage", stage, "--root", str(root),
+           "--chunks", str(args.chunks), "--question", queries(args.chunks, 1)[0]["q"]] + args.passthrough
+    log = open(root / f"{stage}.log", "w", encoding="utf-8")
+    try:
+        rc = subprocess.run(cmd, env=_worker_env(root, args), cwd=str(APP), stdout=log, stderr=subprocess.STDOUT).returncode
+    finally:
+        log.close()
+    if rc != 0 or not out.exists():
+        raise RuntimeError(f"{stage} stage failed for {args.chunks} chunks; see {root / (stage + '.log')}")
+    return json.loads(out.read_text(encoding="utf-8"))
+
+def run(args) -> Dict:
+    results = []
+    for n in args.sizes:
+        root = Path(tempfile.mkdtemp(prefix=f"bench{n}_", dir=args.workdir))
+        try:
+            print(f"[{n:,} chunks] writing corpus …", flush=True)
+            t0 = time.perf_counter()
+            corpus = write_corpus(root / "sources", n, args.chunk_tokens // 4)
+            corpus["write_s"] = time.perf_counter() - t0
+            args.chunks = n
+            print(f"[{n:,} chunks] ingest …", flush=True)
+            ing = _run_stage("ingest", root, args)
+            print(f"[{n:,} chunks] {ing['chunks_per_s']:,.0f} chunks/s, peak {ing['peak_rss_mb'] or 0:.0f} MB; "
+                  f"queries …", flush=True)
+            cold = _run_stage("coldstart", root, args)
+            qry = _run_stage("query", root, args)
+            results.append({"chunks": n, "corpus": corpus, "ingest": ing, "coldstart": cold, "query": qry})
+            print(f"[{n:,} chunks] first answer {cold['first_answer_s']:.2f}s after start, "
+                  f"load {qry['load_s'] * 1e3:.0f} ms, retrieve p50 "
+                  f"{qry['retrieve']['p50_ms']:.1f} ms p99 {qry['retrieve']['p99_ms']:.1f} ms", flush=True)
+        finally:
+            if args.keep: print(f"   kept {root}")
+            else: shutil.rmtree(root, ignore_errors=True)
+    return {
+        "ts": time.time(),
+        "host": {"python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {"dim": args.dim, "chunk_tokens": args.chunk_tokens, "k": args.k, "queries": args.queries,
+                   "embed_latency_ms": args.embed_latency_ms, "embed_item_ms": args.embed_item_ms,
+                   "chat_latency_ms": args.chat_latency_ms, "chat_token_ms": args.chat_token_ms,
+                   "env": {k: os.environ[k] for k in ("INDEX_DTYPE", "SEGMENT_ROWS", "ANN_MIN_ROWS",
+                           "ANN_NPROBE", "HYBRID_SEARCH", "EMBED_CONCURRENCY") if k in os.environ}},
+        "results": results,
+    }
+
+# lower is better unless listed in HIGHER
+METRICS = ["ingest.chunks_per_s", "ingest.peak_rss_mb", "coldstart.first_answer_s", "query.load_s", "query.peak_rss_mb",
+           "query.retrieve.p50_ms", "query.retrieve.p99_ms", "query.retrieve_exact.p50_ms",
+           "query.retrieve_exact.p99_ms", "query.retrieve.on_topic"]
+HIGHER = {"ingest.chunks_per_s", "query.retrieve.on_topic"}
+
+def _get(d: Dict, path: str):
+    for k in path.split("."):
+        d = d.get(k) if isinstance(d, dict) else None
+    return d
+
+def compare(new: Dict, old: Dict) -> List[Dict]:
+    base = {r["chunks"]: r for r in old.get("results", [])}
+    rows = []
+    for r in new["results"]:
+        b = base.get(r["chunks"])
+        if b is None: continue
+        for m in METRICS:
+            x, y = _get(r, m), _get(b, m)
+            if not isinstance(x, (int, float)) or not isinstance(y, (int, float)) or not y:
+                continue
+            change = (x - y) / y
+            worse = -change if m in HIGHER else change
+            rows.append({"chunks": r["chunks"], "metric": m, "old": y, "new": x, "change": change,
+                         "regression": worse > REGRESSION})
+    return rows
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Offline ingest/retrieve benchmarks on synthetic corpora")
+    ap.add_argument("--sizes", nargs="+", default=["1k", "10k", "100k"], help="corpus sizes in chunks (1k .. 1m)")
+    ap.add_argument("--out", default=str(OUT_PATH), help="results JSON")
+    ap.add_argument("--baseline", help="earlier results JSON to compare against (exit 1 on regressions)")
+    ap.add_argument("--workdir", help="scratch directory for corpora and indexes (default: system temp)")
+    ap.add_argument("--keep", action="store_true", help="keep the scratch data directories")
+    ap.add_argument("--json", action="store_true", help="print the results JSON to stdout")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--answers", type=int, default=20, help="answer() calls timed with the fake chat model")
+    ap.add_argument("-k", type=int, default=8)
+    ap.add_argument("--dim", type=int, default=256, help="fake embedding dimension")
+    ap.add_argument("--chunk-tokens", type=int, default=160)
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0, help="fake latency per embeddings request")
+    ap.add_argument("--embed-item-ms", type=float, default=0.0, help="fake latency per embedded text")
+    ap.add_argument("--chat-latency-ms", type=float, default=0.0, help="fake time to first token")
+    ap.add_argument("--chat-token-ms", type=float, default=0.0, help="fake latency per generated token")
+    # worker-process mode (internal)
+    ap.add_argument("--stage", choices=["ingest", "coldstart", "query"], help=argparse.SUPPRESS)
+    ap.add_argument("--root", help=argparse.SUPPRESS)
+    ap.add_argument("--chunks", type=int, default=0, help=argparse.SUPPRESS)
+    ap.add_argument("--question", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.stage:
+        root = Path(args.root)
+        res = {"ingest": stage_ingest, "coldstart": stage_coldstart, "query": stage_query}[args.stage](root, args)
+        (root / f"{args.stage}.json").write_text(json.dumps(res), encoding="utf-8")
+        sys.exit(0)
+
+    args.sizes = [_size(s) for s in args.sizes]
+    args.passthrough = ["--queries", str(args.queries), "--answers", str(args.answers), "-k", str(args.k),
+                        "--dim", str(args.dim), "--chunk-tokens", str(args.chunk_tokens),
+                        "--embed-latency-ms", str(args.embed_latency_ms), "--embed-item-ms", str(args.embed_item_ms),
+                        "--chat-latency-ms", str(args.chat_latency_ms), "--chat-token-ms", str(args.chat_token_ms)]
+    res = run(args)
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(res, indent=1), encoding="utf-8")
+    if args.json:
+        print(json.dumps(res, indent=1))
+    print(f"\n{'chunks':>9} {'ingest/s':>9} {'ingest MB':>9} {'cold s':>7} {'load ms':>8} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'exact p99':>9} {'query MB':>8} {'on-topic':>8}")
+    for r in res["results"]:
+        i, q = r["ingest"], r["query"]
+        print(f"{r['chunks']:>9,} {i['chunks_per_s']:>9,.0f} {i['peak_rss_mb'] or 0:>9.0f} "
+              f"{r['coldstart']['first_answer_s']:>7.2f} {q['load_s'] * 1e3:>8.1f} "
+              f"{q['retrieve']['p50_ms']:>7.2f} {q['retrieve']['p99_ms']:>7.2f} {q['retrieve_exact']['p99_ms']:>9.2f} "
+              f"{q['peak_rss_mb'] or 0:>8.0f} {q['retrieve']['on_topic']:>8.0%}")
+    print(f"Saved: {out}")
+    if args.baseline:
+        rows = compare(res, json.loads(Path(args.baseline).read_text(encoding="utf-8")))
+        bad = [r for r in rows if r["regression"]]
+        for r in rows:
+            flag = "  REGRESSION" if r["regression"] else ""
+            print(f"{r['chunks']:>9,} {r['metric']:<30} {r['old']:>10.2f} -> {r['new']:>10.2f} "
+                  f"({r['change']:+.0%}){flag}")
+        sys.exit(1 if bad else 0)
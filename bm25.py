@@ -0,0 +1,177 @@
+# bm25.py — sparse lexical (BM25) index over the segments of a store.Index
+#
+# Postings are built per segment (segments are immutable), so a reindex only tokenizes
+# the new segments. Terms are stored as 64-bit hashes; per segment <seg>:
+#   bm25terms.<seg>.npy  [T] int64 sorted term hashes
+#   bm25offs.<seg>.npy   [T+1] int64 posting-list boundaries (CSR)
+#   bm25docs.<seg>.npy   [P] int32 segment-local row ids, ascending within a term
+#   bm25tf.<seg>.npy     [P] float32 term frequencies
+#   bm25len.<seg>.npy    [n] float32 document lengths in tokens
+# Document frequencies and the average length are summed across segments at load time,
+# so scores are those of one index over all rows (tombstoned rows included).
+import os, re, hashlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+import store
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[._'-][a-z0-9]+)*")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words; keeps dotted/hyphenated terms (l2-norm, f1-score, e.g. 3.14) whole."""
+    return _TOKEN.findall(text.lower())
+
+def _hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+def _files(outdir: Path, seg: str) -> Dict[str, Path]:
+    return {k: outdir / f"bm25{k}.{seg}.npy" for k in ("terms", "offs", "docs", "tf", "len")}
+
+def has_segment(outdir: Path, seg: str) -> bool:
+    return all(p.exists() for p in _files(outdir, seg).values())
+
+def build_segment(outdir: Path, seg: str, texts: Iterable[str]):
+    """Tokenize one segment's texts and write its postings."""
+    toks, lens = [], []
+    for text in texts:
+        t = tokenize(text)
+        toks.extend(t); lens.append(len(t))
+    vocab = {t: i for i, t in enumerate(dict.fromkeys(toks))}
+    tids = np.fromiter(map(vocab.__getitem__, toks), dtype=np.int64, count=len(toks))
+    dids = np.repeat(np.arange(len(lens), dtype=np.int64), lens)
+    # (term, doc) pairs -> term frequencies; sort terms by hash so queries can binary-search
+    hashes = np.array([_hash(t) for t in vocab], dtype=np.int64)
+    rank = np.empty(len(hashes), dtype=np.int64)
+    rank[np.argsort(hashes)] = np.arange(len(hashes))
+    pairs, tf = np.unique(rank[tids] * max(len(lens), 1) + dids, return_counts=True)
+    trank, docs = np.divmod(pairs, max(len(lens), 1))
+    counts = np.bincount(trank, minlength=len(hashes))
+    arrays = {
+        "terms": np.sort(hashes),
+        "offs": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "docs": docs.astype(np.int32),
+        "tf": tf.astype(np.float32),
+        "len": np.asarray(lens, dtype=np.float32),
+    }
+    # lengths last: has_segment() only sees complete postings
+    for key in ("terms", "offs", "docs", "tf", "len"):
+        with open(_files(outdir, seg)[key], "wb") as f:
+            np.save(f, arrays[key])
+
+class BM25:
+    """Read-only BM25 scorer over the postings of every segment of an index."""
+
+    def __init__(self, parts: List[Dict[str, np.ndarray]], bounds: np.ndarray,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.parts, self.bounds, self.k1, self.b = parts, bounds, k1, b
+        self.n = int(bounds[-1])
+        total = sum(float(p["len"].sum()) for p in parts)
+        self.avgdl = total / self.n if self.n else 1.0
+        # per-segment length normalisation, precomputed: k1 * (1 - b + b * len / avgdl)
+        self._norm = [k1 * (1 - b + b * p["len"] / max(self.avgdl, 1e-9)) for p in parts]
+
+    @classmethod
+    def load(cls, outdir: Path, idx) -> "BM25 | None":
+        """Postings for every segment of idx (a store.Index), or None if any are missing."""
+        hdrs = store.segment_headers(idx.manifest)
+        if not hdrs or len(hdrs) != len(idx.segments):
+            return None
+        parts = []
+        for h in hdrs:
+            if not has_segment(outdir, h["name"]):
+                return None
+            f = _files(outdir, h["name"])
+            parts.append({k: np.load(p, mmap_mode="r") for k, p in f.items()})
+        return cls(parts, idx.bounds)
+
+    def _lookup(self, hashes: np.ndarray):
+        """Per segment (term positions, found mask) of the query term hashes."""
+        out = []
+        for p in self.parts:
+            terms = p["terms"]
+            pos = np.searchsorted(terms, hashes)
+            pos = np.minimum(pos, max(len(terms) - 1, 0))
+            found = (terms[pos] == hashes) if len(terms) else np.zeros(len(hashes), dtype=bool)
+            out.append((pos, found))
+        return out
+
+    def _postings(self, query: str, ranges: List[Tuple[int, int]] | None = None):
+        """(rows, contributions): one entry per posting of a query term, only for rows inside
+        ranges [(a, b), ...] when given. Document frequencies stay index-wide either way."""
+        toks = list(dict.fromkeys(tokenize(query)))
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if not toks or not self.n:
+            return empty
+        hashes = np.array([_hash(t) for t in toks], dtype=np.int64)
+        where = self._lookup(hashes)
+        df = np.zeros(len(hashes), dtype=np.float64)
+        for p, (pos, found) in zip(self.parts, where):
+            df += np.where(found, p["offs"][pos + 1] - p["offs"][pos], 0)
+        idf = np.log1p((self.n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        rows, vals = [], []
+        for s, (p, (pos, found)) in enumerate(zip(self.parts, where)):
+            lo, hi = int(self.bounds[s]), int(self.bounds[s + 1])
+            if ranges is not None:
+                # the filter's rows as segment-local [start, stop) bounds
+                local = np.array([(max(a, lo) - lo, min(b, hi) - lo) for a, b in ranges if a < hi and b > lo],
+                                 dtype=np.int64).reshape(-1, 2)
+                if not len(local):
+                    continue
+            spans = []
+            for t, (i, ok) in enumerate(zip(pos, found)):
+                if not ok:
+                    continue
+                a, b = int(p["offs"][i]), int(p["offs"][i + 1])
+                if ranges is None:
+                    spans.append((a, b, idf[t])); continue
+                # docs ascend within a term: binary-search each range instead of scanning the list
+                docs = p["docs"][a:b]
+                starts, stops = np.searchsorted(docs, local[:, 0]), np.searchsorted(docs, local[:, 1])
+                spans += [(a + int(x), a + int(y), idf[t]) for x, y in zip(starts, stops) if x < y]
+            if not spans:
+                continue
+            docs = np.concatenate([p["docs"][a:b] for a, b, _ in spans])
+            tf = np.concatenate([p["tf"][a:b] for a, b, _ in spans])
+            w = np.concatenate([np.full(b - a, v, dtype=np.float32) for a, b, v in spans])
+            rows.append(docs.astype(np.int64) + lo)
+            vals.append(w * tf * (self.k1 + 1) / (tf + self._norm[s][docs]))
+        if not rows:
+            return empty
+        return np.concatenate(rows), np.concatenate(vals)
+
+    def scores(self, query: str) -> np.ndarray:
+        """[N] BM25 score of every row for query (0 where no term matches)."""
+        rows, vals = self._postings(query)
+        return np.bincount(rows, weights=vals, minlength=self.n).astype(np.float32)
+
+    def search(self, query: str, k: int, dead: np.ndarray | None = None,
+               ranges: List[Tuple[int, int]] | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, scores) of the best k rows with a positive score, best first; only rows
+        inside ranges [(a, b), ...] when given (then dead is not needed, and the work is
+        proportional to the matching postings inside the ranges, not to the index size)."""
+        if ranges is not None:
+            rows, vals = self._postings(query, ranges)
+            cand, inv = np.unique(rows, return_inverse=True)
+            s = np.bincount(inv, weights=vals, minlength=len(cand)).astype(np.float32)
+        else:
+            s = self.scores(query)
+            if dead is not None and len(dead):
+                s[dead] = 0.0
+            cand = None   # positions in s are row ids
+        keep = np.flatnonzero(s > 0)
+        if keep.size > k:
+            keep = keep[np.argpartition(-s[keep], k - 1)[:k]]
+        keep = keep[np.argsort(-s[keep], kind="stable")]
+        return (keep if cand is None else cand[keep]), s[keep]
+
+def build_missing(outdir: Path, idx) -> int:
+    """Write postings for the segments of idx that have none; returns how many were built."""
+    built = 0
+    for h, seg in zip(store.segment_headers(idx.manifest), idx.segments):
+        if not has_segment(outdir, h["name"]):
+            build_segment(outdir, h["name"], (seg.meta(j)["text"] for j in range(len(seg))))
+            built += 1
+    return built
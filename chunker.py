@@ -0,0 +1,160 @@
+# chunker.py — streaming, token-budgeted chunking with pluggable strategies
+#
+# Input is a list of "units" from extraction: {"text": ...} plus optional "page"
+# (PDF) or "section" (Markdown heading path). Sentences are packed greedily
+# until the next one would exceed max_tokens; the last sentences (up to `overlap`
+# tokens) are carried into the next chunk. Each sentence is tokenized once, so
+# the whole pass is linear in the input size and there is no document size cap.
+import re
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List
+from utils import get_encoding
+
+_SENT_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+def iter_sentences(text: str) -> Iterator[str]:
+    pos = 0
+    for m in _SENT_END.finditer(text):
+        s = text[pos:m.start()].strip()
+        if s: yield s
+        pos = m.end()
+    s = text[pos:].strip()
+    if s: yield s
+
+def _tokens(s: str) -> int:
+    # counted with a leading space, the way the sentence appears inside a joined chunk,
+    # so the sum over a chunk is an upper bound on the chunk's real token count
+    enc = get_encoding()
+    if enc is None:
+        return max(1, (len(s) + 1) // 4)
+    return len(enc.encode(" " + s, disallowed_special=()))
+
+def _split_long(s: str, max_tokens: int) -> Iterator[str]:
+    """Pieces of a single sentence that alone exceeds the budget."""
+    enc = get_encoding()
+    if enc is None:
+        step = max_tokens * 4
+        for i in range(0, len(s), step):
+            yield s[i:i+step]
+        return
+    ids = enc.encode(s, disallowed_special=())
+    step = max(1, max_tokens - 1)
+    for i in range(0, len(ids), step):
+        yield enc.decode(ids[i:i+step]).strip()
+
+class _Packer:
+    """Greedy sentence packer shared by all strategies."""
+
+    def __init__(self, max_tokens: int, overlap: int):
+        self.max_tokens, self.overlap = max_tokens, overlap
+        self.buf = deque()      # (sentence, tokens, attrs)
+        self.tok = 0
+        self.fresh = 0          # sentences added since the last flush (excludes overlap)
+
+    def add(self, sent: str, attrs: Dict) -> Iterator[Dict]:
+        n = _tokens(sent)
+        if n > self.max_tokens:
+            for piece in _split_long(sent, self.max_tokens):
+                if piece: yield from self.add(piece, attrs)
+            return
+        if self.buf and self.tok + n > self.max_tokens:
+            yield from self.flush(keep_overlap=True)
+        self.buf.append((sent, n, attrs)); self.tok += n; self.fresh += 1
+
+    def flush(self, keep_overlap: bool = False) -> Iterator[Dict]:
+        if not self.fresh:
+            self.buf.clear(); self.tok = 0
+            return
+        chunk = {"text": " ".join(s for s, _, _ in self.buf), "tokens": self.tok}
+        first, last = self.buf[0][2], self.buf[-1][2]
+        if "section" in first: chunk["section"] = first["section"]
+        if "page" in first:
+            chunk["page"] = first["page"]
+            chunk["page_end"] = last.get("page", first["page"])
+        yield chunk
+        self.fresh = 0
+        if not keep_overlap or not self.overlap:
+            self.buf.clear(); self.tok = 0
+            return
+        # keep whole trailing sentences worth at most `overlap` tokens
+        keep, t = deque(), 0
+        while len(self.buf) > 1 and t + self.buf[-1][1] <= self.overlap:
+            item = self.buf.pop(); keep.appendleft(item); t += item[1]
+        self.buf, self.tok = keep, t
+        # overlap that cannot fit with a new sentence would only produce duplicates
+        if self.tok >= self.max_tokens:
+            self.buf.clear(); self.tok = 0
+
+# --- strategies: units -> chunk dicts
+
+def chunk_sentences(units: Iterable[Dict], max_tokens: int, overlap: int) -> Iterator[Dict]:
+    """Plain text: chunks run across unit boundaries."""
+    pk = _Packer(max_tokens, overlap)
+    for u in units:
+        for s in iter_sentences(u.get("text") or ""):
+            yield from pk.add(s, {})
+    yield from pk.flush()
+
+def chunk_pages(units: Iterable[Dict], max_tokens: int, overlap: int) -> Iterator[Dict]:
+    """PDF: chunks may span pages and record page .. page_end."""
+    pk = _Packer(max_tokens, overlap)
+    for u in units:
+        attrs = {"page": u["page"]} if "page" in u else {}
+        for s in iter_sentences(u.get("text") or ""):
+            yield from pk.add(s, attrs)
+    yield from pk.flush()
+
+def chunk_markdown(units: Iterable[Dict], max_tokens: int, overlap: int) -> Iterator[Dict]:
+    """Markdown: never cross a heading; every chunk carries its section path."""
+    pk, section = _Packer(max_tokens, overlap), None
+    for u in units:
+        if u.get("section") != section:
+            yield from pk.flush()
+            section = u.get("section")
+        attrs = {"section": section} if section else {}
+        for s in iter_sentences(u.get("text") or ""):
+            yield from pk.add(s, attrs)
+    yield from pk.flush()
+
+STRATEGIES: Dict[str, Callable[..., Iterator[Dict]]] = {
+    "sentence": chunk_sentences,
+    "page": chunk_pages,
+    "markdown": chunk_markdown,
+}
+
+def strategy_for(name: str) -> str:
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    return {"pdf": "page", "md": "markdown", "markdown": "markdown"}.get(ext, "sentence")
+
+def chunk_units(units: Iterable[Dict], strategy: str = "sentence",
+                max_tokens: int = 300, overlap: int = 50) -> List[Dict]:
+    return list(STRATEGIES[strategy](units, max_tokens, overlap))
+
+if __name__ == "__main__":
+    import argparse, random, time
+    ap = argparse.ArgumentParser(description="Chunker micro-benchmark on synthetic text")
+    ap.add_argument("--mb", type=float, default=8.0, help="input size in MB")
+    ap.add_argument("--strategy", default="sentence", choices=sorted(STRATEGIES))
+    ap.add_argument("--max-tokens", type=int, default=300)
+    ap.add_argument("--overlap", type=int, default=50)
+    args = ap.parse_args()
+
+    rnd = random.Random(0)
+    words = ("gradient descent loss function matrix vector neuron layer regression model "
+             "probability estimate variance bias sample training data feature weight").split()
+    target, parts, size = int(args.mb * 2**20), [], 0
+    while size < target:
+        s = " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 30))).capitalize() + rnd.choice(".!?")
+        parts.append(s); size += len(s) + 1
+    text = " ".join(parts)
+    units = [{"text": text[i:i+40_000], "page": n + 1, "section": f"Part {n // 10}"}
+             for n, i in enumerate(range(0, len(text), 40_000))]
+
+    enc = "tiktoken" if get_encoding() else "len//4 estimate (tiktoken unavailable)"
+    t0 = time.perf_counter()
+    chunks = chunk_units(units, args.strategy, args.max_tokens, args.overlap)
+    dt = time.perf_counter() - t0
+    over = sum(1 for c in chunks if c["tokens"] > args.max_tokens)
+    print(f"{len(text)/2**20:.1f} MB, strategy={args.strategy}, tokens={enc}")
+    print(f"{len(chunks)} chunks in {dt:.2f}s -> {len(chunks)/dt:,.0f} chunks/s, {len(text)/2**20/dt:.1f} MB/s")
+    print(f"mean {sum(c['tokens'] for c in chunks)/len(chunks):.0f} tokens/chunk, {over} over budget")
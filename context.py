@@ -0,0 +1,139 @@
+# context.py — token-budgeted prompt context from retrieved chunks
+#
+# select() picks hits by maximal marginal relevance, each pick maximizing
+#     lam * rel(chunk) - (1 - lam) * max cos(chunk, already picked),
+# and skips any chunk that would overflow the token budget. rel falls linearly from 1 to 0
+# down the order retrieval returned (the RRF fusion of dense and BM25 ranks when hybrid):
+# re-scoring by query cosine would bury exact-term hits that only BM25 found. A chunk next to one already
+# picked (same source, chunk number +-1) only costs the text past their shared overlap
+# (the chunker repeats the last CHUNK_OVERLAP tokens of whole sentences).
+# render() turns runs of adjacent picked chunks into one block with the overlap removed,
+# cited as (source #first-last). The rendered text is checked against the budget with
+# tiktoken (utils.count_tokens).
+import os
+from typing import Dict, List
+import numpy as np
+from utils import count_tokens, get_encoding
+
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))   # 1 = relevance only, 0 = diversity only
+_PROBE = 32   # overlaps shorter than this many characters are not stripped
+
+def overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of a that is also a prefix of b (0 if under _PROBE chars)."""
+    n = min(len(a), len(b))
+    if n < _PROBE:
+        return 0
+    probe = b[:_PROBE]
+    i = a.find(probe, len(a) - n)
+    while i != -1:                 # the first match is the longest overlap
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(probe, i + 1)
+    return 0
+
+def _key(h: Dict):
+    return h.get("source"), h.get("chunk")
+
+def _neighbours(h: Dict, by_key: Dict) -> List[Dict]:
+    src, c = _key(h)
+    if not isinstance(c, int):
+        return []
+    return [by_key[k] for k in ((src, c - 1), (src, c + 1)) if k in by_key]
+
+def _new_text(h: Dict, by_key: Dict) -> str:
+    """Text h adds next to the picked chunks in by_key (overlap with its neighbours removed)."""
+    text = h["text"]
+    src, c = _key(h)
+    if not isinstance(c, int):
+        return text
+    prev, nxt = by_key.get((src, c - 1)), by_key.get((src, c + 1))
+    a = overlap(prev["text"], text) if prev else 0
+    b = overlap(text, nxt["text"]) if nxt else 0
+    return text[a:len(text) - b]
+
+def truncate(text: str, max_tokens: int) -> str:
+    enc = get_encoding()
+    if enc is None:
+        return text[:max_tokens * 4]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+
+def _header(h: Dict, i: int) -> str:
+    return f"[{i}] ({h.get('source') or 'unknown'} #{h.get('chunk')}): "
+
+def select(hits: List[Dict], vecs: np.ndarray | None, budget: int,
+           lam: float = MMR_LAMBDA, cite: bool = True) -> List[Dict]:
+    """MMR-ordered subset of hits (best first) whose render(cite=cite) fits in budget tokens.
+
+    vecs [n, D] are the hits' embeddings, for redundancy only; without them the hits are
+    taken in their given order. When not even the best hit fits, it is returned truncated.
+    """
+    if not hits or budget <= 0:
+        return []
+    rel = np.linspace(1.0, 0.0, len(hits)) if len(hits) > 1 else np.ones(1)
+    if vecs is None:
+        sim = np.zeros((len(hits), len(hits)))
+    else:
+        vecs = vecs / (np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12)
+        sim = vecs @ vecs.T
+    left, picked, by_key, used = list(range(len(hits))), [], {}, 0
+    while left:
+        red = sim[np.ix_(left, picked)].max(axis=1) if picked else np.zeros(len(left))
+        order = np.argsort(-(lam * rel[left] - (1 - lam) * red), kind="stable")
+        for j in order:
+            h = hits[left[j]]
+            if _key(h) in by_key:     # the same chunk twice (e.g. a re-added file)
+                cost = 0
+            else:
+                head = _header(h, len(picked) + 1) if cite else ""
+                cost = count_tokens(head + _new_text(h, by_key)) + 1   # + block separator
+            if used + cost <= budget:
+                break
+        else:
+            break                      # nothing left fits
+        i = left.pop(int(j))
+        if cost:
+            picked.append(i); by_key[_key(hits[i])] = hits[i]; used += cost
+    if not picked:
+        h = hits[int(np.argmax(rel))]
+        head = count_tokens(_header(h, 1)) if cite else 0
+        return [{**h, "text": truncate(h["text"], max(1, budget - head - 1))}]
+    out = [hits[i] for i in picked]
+    # per-block estimates can be off by a token or two at the joins: trim to the exact count
+    while len(out) > 1 and count_tokens(render(out, cite)) > budget:
+        out.pop()
+    return out
+
+def blocks(ctx: List[Dict]) -> List[Dict]:
+    """Runs of adjacent chunks of one source merged into blocks {source, first, last, text},
+    ordered by their best-ranked member."""
+    by_key = {_key(h): h for h in ctx}
+    done, out = set(), []
+    for h in ctx:
+        if _key(h) in done:
+            continue
+        run, todo = {}, [h]
+        while todo:
+            x = todo.pop()
+            if _key(x) in run: continue
+            run[_key(x)] = x
+            todo.extend(_neighbours(x, by_key))
+        members = sorted(run.values(), key=lambda x: x.get("chunk") if isinstance(x.get("chunk"), int) else 0)
+        text = members[0]["text"]
+        for prev, cur in zip(members, members[1:]):
+            cut = overlap(prev["text"], cur["text"])
+            text += cur["text"][cut:] if cut else " " + cur["text"]
+        done.update(run)
+        out.append({"source": h.get("source"), "first": members[0].get("chunk"),
+                    "last": members[-1].get("chunk"), "text": text})
+    return out
+
+def render(ctx: List[Dict], cite: bool = True) -> str:
+    """Prompt text: "[i] (source #a-b): text" blocks (or bare texts with cite=False)."""
+    parts = []
+    for i, b in enumerate(blocks(ctx), 1):
+        if not cite:
+            parts.append(b["text"]); continue
+        span = f"{b['first']}" if b["first"] == b["last"] else f"{b['first']}-{b['last']}"
+        parts.append(f"[{i}] ({b['source'] or 'unknown'} #{span}): {b['text']}")
+    return "\n\n".join(parts)
@@ -0,0 +1,40 @@
+# courses.py — course registry: one sources directory and one index per course
+#
+#   data/sources, data/simple                              course "default" (the original layout)
+#   data/courses/<id>/sources, data/courses/<id>/simple    every other course
+#
+# A course id is a directory name: letters, digits, "_", "-" and "." (not leading), at most
+# 64 characters. Paths are resolved on every call from DATA, so a test or benchmark can
+# point the whole app at another data root by setting courses.DATA.
+import re
+from pathlib import Path
+from typing import List
+
+APP = Path(__file__).resolve().parent
+DATA = APP / "data"
+DEFAULT = "default"
+
+_ID = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}")
+
+def check(course: str) -> str:
+    """course if it is a valid id; ValueError otherwise (ids become directory names)."""
+    if not isinstance(course, str) or not _ID.fullmatch(course):
+        raise ValueError(f"Invalid course id {course!r}: use letters, digits, '_', '-' and '.'")
+    return course
+
+def course_dir(course: str = DEFAULT) -> Path:
+    return DATA if check(course) == DEFAULT else DATA / "courses" / course
+
+def sources_dir(course: str = DEFAULT) -> Path:
+    return course_dir(course) / "sources"
+
+def index_root(course: str = DEFAULT) -> Path:
+    """Index root of the course: versioned directories + CURRENT (see store.py)."""
+    return course_dir(course) / "simple"
+
+def list_courses() -> List[str]:
+    """The default course, then every course directory under data/courses, by name."""
+    base = DATA / "courses"
+    found = sorted(p.name for p in base.iterdir()
+                   if p.is_dir() and p.name != DEFAULT and _ID.fullmatch(p.name)) if base.is_dir() else []
+    return [DEFAULT] + found
@@ -0,0 +1,131 @@
+# embed_cache.py — content-addressed embedding store (SQLite)
+import os, sqlite3, hashlib, threading, time
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+
+APP = Path(__file__).resolve().parent
+CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", APP / "data" / "cache" / "embeddings.sqlite"))
+# evict least-recently-used vectors once the store grows past this many bytes
+CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "2048"))
+TOUCH_FLUSH = 50000   # pending access times written in one go once this many accumulate
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Vectors keyed by (model, sha256(text)), stored as float32 blobs."""
+
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = int(CACHE_MAX_MB * 2**20)):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS emb ("
+            " model TEXT NOT NULL, key TEXT NOT NULL, vec BLOB NOT NULL,"
+            " atime REAL NOT NULL, PRIMARY KEY (model, key))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS emb_atime ON emb(atime)")
+        self._db.commit()
+        self._touched: Dict[Tuple[str, str], float] = {}   # (model, key) -> atime not yet written
+
+    def _flush_atimes(self):
+        # caller holds the lock and commits
+        if self._touched:
+            self._db.executemany("UPDATE emb SET atime=? WHERE model=? AND key=?",
+                                 [(t, m, k) for (m, k), t in self._touched.items()])
+            self._touched.clear()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """Return {position in texts: vector} for every cached text."""
+        keys = [text_key(t) for t in texts]
+        found = {}
+        with self._lock:
+            uniq = list(dict.fromkeys(keys))
+            for i in range(0, len(uniq), 500):   # stay under SQLite's variable limit
+                part = uniq[i:i+500]
+                rows = self._db.execute(
+                    f"SELECT key, vec FROM emb WHERE model=? AND key IN ({','.join('?'*len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for k, blob in rows:
+                    found[k] = np.frombuffer(blob, dtype=np.float32)
+            # LRU bookkeeping is written with the next insert or eviction, not per lookup
+            now = time.time()
+            self._touched.update(((model, k), now) for k in found)
+            if len(self._touched) >= TOUCH_FLUSH:
+                self._flush_atimes()
+                self._db.commit()
+        out = {i: found[k] for i, k in enumerate(keys) if k in found}
+        self.hits += len(out)
+        self.misses += len(texts) - len(out)
+        return out
+
+    def put_many(self, model: str, texts: List[str], vecs: np.ndarray):
+        now = time.time()
+        rows = [(model, text_key(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+                for t, v in zip(texts, vecs)]
+        with self._lock:
+            self._flush_atimes()
+            self._db.executemany("INSERT OR REPLACE INTO emb VALUES (?,?,?,?)", rows)
+            self._db.commit()
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM emb").fetchone()[0]
+
+    def evict(self, max_bytes: int | None = None) -> int:
+        """Drop least-recently-used vectors until the store fits in max_bytes."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:   # recent hits must count before picking what to drop
+            self._flush_atimes()
+            self._db.commit()
+        size = self.size_bytes()
+        if size <= limit:
+            return 0
+        removed = 0
+        with self._lock:
+            cur = self._db.execute("SELECT rowid, LENGTH(vec) FROM emb ORDER BY atime")
+            doomed = []
+            for rowid, n in cur:
+                if size <= limit: break
+                doomed.append((rowid,)); size -= n
+            self._db.executemany("DELETE FROM emb WHERE rowid=?", doomed)
+            self._db.commit()
+            removed = len(doomed)
+        return removed
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": entries,
+            "bytes": self.size_bytes(),
+        }
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_cache() -> EmbeddingCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = EmbeddingCache()
+        return _CACHE
+
+if __name__ == "__main__":
+    import sys, json
+    c = get_cache()
+    if "--evict" in sys.argv[1:]:
+        print(f"Evicted {c.evict()} vector(s)")
+    print(json.dumps(c.stats(), indent=1))
@@ -0,0 +1,190 @@
+# embedders.py — embedding providers, chosen by EMBED_PROVIDER
+#
+#   openai   the OpenAI embeddings API (EMBED_MODEL, default text-embedding-3-large)
+#   local    a small sentence-embedding model on this machine's CPU (LOCAL_EMBED_MODEL, default
+#            all-MiniLM-L6-v2, 384 dims) through the optional sentence-transformers package
+#            (pip install sentence-transformers). The model is downloaded once to the Hugging Face
+#            cache, or LOCAL_EMBED_MODEL names a local directory. After that it runs offline.
+#
+# Every provider returns unit float32 rows. Its name keys the embedding cache. The name, the
+# provider and the dimension are also recorded in the index manifest. Vectors of different
+# models are not comparable, so rag refuses an index built by another one, and ingest rebuilds it.
+#
+#   python embedders.py [--providers openai local] [--texts 2000] [--queries 200] [--json out.json]
+#
+# reports ingest throughput (texts/s) and single-query latency per provider.
+import os, threading, time
+from typing import Dict, List
+import numpy as np
+from tracing import NOOP, usage
+from utils import get_client
+import courses
+
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai")                # openai | local
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")      # openai provider
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_THREADS = int(os.getenv("LOCAL_EMBED_THREADS", "0")) or (os.cpu_count() or 1)
+LOCAL_EMBED_BATCH = int(os.getenv("LOCAL_EMBED_BATCH", "64"))         # texts per forward pass
+
+def _unit(arr: np.ndarray) -> np.ndarray:
+    arr /= (np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12)
+    return arr
+
+class OpenAIEmbedder:
+    """The OpenAI embeddings API: large batches, many requests in flight."""
+    provider = "openai"
+    max_batch = 2048        # inputs per request (API limit)
+    max_concurrency = 64    # ingest caps this with EMBED_CONCURRENCY
+
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+        self.name = model   # the cache key from before providers existed: old caches stay valid
+        self.dim = None     # known after the first response
+
+    def embed(self, texts: List[str], sp=NOOP, sdk_retries: bool = True) -> np.ndarray:
+        """[n, D] unit vectors. sdk_retries=False leaves retrying to the caller (ingest)."""
+        api = get_client() if sdk_retries else get_client().with_options(max_retries=0)
+        resp = api.embeddings.create(model=self.model, input=texts)
+        sp.set(**usage(resp))
+        arr = _unit(np.array([d.embedding for d in resp.data], dtype=np.float32))
+        self.dim = arr.shape[1]
+        return arr
+
+class LocalEmbedder:
+    """A sentence-transformers model on the CPU.
+
+    Texts are encoded in batches of LOCAL_EMBED_BATCH on LOCAL_EMBED_THREADS intra-op threads.
+    One encode runs at a time: the model already uses every core, and interleaved encodes only
+    thrash them. Concurrent callers (the server, ingest) therefore queue for it.
+    """
+    provider = "local"
+    max_batch = 256         # texts per ingest batch (cache checkpoint), split into forward passes
+    max_concurrency = 1
+
+    def __init__(self, model: str = LOCAL_EMBED_MODEL):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("EMBED_PROVIDER=local needs sentence-transformers: "
+                               "pip install sentence-transformers") from e
+        torch.set_num_threads(LOCAL_EMBED_THREADS)
+        self.model = model
+        self.name = f"local:{model}"
+        self._m = SentenceTransformer(model, device="cpu")
+        self.dim = self._m.get_sentence_embedding_dimension()
+        self._lock = threading.Lock()
+
+    def embed(self, texts: List[str], sp=NOOP, sdk_retries: bool = True) -> np.ndarray:
+        with self._lock:
+            arr = self._m.encode(list(texts), batch_size=LOCAL_EMBED_BATCH, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False)
+        sp.set(local=True)
+        return np.ascontiguousarray(arr, dtype=np.float32).reshape(len(texts), -1)
+
+PROVIDERS = {"openai": OpenAIEmbedder, "local": LocalEmbedder}
+
+_EMBEDDERS: Dict[str, object] = {}
+_LOCK = threading.Lock()
+
+def get_embedder(provider: str | None = None):
+    """The shared embedder of provider (default EMBED_PROVIDER), created on first use."""
+    provider = provider or EMBED_PROVIDER
+    e = _EMBEDDERS.get(provider)
+    if e is None:
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown EMBED_PROVIDER {provider!r}: use one of {sorted(PROVIDERS)}")
+        with _LOCK:   # a local model loads for seconds: once per process
+            e = _EMBEDDERS.get(provider) or _EMBEDDERS.setdefault(provider, PROVIDERS[provider]())
+    return e
+
+def manifest_fields(emb) -> Dict:
+    return {"embed_model": emb.name, "embed_provider": emb.provider, "embed_dim": emb.dim}
+
+def check_index(manifest: Dict, dim: int, course: str) -> None:
+    """RuntimeError when the index was embedded by a model other than the configured one."""
+    emb = get_embedder()
+    built = manifest.get("embed_model")
+    if (built is None or built == emb.name) and (not emb.dim or not dim or dim == emb.dim):
+        return
+    hint = "" if course == courses.DEFAULT else f" --course {course}"
+    raise RuntimeError(
+        f"Index for course {course!r} was built with embeddings {built or 'of another model'!r} "
+        f"({dim} dims) but EMBED_PROVIDER={emb.provider} uses {emb.name!r} ({emb.dim or '?'} dims). "
+        f"Run `python ingest.py --full{hint}` to rebuild it.")
+
+# --- throughput and query latency per provider
+
+def _sample_texts(n: int, seed: int = 0) -> List[str]:
+    """n chunk-sized texts of random sentences from a small vocabulary."""
+    rng = np.random.default_rng(seed)
+    words = ("gradient descent matrix vector loss neuron layer regression variance bias kernel margin "
+             "entropy tree split probability prior posterior sample estimate error model data").split()
+    return [". ".join(" ".join(rng.choice(words, 12)) for _ in range(int(rng.integers(4, 12))))
+            for _ in range(n)]
+
+def report(providers=("openai", "local"), texts: List[str] | None = None, n_queries: int = 200,
+           concurrency: int | None = None) -> Dict:
+    """Per provider: ingest-style throughput over texts (batches in parallel as ingest runs them,
+    no cache) and the latency of embedding one short query."""
+    from concurrent.futures import ThreadPoolExecutor
+    import ingest
+    texts = texts or _sample_texts(2000)
+    queries = [t.split(".")[0] for t in texts[:n_queries]]
+    out = {"texts": len(texts), "queries": len(queries), "cpus": os.cpu_count(), "runs": []}
+    for p in providers:
+        try:
+            emb = get_embedder(p)
+        except Exception as e:
+            out["runs"].append({"provider": p, "error": str(e)})
+            continue
+        emb.embed(queries[:2])   # warm up (model pages, connection pool)
+        batches = ingest._token_batches(texts, emb.max_batch)
+        workers = min(concurrency or ingest.EMBED_CONCURRENCY, emb.max_concurrency)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            dim = list(ex.map(emb.embed, batches))[0].shape[1]
+        secs = time.perf_counter() - t0
+        ms = []
+        for q in queries:
+            t0 = time.perf_counter()
+            emb.embed([q])
+            ms.append((time.perf_counter() - t0) * 1e3)
+        out["runs"].append({"provider": p, "name": emb.name, "dim": dim, "batches": len(batches),
+                            "workers": workers, "texts_per_s": len(texts) / secs if secs else 0.0,
+                            "query_p50_ms": float(np.percentile(ms, 50)),
+                            "query_p99_ms": float(np.percentile(ms, 99))})
+    return out
+
+if __name__ == "__main__":
+    import argparse, json
+    ap = argparse.ArgumentParser(description="Embedding throughput and query latency per provider")
+    ap.add_argument("--providers", nargs="+", default=["openai", "local"], choices=sorted(PROVIDERS))
+    ap.add_argument("--course", help="embed this course's indexed chunks instead of random sentences")
+    ap.add_argument("--texts", type=int, default=2000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, help="requests in flight (default EMBED_CONCURRENCY)")
+    ap.add_argument("--fake-latency-ms", type=float,
+                    help="measure the openai provider against fake_openai with this latency per request (offline)")
+    ap.add_argument("--json", help="also write the report here")
+    args = ap.parse_args()
+    if args.fake_latency_ms is not None:
+        import fake_openai
+        fake_openai.install(embed_latency_ms=args.fake_latency_ms)
+    texts = None
+    if args.course:
+        import store
+        idx = store.open_index(store.current_dir(courses.index_root(args.course)))
+        texts = [idx.meta(i)["text"] for i in range(min(len(idx), args.texts))]
+    r = report(args.providers, texts or _sample_texts(args.texts), args.queries, args.concurrency)
+    print(f"texts={r['texts']} queries={r['queries']} cpus={r['cpus']}")
+    print(f"{'provider':>8} {'dim':>5} {'workers':>7} {'texts/s':>9} {'query p50':>10} {'p99 ms':>8}")
+    for row in r["runs"]:
+        if "error" in row:
+            print(f"{row['provider']:>8}  unavailable: {row['error']}")
+            continue
+        print(f"{row['provider']:>8} {row['dim']:>5} {row['workers']:>7} {row['texts_per_s']:>9.1f} "
+              f"{row['query_p50_ms']:>10.2f} {row['query_p99_ms']:>8.2f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, indent=1)
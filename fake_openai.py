@@ -0,0 +1,134 @@
+# fake_openai.py — deterministic, offline stand-in for the OpenAI client (benchmarks, smoke tests)
+#
+# Implements the slice of the client this app uses: embeddings.create, chat.completions.create
+# (plain, stream=True and JSON-mode MCQs) and with_options. Embeddings are sums of fixed random
+# vectors per word, so texts sharing words land close together and every run is reproducible.
+# Latency is simulated per request plus per input item / generated token. AsyncFakeOpenAI is the
+# openai.AsyncOpenAI counterpart (same outputs, latency via asyncio.sleep).
+import json, time, asyncio, hashlib, threading
+from types import SimpleNamespace as NS
+from typing import Dict, List
+import numpy as np
+
+_WORD = __import__("re").compile(r"\w+")
+
+class _Embeddings:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.o = owner
+        self.calls = self.items = 0
+        self._words: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _word(self, w: str) -> np.ndarray:
+        v = self._words.get(w)
+        if v is None:
+            seed = int.from_bytes(hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest(), "little")
+            v = np.random.default_rng(seed ^ self.o.seed).standard_normal(self.o.dim).astype(np.float32)
+            self._words[w] = v
+        return v
+
+    def vector(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        if not words:
+            return self._word("")
+        return np.sum([self._word(w) for w in words], axis=0)
+
+    def create(self, model: str, input, _wait: bool = True, **kw):
+        texts = [input] if isinstance(input, str) else list(input)
+        with self._lock:
+            self.calls += 1; self.items += len(texts)
+        if _wait:
+            self.o._sleep(self.o.embed_latency_ms + self.o.embed_item_ms * len(texts))
+        data = [NS(embedding=self.vector(t).tolist(), index=i) for i, t in enumerate(texts)]
+        tokens = sum(len(_WORD.findall(t)) for t in texts)
+        return NS(data=data, model=model, usage=NS(prompt_tokens=tokens, total_tokens=tokens))
+
+class _Completions:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.o = owner
+        self.calls = 0
+
+    def _text(self, messages: List[Dict], json_mode: bool) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        if not json_mode:
+            return f"(fake answer) {prompt[:200]}"
+        k = 5
+        m = __import__("re").search(r"exactly (\d+)", prompt)
+        if m: k = int(m.group(1))
+        h = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        qs = [{"type": "mcq", "q": f"Fake question {h}-{i}: which option is correct?",
+               "choices": ["alpha", "beta", "gamma", "delta"], "answer": "alpha",
+               "explanation": "Alpha is correct because this is a deterministic fake. " * 4}
+              for i in range(k)]
+        return json.dumps({"questions": qs})
+
+    def create(self, model: str, messages: List[Dict], stream: bool = False, _wait: bool = True, **kw):
+        self.calls += 1
+        text = self._text(messages, (kw.get("response_format") or {}).get("type") == "json_object")
+        words = text.split(" ")
+        prompt_tokens = sum(len(_WORD.findall(m.get("content") or "")) for m in messages)
+        usage = NS(prompt_tokens=prompt_tokens, completion_tokens=len(words),
+                   total_tokens=prompt_tokens + len(words))
+        if not stream:
+            if _wait:
+                self.o._sleep(self.o.chat_latency_ms + self.o.chat_token_ms * len(words))
+            return NS(choices=[NS(message=NS(content=text, role="assistant"), finish_reason="stop")],
+                      model=model, usage=usage)
+
+        def events():
+            self.o._sleep(self.o.chat_latency_ms)            # time to first token
+            for i, w in enumerate(words):
+                self.o._sleep(self.o.chat_token_ms)
+                yield NS(choices=[NS(delta=NS(content=(w if i == 0 else " " + w)), finish_reason=None)],
+                         usage=None)
+            if (kw.get("stream_options") or {}).get("include_usage"):
+                yield NS(choices=[], usage=usage)
+        return events()
+
+class FakeOpenAI:
+    """Drop-in for openai.OpenAI in this app; latencies in milliseconds."""
+
+    def __init__(self, dim: int = 256, embed_latency_ms: float = 0.0, embed_item_ms: float = 0.0,
+                 chat_latency_ms: float = 0.0, chat_token_ms: float = 0.0, seed: int = 0):
+        self.dim, self.seed = dim, seed
+        self.embed_latency_ms, self.embed_item_ms = embed_latency_ms, embed_item_ms
+        self.chat_latency_ms, self.chat_token_ms = chat_latency_ms, chat_token_ms
+        self.embeddings = _Embeddings(self)
+        self.chat = NS(completions=_Completions(self))
+
+    @staticmethod
+    def _sleep(ms: float):
+        if ms > 0:
+            time.sleep(ms / 1e3)
+
+    def with_options(self, **kw) -> "FakeOpenAI":
+        return self
+
+class AsyncFakeOpenAI:
+    """Async twin of a FakeOpenAI (shares its vectors and counters); non-streaming calls only."""
+
+    def __init__(self, fake: FakeOpenAI):
+        self.fake = fake
+        self.embeddings = NS(create=self._embed)
+        self.chat = NS(completions=NS(create=self._chat))
+
+    async def _embed(self, model: str, input, **kw):
+        n = 1 if isinstance(input, str) else len(input)
+        await asyncio.sleep((self.fake.embed_latency_ms + self.fake.embed_item_ms * n) / 1e3)
+        return self.fake.embeddings.create(model, input, _wait=False, **kw)
+
+    async def _chat(self, model: str, messages: List[Dict], **kw):
+        resp = self.fake.chat.completions.create(model, messages, _wait=False, **kw)
+        await asyncio.sleep((self.fake.chat_latency_ms
+                             + self.fake.chat_token_ms * resp.usage.completion_tokens) / 1e3)
+        return resp
+
+    def with_options(self, **kw) -> "AsyncFakeOpenAI":
+        return self
+
+def install(fake: FakeOpenAI | None = None, **kw) -> FakeOpenAI:
+    """Make the fake (and its async twin) the app's shared OpenAI clients."""
+    fake = fake or FakeOpenAI(**kw)
+    import utils
+    utils.set_client(fake, AsyncFakeOpenAI(fake))
+    return fake
@@ -0,0 +1,149 @@
+# filters.py — metadata filters resolved to row ranges of the index
+#
+# Ingest records, in each file's manifest entry, where its sections and pages live, as row
+# ranges relative to the file's first row (so compaction, which only moves whole files, keeps
+# them valid):
+#   "sections": {"Chapter 3 > Linear Regression": [[0, 14]], ...}   Markdown heading paths
+#   "pages":    [[page, page_end, first_row], ...]                   PDF page runs, in row order
+# A filter {"source": "notes.pdf", "section": "Linear Regression", "pages": [10, 20]} (any
+# subset) resolves to sorted, merged absolute ranges, so retrieval scores only that slice.
+# A section filter matches a heading path, any heading in it, or a path prefix, case-insensitively,
+# so "Linear Regression" also selects its subsections.
+import re
+from typing import Dict, List, Tuple
+
+Ranges = List[Tuple[int, int]]
+KEYS = ("source", "section", "pages")
+
+_NONWORD = re.compile(r"[^0-9a-z]+")
+# "Chapter 3:", "Section 2.1 -", "3.2", "IV." in front of a title
+_NUMBERING = re.compile(r"^\s*(?:(?:chapter|section|part|unit|lecture|module|week)\s+)?"
+                        r"(?:\d+(?:\.\d+)*|[ivxlc]+)\s*[.:)\-–—]?\s+", re.I)
+
+def describe(chunks: List[Dict]) -> Dict:
+    """The "sections" / "pages" manifest fields for one file's chunks (absent when unused)."""
+    sections: Dict[str, Ranges] = {}
+    pages: List[List[int]] = []
+    for i, ch in enumerate(chunks):
+        sec = ch.get("section")
+        if sec:
+            rs = sections.setdefault(sec, [])
+            if rs and rs[-1][1] == i: rs[-1][1] = i + 1
+            else: rs.append([i, i + 1])
+        if "page" in ch:
+            span = [ch["page"], ch.get("page_end", ch["page"])]
+            if not pages or pages[-1][:2] != span:
+                pages.append(span + [i])
+    out = {}
+    if sections: out["sections"] = sections
+    if pages: out["pages"] = pages
+    return out
+
+def check(where) -> Dict | None:
+    """where as a clean filter dict (None when empty); ValueError on unknown keys or bad values."""
+    if not where:
+        return None
+    if not isinstance(where, dict) or set(where) - set(KEYS):
+        raise ValueError(f"Filter keys must be among {KEYS}")
+    out = {}
+    for key in ("source", "section"):
+        v = where.get(key)
+        if v is not None:
+            if not isinstance(v, str) or not v.strip():
+                raise ValueError(f"Filter '{key}' must be a non-empty string")
+            out[key] = v.strip()
+    if where.get("pages") is not None:
+        p = where["pages"]
+        if isinstance(p, int):
+            p = [p, p]
+        if (not isinstance(p, (list, tuple)) or len(p) != 2
+                or not all(isinstance(x, int) for x in p) or p[0] > p[1]):
+            raise ValueError("Filter 'pages' must be a page number or [first, last]")
+        out["pages"] = (int(p[0]), int(p[1]))
+    return out or None
+
+def key(where: Dict | None) -> Tuple:
+    return tuple((k, where[k]) for k in KEYS if k in where) if where else ()
+
+def _norm(s: str) -> str:
+    return _NONWORD.sub(" ", s.lower()).strip()
+
+def _title(s: str) -> str:
+    """Normalized heading text without its numbering ("Chapter 3: Linear Regression" -> "linear regression")."""
+    return _norm(_NUMBERING.sub("", s, count=1)) or _norm(s)
+
+def _source_match(want: str, name: str) -> bool:
+    w = want.lower()
+    return w == name.lower() or w == name.rsplit(".", 1)[0].lower()
+
+def _section_match(want: str, path: str) -> bool:
+    w, p = _norm(want), _norm(path)
+    if p == w or p.startswith(w + " "):
+        return True
+    t = _title(want)
+    return any(_norm(h) == w or _title(h) == t for h in path.split(" > "))
+
+def _page_rows(runs: List[List[int]], n: int, lo: int, hi: int) -> Ranges:
+    out = []
+    for j, (first, last, start) in enumerate(runs):
+        if first <= hi and last >= lo:
+            end = runs[j + 1][2] if j + 1 < len(runs) else n
+            out.append((start, end))
+    return out
+
+def _intersect(a: Ranges, b: Ranges) -> Ranges:
+    out, i, j = [], 0, 0
+    b = sorted(b)
+    while i < len(a) and j < len(b):
+        lo, hi = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if lo < hi: out.append((lo, hi))
+        if a[i][1] < b[j][1]: i += 1
+        else: j += 1
+    return out
+
+def merge(ranges: Ranges) -> Ranges:
+    out: Ranges = []
+    for a, b in sorted(ranges):
+        if out and a <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], b))
+        elif a < b:
+            out.append((a, b))
+    return out
+
+def resolve(manifest: Dict, where: Dict) -> Ranges:
+    """Absolute row ranges [a, b) of the live rows matching every key of where."""
+    out = []
+    for name, e in (manifest.get("files") or {}).items():
+        if "source" in where and not _source_match(where["source"], name):
+            continue
+        a, b = e["rows"]
+        rows = [(0, b - a)]
+        if "section" in where:
+            rows = _intersect(rows, [tuple(r) for s, rs in (e.get("sections") or {}).items()
+                                     if _section_match(where["section"], s) for r in rs])
+        if "pages" in where:
+            rows = _intersect(rows, _page_rows(e.get("pages") or [], b - a, *where["pages"]))
+        out += [(a + x, a + y) for x, y in rows]
+    return merge(out)
+
+class Catalog:
+    """Sources and section headings of one index, for mapping free-text topics to filters."""
+
+    def __init__(self, manifest: Dict):
+        self.sources: Dict[str, str] = {}     # lowercased name and stem -> file name
+        self.titles: Dict[str, str] = {}      # normalized heading title -> heading as written
+        for name, e in (manifest.get("files") or {}).items():
+            self.sources[name.lower()] = name
+            self.sources.setdefault(name.rsplit(".", 1)[0].lower(), name)
+            for path in e.get("sections") or {}:
+                for h in path.split(" > "):
+                    self.titles.setdefault(_title(h), h)
+
+    def match(self, topic: str) -> Dict | None:
+        """{"source": name} when topic names a file, {"section": heading} when it is a heading
+        (numbering like "Chapter 3:" ignored on either side); else None."""
+        t = topic.strip().lower()
+        if t in self.sources:
+            return {"source": self.sources[t]}
+        h = self.titles.get(_title(topic))
+        return {"section": h} if h else None
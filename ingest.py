@@ -1,23 +1,45 @@
 # ingest.py — simple NumPy index (no Chroma)
-import os, re, glob, json
+import os, json, hashlib, shutil, threading, random, time
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List
 from dotenv import load_dotenv
-from pypdf import PdfReader
-from markdown_it import MarkdownIt
 import numpy as np
-from openai import OpenAI
+from embed_cache import get_cache
+from embedders import get_embedder, manifest_fields
+from utils import count_tokens
+from tracing import span, traced, bind
+import store, ann, bm25, chunker, courses, filters
 
 load_dotenv()
 APP = Path(__file__).resolve().parent
-DATA = APP / "data"
-SRC = DATA / "sources"
-OUTDIR = DATA / "simple"
-OUTDIR.mkdir(parents=True, exist_ok=True)
+# sources and index root (versioned directories + CURRENT, see store.py) per course: courses.py
+EXTRACT_CACHE = courses.DATA / "cache" / "extract"   # shared by all courses (keyed by content hash)
+EXTRACT_VERSION = 2
 
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# compact once this fraction of index rows belongs to deleted/replaced files
+COMPACT_RATIO = float(os.getenv("COMPACT_RATIO", "0.25"))
+# float32 | float16 | int8 (per-row scales); see store.py
+INDEX_DTYPE = os.getenv("INDEX_DTYPE", "float32")
+# chunk size and overlap in tokens (tiktoken)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# extraction: worker processes; large PDFs are split into tasks of this many pages
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# embeddings: requests in flight, tokens per request, retries on 429/5xx
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "50000"))
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "6"))
+
+# serializes upserts and background compaction within one process
+_INDEX_LOCK = threading.Lock()
 
 def log(x):
+    job = _JOB
+    if job is not None and job.running:
+        job.lines.append(str(x))
     try:
         print(x, flush=True)
     except UnicodeEncodeError:
@@ -26,89 +48,523 @@ def log(x):
             x = str(x)
         print(x.encode("ascii", "ignore").decode(), flush=True)
 
-def read_pdf(p: Path) -> str:
+def read_pdf_pages(p: Path, start: int = 0, stop: int | None = None) -> List[str]:
+    from pypdf import PdfReader             # parsers load on first use, not at import
     doc = PdfReader(str(p))
-    return "\n".join((pg.extract_text() or "") for pg in doc.pages)
+    return [(pg.extract_text() or "") for pg in doc.pages[start:stop]]
+
+def read_pdf(p: Path) -> str:
+    return "\n".join(read_pdf_pages(p))
+
+def read_md_sections(p: Path) -> List[Dict]:
+    """[{"section": "H1 > H2", "text": ...}] — one unit per heading, markup-free text."""
+    from markdown_it import MarkdownIt
+    tokens = MarkdownIt().parse(p.read_text(encoding="utf-8", errors="ignore"))
+    units, path, buf = [], [], []
+    def emit():
+        text = "\n\n".join(buf).strip()
+        if text:
+            units.append({"section": " > ".join(t for _, t in path), "text": text} if path else {"text": text})
+        buf.clear()
+    for i, t in enumerate(tokens):
+        if t.type == "heading_open":
+            emit()
+            level, title = int(t.tag[1:]), tokens[i + 1].content.strip()
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, title))
+            buf.append(title)
+        elif t.type == "inline" and i and tokens[i - 1].type != "heading_open":
+            buf.append(t.content)
+        elif t.type in ("fence", "code_block"):
+            buf.append(t.content)
+    emit()
+    return units
 
 def read_md(p: Path) -> str:
-    text = p.read_text(encoding="utf-8", errors="ignore")
-    return MarkdownIt().render(text)
+    return "\n\n".join(u["text"] for u in read_md_sections(p))
 
 def read_txt(p: Path) -> str:
     return p.read_text(encoding="utf-8", errors="ignore")
 
-def chunk_text(text: str, max_tokens=300, overlap=50):
-    if len(text) > 2_000_000:
-        text = text[:2_000_000]
-    parts = re.split(r"(?<=[.!?])\s+", text)
-    chunks, buf, tok = [], [], 0
-
-    def flush():
-        nonlocal buf
-        if not buf: return
-        joined = " ".join(buf).strip()
-        max_chars = 350*4
-        if len(joined) > max_chars: joined = joined[:max_chars]
-        if joined: chunks.append(joined)
-        buf = []
-
-    for p in parts:
-        t = (p or "").strip()
-        if not t: continue
-        est = max(1, len(t)//4)
-        if tok + est > max_tokens and buf:
-            flush()
-            tail = (" ".join(buf))[-overlap*4:] if overlap else ""
-            buf = [tail] if tail else []
-            tok = sum(len(s)//4 for s in buf)
-        buf.append(t); tok += est
-    flush()
-    return [c for c in chunks if c.strip()]
+def read_any(p: Path) -> str:
+    if p.suffix.lower()==".pdf": return read_pdf(p)
+    if p.suffix.lower() in [".md",".markdown"]: return read_md(p)
+    return read_txt(p)
 
-def embed_texts(texts):
-    vecs = []
-    B = 64
-    for i in range(0, len(texts), B):
-        batch = texts[i:i+B]
-        resp = client.embeddings.create(model=EMBED_MODEL, input=batch)
-        vecs.extend([d.embedding for d in resp.data])
-        log(f"   • Embedded {i+len(batch)}/{len(texts)}")
-    arr = np.array(vecs, dtype=np.float32)
-    arr /= (np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12)
+# --- parallel extraction with a cache keyed by file content hash
+# Extraction yields "units" for the chunker: {"text", "page"} per PDF page,
+# {"text", "section"} per Markdown section, or a single {"text"}. They are stored as
+# data/cache/extract/<sha256>.v<EXTRACT_VERSION>.json; bump EXTRACT_VERSION whenever
+# readers change what they return.
+
+def _extract_task(path: str, start: int = 0, stop: int | None = None) -> List[Dict]:
+    p = Path(path)
+    if p.suffix.lower() == ".pdf":
+        return [{"page": start + i + 1, "text": t} for i, t in enumerate(read_pdf_pages(p, start, stop))]
+    if p.suffix.lower() in [".md",".markdown"]:
+        return read_md_sections(p)
+    return [{"text": read_txt(p)}]
+
+def _extract_cache_path(sha: str) -> Path:
+    return EXTRACT_CACHE / f"{sha}.v{EXTRACT_VERSION}.json"
+
+def extract_files(items) -> dict:
+    """{name: [units] | Exception} for (path, sha256) items; cache hits skip the readers.
+
+    Misses fan out over a process pool; PDFs longer than PDF_PAGES_PER_TASK pages are
+    split into page ranges so one big textbook spreads across all workers. Workers are
+    spawned, not forked: this runs from the background reindex thread, and a forked child
+    could inherit locks held by the parent's other threads.
+    """
+    with span("ingest.extract", files=len(items)) as sp:
+        EXTRACT_CACHE.mkdir(parents=True, exist_ok=True)
+        out, tasks, hits = {}, [], 0
+        for p, sha in items:
+            cp = _extract_cache_path(sha)
+            if cp.exists():
+                with open(cp, "r", encoding="utf-8") as f:
+                    out[p.name] = json.load(f)
+                hits += 1; continue
+            ranges = [(0, None)]
+            if p.suffix.lower() == ".pdf":
+                try:
+                    from pypdf import PdfReader
+                    n = len(PdfReader(str(p)).pages)
+                except Exception as e:
+                    out[p.name] = e; continue
+                ranges = [(a, min(n, a + PDF_PAGES_PER_TASK)) for a in range(0, n, PDF_PAGES_PER_TASK)] or ranges
+            tasks.append((p, sha, ranges))
+        if tasks:
+            log(f"   • Extracting {len(tasks)} file(s) ({hits} cached)")
+        sp.set(cached=hits, tasks=sum(len(r) for _, _, r in tasks), cache_hit=not tasks)
+
+        parts = {}
+        work = [(p, i, r) for p, _, ranges in tasks for i, r in enumerate(ranges)]
+        if len(work) <= 1 or EXTRACT_WORKERS <= 1:
+            for p, i, (a, b) in work:
+                try: parts[(p.name, i)] = _extract_task(str(p), a, b)
+                except Exception as e: parts[(p.name, i)] = e
+        else:
+            with ProcessPoolExecutor(max_workers=min(EXTRACT_WORKERS, len(work)),
+                                     mp_context=mp.get_context("spawn")) as ex:
+                futs = {ex.submit(_extract_task, str(p), a, b): (p.name, i) for p, i, (a, b) in work}
+                for fut in as_completed(futs):
+                    try: parts[futs[fut]] = fut.result()
+                    except Exception as e: parts[futs[fut]] = e
+
+        for p, sha, ranges in tasks:
+            got = [parts[(p.name, i)] for i in range(len(ranges))]
+            err = next((g for g in got if isinstance(g, Exception)), None)
+            if err is not None:
+                out[p.name] = err; continue
+            units = [u for g in got for u in g]
+            tmp = _extract_cache_path(sha).with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(units, f, ensure_ascii=False)
+            os.replace(tmp, _extract_cache_path(sha))
+            out[p.name] = units
+        return out
+
+def file_hash(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for blk in iter(lambda: f.read(1 << 20), b""):
+            h.update(blk)
+    return h.hexdigest()
+
+def chunk_text(text: str, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    return [c["text"] for c in chunker.chunk_units([{"text": text}], "sentence", max_tokens, overlap)]
+
+def _token_batches(texts: List[str], max_items: int = 2048) -> List[List[str]]:
+    """Greedy batches bounded by EMBED_BATCH_TOKENS tokens and max_items texts (the API takes 2048)."""
+    batches, cur, tok = [], [], 0
+    for t in texts:
+        n = count_tokens(t)
+        if cur and (tok + n > EMBED_BATCH_TOKENS or len(cur) >= max_items):
+            batches.append(cur); cur, tok = [], 0
+        cur.append(t); tok += n
+    if cur: batches.append(cur)
+    return batches
+
+def _retry_delay(err, attempt: int) -> float:
+    resp = getattr(err, "response", None)
+    after = resp.headers.get("retry-after") if resp is not None else None
+    try:
+        if after: return float(after)
+    except ValueError:
+        pass
+    return min(60.0, 2 ** attempt) * (0.5 + random.random())
+
+def _retryable(err: Exception) -> bool:
+    import openai   # loaded already whenever a real client raised err
+    return isinstance(err, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+def _embed_batch(batch: List[str]) -> np.ndarray:
+    """Embed one batch with backoff on 429/5xx/connection errors; cache it as a checkpoint."""
+    emb = get_embedder()
+    with span("ingest.embed_batch", texts=len(batch), provider=emb.provider) as sp:
+        for attempt in range(EMBED_RETRIES + 1):
+            try:
+                arr = emb.embed(batch, sp, sdk_retries=False)   # retries are ours, with jitter
+                break
+            except Exception as e:
+                if attempt == EMBED_RETRIES or not _retryable(e): raise
+                delay = _retry_delay(e, attempt)
+                log(f"   • {type(e).__name__}; retrying batch of {len(batch)} in {delay:.1f}s")
+                time.sleep(delay)
+        sp.set(retries=attempt)
+    get_cache().put_many(emb.name, batch, arr)
     return arr
 
-def upsert_files():
-    log("Ingest (simple) starting")
-    SRC.mkdir(parents=True, exist_ok=True)
-    files = [p for p in SRC.glob("*") if p.is_file()]
+def embed_texts(texts):
+    # only cache misses go to the API; identical texts are embedded once. Every finished
+    # batch lands in the cache right away, so a crashed run resumes where it stopped.
+    with span("ingest.embed", texts=len(texts)) as sp:
+        cache, emb = get_cache(), get_embedder()
+        found = cache.get_many(emb.name, texts)
+        todo = list(dict.fromkeys(t for i, t in enumerate(texts) if i not in found))
+        log(f"   • Embedding cache: {len(found)}/{len(texts)} hits, {len(todo)} to embed")
+        sp.set(cache_hits=len(found), to_embed=len(todo))
+        fresh = {}
+        if todo:
+            batches = _token_batches(todo, emb.max_batch)
+            done = 0
+            ex = ThreadPoolExecutor(max_workers=min(EMBED_CONCURRENCY, emb.max_concurrency),
+                                    thread_name_prefix="embed")
+            try:
+                futs = {ex.submit(bind(_embed_batch), b): b for b in batches}
+                for fut in as_completed(futs):
+                    batch = futs[fut]
+                    fresh.update(zip(batch, fut.result()))
+                    done += len(batch)
+                    log(f"   • Embedded {done}/{len(todo)}")
+            finally:
+                ex.shutdown(wait=True, cancel_futures=True)
+            cache.evict()
+        return np.array([found[i] if i in found else fresh[t] for i, t in enumerate(texts)],
+                        dtype=np.float32).reshape(len(texts), -1)
+
+# --- manifest: one entry per source file -> content hash, size, mtime, row range
+# (plus file-relative section / page row ranges, see filters.py)
+# Rows of the index that are not covered by any file entry are tombstones
+# (deleted or replaced files); rag masks them and compact_index() drops them.
+# The manifest also lists the index segments (see store.py). Builds commit to the
+# manifest of a staging version directory; store.publish() makes it live.
+
+def load_manifest(outdir: Path | None = None, course: str = courses.DEFAULT) -> dict:
+    path = (outdir or store.current_dir(courses.index_root(course))) / "manifest.json"
+    if not path.exists():
+        return _empty_manifest()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _empty_manifest() -> dict:
+    return {**manifest_fields(get_embedder()), "rows": 0, "files": {}, "store": {"segments": []}}
+
+def _atomic_write(path: Path, write):
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+def _save_manifest(man: dict, outdir: Path):
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(man, f, ensure_ascii=False, indent=1)
+    _atomic_write(outdir / "manifest.json", write)
+
+def _commit(man: dict, outdir: Path):
+    """Durably record man in the staging version (crash-resume point; not yet visible to rag)."""
+    segs = store.segment_headers(man)
+    man["store"] = {"segments": segs}
+    man["rows"] = sum(h["rows"] for h in segs)
+    _save_manifest(man, outdir)
+    keep = [h["name"] for h in segs] + ([man["ann"]["name"]] if man.get("ann") else [])
+    store.cleanup(outdir, keep)
+
+def _load_existing(man: dict, outdir: Path):
+    """Index already in outdir, or None if it must be rebuilt from scratch."""
+    if man.get("embed_model") != get_embedder().name:
+        return None
+    try:
+        idx = store.open_index(outdir)
+    except FileNotFoundError:
+        return None
+    return idx if man.get("rows") == len(idx) else None
+
+@traced("ingest.finalize")
+def _build_ann(man: dict, outdir: Path):
+    """Derived search structures, then commit: BM25 postings for new segments, IVF if large.
+
+    An IVF index left in man["ann"] by the previous version (covering a prefix of the rows) is
+    extended with the appended rows; it is retrained when ann.extend declines.
+    """
+    idx = store.open_segments(outdir, man)
+    built = bm25.build_missing(outdir, idx)
+    if built:
+        log(f"   • BM25 postings for {built} segment(s)")
+    prev = man.pop("ann", None)
+    if man["rows"] >= ann.ANN_MIN_ROWS:
+        _progress(stage="ann")
+        name = store.new_name("a")
+        hdr = None
+        if prev and prev.get("name") and prev.get("rows", 0) <= man["rows"]:
+            if prev["rows"] == man["rows"]:
+                hdr, name = prev, prev["name"]
+            else:
+                hdr = ann.extend(idx, outdir, prev, name)
+                if hdr is not None:
+                    log(f"   • IVF: {man['rows'] - prev['rows']} new rows assigned to {hdr['nlist']} lists")
+        if hdr is None:
+            log(f"Building IVF index over {man['rows']} rows …")
+            hdr = ann.build(idx, outdir, name)
+            log(f"   • {hdr['nlist']} lists")
+        man["ann"] = dict(hdr, name=name)
+    _commit(man, outdir)
+
+def dead_rows(man: dict) -> int:
+    live = sum(e["rows"][1] - e["rows"][0] for e in man["files"].values())
+    return man.get("rows", 0) - live
+
+@traced("ingest.compact")
+def compact_index(course: str = courses.DEFAULT):
+    """Rewrite segments holding tombstoned rows (and merge small ones); renumber file ranges.
+
+    Works one segment at a time, so memory stays bounded by the segment size.
+    """
+    root = courses.index_root(course)
+    with _INDEX_LOCK:
+        work = store.staging_dir(root)
+        man = load_manifest(work)
+        old = _load_existing(man, work)
+        if old is None or dead_rows(man) == 0:
+            return
+        alive = np.zeros(len(old), dtype=bool)
+        for e in man["files"].values():
+            alive[e["rows"][0]:e["rows"][1]] = True
+        new_segs = []
+        writer = store.SegmentWriter(work, INDEX_DTYPE, on_flush=new_segs.append)
+        for s, (hdr, seg) in enumerate(zip(store.segment_headers(man), old.segments)):
+            a, b = int(old.bounds[s]), int(old.bounds[s + 1])
+            live = np.flatnonzero(alive[a:b])
+            if live.size == len(seg) and len(seg) >= store.SEGMENT_ROWS // 2:
+                writer.flush()            # keep row order: pending rows go before this segment
+                new_segs.append(hdr)
+            elif live.size:
+                writer.add(seg.rows_f32(live), [seg.meta(int(j)) for j in live])
+        writer.flush()
+        newpos = np.cumsum(alive) - 1
+        for e in man["files"].values():
+            a, b = e["rows"]
+            start = int(newpos[a]) if b > a else (int(newpos[a - 1]) + 1 if a else 0)
+            e["rows"] = [start, start + (b - a)]
+        before = len(old)
+        del old
+        man["store"] = {"segments": new_segs}
+        man["rows"] = sum(h["rows"] for h in new_segs)
+        man.pop("ann", None)   # row ids changed: retrain
+        _build_ann(man, work)
+        store.publish(root, work)
+        log(f"Compacted index: {before} -> {man['rows']} rows in {len(new_segs)} segment(s)")
+
+def _iter_extracted(changed):
+    """(path, sha256, stat, pages | Exception) per file; files are extracted a group at a time."""
+    group = max(1, EXTRACT_WORKERS) * 2
+    for i in range(0, len(changed), group):
+        part = changed[i:i+group]
+        extracted = extract_files([(p, h) for p, h, _ in part])
+        for p, h, st in part:
+            yield p, h, st, extracted.pop(p.name)
+
+def _iter_chunks(changed):
+    """(path, sha256, stat, chunk dicts) per readable file."""
+    for p, h, st, units in _iter_extracted(changed):
+        if isinstance(units, Exception):
+            log(f"Read failed {p.name}: {units}"); continue
+        with span("ingest.chunk", file=p.name) as sp:
+            chunks = chunker.chunk_units(units, chunker.strategy_for(p.name), CHUNK_TOKENS, CHUNK_OVERLAP)
+            sp.set(chunks=len(chunks))
+        log(f"   • {p.name}: {len(chunks)} chunks")
+        yield p, h, st, chunks
+
+@traced("ingest.upsert")
+def upsert_files(full: bool = False, course: str = courses.DEFAULT):
+    """Streaming reindex of one course: read -> chunk -> embed -> write, one segment at a time.
+
+    Every flushed segment is committed together with the entries of the files it
+    completes, so peak memory is bounded by SEGMENT_ROWS and a crash keeps all
+    committed work; the next run only redoes the files that were in flight.
+    """
+    log(f"Ingest (simple) starting: course {course}")
+    src, root = courses.sources_dir(course), courses.index_root(course)
+    src.mkdir(parents=True, exist_ok=True)
+    files = [p for p in src.glob("*") if p.is_file()]
     if not files:
-        log("No files in data/sources"); return
+        log(f"No files in {src}"); return
+
+    with _INDEX_LOCK:
+        # build the next version beside the live one; rag keeps serving the live one
+        work = store.staging_dir(root)
+        man = load_manifest(work)
+        old = _load_existing(man, work)
+        if old is None:
+            man = _empty_manifest()
+        del old
+        entries = man["files"]
+        _progress(stage="scan")
+
+        # 1) classify: size+mtime match -> unchanged without hashing; else compare hashes
+        changed, touched = [], False
+        for p in files:
+            st = p.stat()
+            e = entries.get(p.name)
+            if not full and e and e["size"] == st.st_size and e["mtime_ns"] == st.st_mtime_ns:
+                continue
+            h = file_hash(p)
+            if not full and e and e["sha256"] == h:
+                e["mtime_ns"] = st.st_mtime_ns; touched = True
+                continue
+            changed.append((p, h, st))
+        removed = set(entries) - {p.name for p in files}
+        for name in removed:
+            log(f"   • {name}: removed")
+            del entries[name]  # its rows become tombstones
+
+        if not changed and not removed:
+            if touched or store.current_dir(root) == root:
+                _save_manifest(man, work)
+                store.publish(root, work)
+            else:
+                store.abandon(root)
+                shutil.rmtree(work, ignore_errors=True)
+            log(f"Index up to date ({len(entries)} file(s), {man['rows']} rows).")
+            return
+        log(f"{len(changed)} new/changed, {len(removed)} removed, {len(files) - len(changed)} unchanged")
+
+        # 2) stream new/changed files into new segments appended after the existing ones.
+        # A changed file keeps serving its old rows until its new entry is committed.
+        segs = store.segment_headers(man)
+        base = man["rows"]
+        # man["ann"] only covers the rows so far (rag ignores it until it covers them all);
+        # _build_ann extends it with the appended rows at the end
+        done = []   # (name, entry) whose rows are all written, awaiting a segment flush
+
+        def on_flush(hdr):
+            segs.append(hdr)
+            flushed = base + writer.flushed
+            ready = [(n, e) for n, e in done if e["rows"][1] <= flushed]
+            for n, e in ready:
+                entries[n] = e  # replaces the entry of a changed file -> old rows tombstoned
+                done.remove((n, e))
+            _commit(man, work)
+            log(f"   • Committed segment {hdr['name']} ({hdr['rows']} rows, {len(ready)} file(s) complete)")
 
-    docs, metas = [], []
-    for p in files:
+        writer = store.SegmentWriter(work, INDEX_DTYPE, on_flush=on_flush)
+        window = []   # metadata rows waiting to be embedded
+
+        def drain():
+            vecs = embed_texts([m["text"] for m in window])
+            man.update(manifest_fields(get_embedder()), embed_dim=int(vecs.shape[1]))
+            with span("ingest.write", rows=len(window)):
+                writer.add(vecs, list(window))
+            _progress(rows=writer.rows)
+            window.clear()
+
+        new_chunks = files_done = 0
+        log("Embedding …")
+        _progress(stage="embed", files_total=len(changed))
+        for p, h, st, chunks in _iter_chunks(changed):
+            start = base + writer.rows + len(window)
+            for i, ch in enumerate(chunks):
+                m = {"source": p.name, "chunk": i, "text": ch["text"]}
+                m.update((k, ch[k]) for k in ("section", "page", "page_end") if k in ch)
+                window.append(m)
+                if len(window) >= store.SEGMENT_ROWS:
+                    drain()
+            new_chunks += len(chunks); files_done += 1
+            _progress(files_done=files_done, chunks=new_chunks)
+            # section / page row ranges for filtered retrieval (see filters.py)
+            done.append((p.name, {"sha256": h, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                  "rows": [start, start + len(chunks)], **filters.describe(chunks)}))
+        if window:
+            drain()
+        writer.flush()
+        for n, e in done:   # files with no chunks past the last flush
+            entries[n] = e
+        if not man["rows"]:
+            store.abandon(root)   # nothing to publish: the next run must not resume this staging
+            shutil.rmtree(work, ignore_errors=True)
+            log("No extractable text found"); return
+        _build_ann(man, work)
+        store.publish(root, work)   # atomic switch for readers
+
+    log(f"Indexed {new_chunks} new chunks; {man['rows']} rows from {len(entries)} file(s) "
+        f"in {len(segs)} segment(s).")
+    log(f"Saved: {work} ({INDEX_DTYPE})")
+
+    dead = dead_rows(man)
+    if dead and dead >= COMPACT_RATIO * man["rows"]:
+        log(f"{dead} tombstoned rows; compacting in background")
+        threading.Thread(target=compact_index, args=(course,), name="compact-index").start()
+
+# --- in-process background reindex (used by the app instead of a subprocess)
+
+class ReindexJob:
+    """State of one background upsert_files() run; fields are updated as it progresses."""
+
+    def __init__(self, full: bool = False, course: str = courses.DEFAULT):
+        self.full, self.course = full, course
+        self.stage = "queued"      # queued | scan | embed | ann | done | failed
+        self.files_total = self.files_done = 0
+        self.chunks = self.rows = 0
+        self.lines: List[str] = []
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self._thread = threading.Thread(target=self._run, name="reindex", daemon=True)
+
+    @property
+    def running(self) -> bool:
+        return self.finished is None
+
+    def _run(self):
         try:
-            if p.suffix.lower()==".pdf": text = read_pdf(p)
-            elif p.suffix.lower() in [".md",".markdown"]: text = read_md(p)
-            else: text = read_txt(p)
+            upsert_files(full=self.full, course=self.course)
+            self.stage = "done"
         except Exception as e:
-            log(f"Read failed {p.name}: {e}"); continue
-        chunks = chunk_text(text, max_tokens=300, overlap=50)
-        log(f"   • {p.name}: {len(chunks)} chunks")
-        for i,ch in enumerate(chunks):
-            docs.append(ch); metas.append({"source": p.name, "chunk": i})
-
-    if not docs:
-        log("No extractable text found"); return
-
-    log("Embedding …")
-    vecs = embed_texts(docs)
-    np.save(OUTDIR / "index.npy", vecs)
-    with open(OUTDIR / "meta.jsonl","w",encoding="utf-8") as f:
-        for m,t in zip(metas, docs):
-            m = dict(m); m["text"] = t
-            f.write(json.dumps(m, ensure_ascii=False) + "\n")
-    log(f"Indexed {len(docs)} chunks from {len(set(m['source'] for m in metas))} file(s).")
-    log(f"Saved: {OUTDIR/'index.npy'}, {OUTDIR/'meta.jsonl'}")
+            self.error = e
+            self.stage = "failed"
+            self.lines.append(f"Reindex failed: {e!r}")
+        finally:
+            self.finished = time.time()
+
+_JOB: ReindexJob | None = None
+_JOB_LOCK = threading.Lock()
+
+def _progress(**kw):
+    job = _JOB
+    if job is not None and job.running:
+        for k, v in kw.items():
+            setattr(job, k, v)
+
+def start_reindex(full: bool = False, course: str = courses.DEFAULT) -> ReindexJob:
+    """Run upsert_files() on a background thread; returns the running job (of any course)
+    if there is one."""
+    global _JOB
+    with _JOB_LOCK:
+        if _JOB is None or not _JOB.running:
+            _JOB = ReindexJob(full, courses.check(course))
+            _JOB._thread.start()
+        return _JOB
+
+def current_job() -> ReindexJob | None:
+    return _JOB
 
 if __name__ == "__main__":
-    upsert_files()
+    import argparse
+    ap = argparse.ArgumentParser(description="Index a course's sources")
+    ap.add_argument("--full", action="store_true", help="re-embed every file, not only changed ones")
+    ap.add_argument("--course", default=courses.DEFAULT,
+                    help="course id: data/courses/<id>/sources (default: data/sources)")
+    args = ap.parse_args()
+    upsert_files(full=args.full, course=courses.check(args.course))
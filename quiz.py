@@ -1,12 +1,29 @@
 # quiz.py
-import os, json, math, re
-from typing import List, Dict
+import os, json, math, queue, threading, logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Set, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
-from rag import retrieve
+import numpy as np
+from rag import retrieve, pack_context, topic_filter, hit_vectors, _embed_queries, _embed_query, _index_mtime
+from quiz_bank import get_quiz_bank, BANK_TARGET
+from tracing import span, traced, bind, usage
+from utils import get_client
+import ann, context, courses
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+log = logging.getLogger("quiz")
+
+QUIZ_CONCURRENCY = int(os.getenv("QUIZ_CONCURRENCY", "8"))      # parallel LLM calls per process
+ENRICH_TIMEOUT = float(os.getenv("QUIZ_ENRICH_TIMEOUT", "45"))  # seconds per explanation call
+TOPUP_RATIO = float(os.getenv("QUIZ_TOPUP_RATIO", "0.25"))      # speculative extra questions (0 = serial top-up)
+DUP_SIM = float(os.getenv("QUIZ_DUP_SIM", "0.92"))              # cosine between question texts = paraphrase
+REFILL_BATCH = int(os.getenv("QUIZ_REFILL_BATCH", "10"))        # questions per background refill call
+CONTEXT_TOKENS = int(os.getenv("QUIZ_CONTEXT_TOKENS", "700"))   # context budget per generation prompt
+MAP_MIN = int(os.getenv("QUIZ_MAP_MIN", "8"))                    # live questions at which generation fans out per cluster (0 = never)
+PER_CALL = int(os.getenv("QUIZ_PER_CALL", "4"))                  # questions per cluster call
+MAP_CANDIDATES = int(os.getenv("QUIZ_MAP_CANDIDATES", "40"))     # chunks retrieved and clustered for a fanned-out quiz
+
+_POOL = ThreadPoolExecutor(max_workers=QUIZ_CONCURRENCY, thread_name_prefix="quiz")
 
 SYSTEM = (
     "You are a strict quiz author. You must return ONLY multiple choice questions in valid JSON. "
@@ -16,14 +33,14 @@ SYSTEM = (
     "Explanations must be clear and self-contained, suitable for a learner."
 )
 
-def _ctx_to_text(ctx: List[Dict], limit_chars: int = 2500) -> str:
-    blocks, total = [], 0
-    for c in ctx:
-        t = (c.get("text") or "").strip()
-        if not t: continue
-        if total + len(t) > limit_chars: break
-        blocks.append(t); total += len(t)
-    return "\n\n".join(blocks)
+def _ctx_to_text(ctx: List[Dict], budget: int = CONTEXT_TOKENS, course: str = courses.DEFAULT) -> str:
+    ctx = [c for c in ctx if (c.get("text") or "").strip()]
+    return context.render(pack_context(ctx, budget=budget, cite=False, course=course), cite=False)
+
+
+def _topic_ctx(topic: str, course: str) -> List[Dict]:
+    # a topic naming a handout or a section heading only searches that part of the index
+    return retrieve(topic, k=8, course=course, where=topic_filter(topic, course))   # smaller k -> faster
 
 
 def _ask_for_mcqs_fast(topic: str, difficulty: str, k: int, ctx_text: str) -> List[Dict]:
@@ -35,17 +52,19 @@ def _ask_for_mcqs_fast(topic: str, difficulty: str, k: int, ctx_text: str) -> Li
         "Topic: {topic}\n\nContext:\n{ctx}"
     ).format(k=k, difficulty=difficulty, topic=topic, ctx=ctx_text or "(no context)")
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",            # ⚡ faster/cheaper; switch to gpt-4o if you want max quality
-        temperature=0.3,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content":
-             "You return strict JSON for MCQs only. Explanations are clear, ~120-180 words."},
-            {"role": "user", "content": prompt},
-        ],
-        timeout=30,  # seconds
-    )
+    with span("quiz.llm_mcqs", k=k, with_ctx=bool(ctx_text)) as sp:
+        resp = get_client().chat.completions.create(
+            model="gpt-4o-mini",            # ⚡ faster/cheaper; switch to gpt-4o if you want max quality
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content":
+                 "You return strict JSON for MCQs only. Explanations are clear, ~120-180 words."},
+                {"role": "user", "content": prompt},
+            ],
+            timeout=30,  # seconds
+        )
+        sp.set(**usage(resp))
     text = resp.choices[0].message.content.strip()
     try:
         data = json.loads(text)
@@ -69,67 +88,289 @@ def _normalize_mcq(q: Dict) -> Dict | None:
     if not choices or answer not in choices: return None
     return {"type":"mcq","q":qtext,"choices":choices,"answer":answer,"explanation":expl}
 
-def _dedup(qs: List[Dict]) -> List[Dict]:
-    seen, out = set(), []
-    for q in qs:
+def _dedup(qs: List[Dict], vecs: np.ndarray | None = None, bank: np.ndarray | None = None,
+           sim: float = DUP_SIM) -> List[Dict]:
+    """Drop exact repeats. Given embeddings of the question texts (vecs, row per q), also drop
+    near-duplicates (cosine >= sim) of earlier questions and of the bank's questions."""
+    seen, out, kept = set(), [], []
+    for i, q in enumerate(qs):
         key = (q["q"].lower(), tuple(c.lower() for c in q["choices"]))
-        if key not in seen:
-            seen.add(key); out.append(q)
+        if key in seen: continue
+        if vecs is not None:
+            v = vecs[i]
+            if bank is not None and len(bank) and bank.shape[1] == len(v) and float(np.max(bank @ v)) >= sim:
+                continue
+            if kept and float(np.max(np.stack(kept) @ v)) >= sim:
+                continue
+            kept.append(v)
+        seen.add(key); out.append(q)
     return out
 
-def _enrich_explanations(qs: List[Dict], ctx_text: str, min_words: int = 110) -> List[Dict]:
-    """Ensure each MCQ has a detailed explanation; expand short ones using context."""
-    enriched = []
-    for q in qs:
-        exp = (q.get("explanation") or "").strip()
-        word_count = len(exp.split())
-        if word_count >= min_words:
-            enriched.append(q)
-            continue
-        prompt = (
-            "Expand the explanation for this MCQ into a 120–220 word mini-lesson.\n"
-            "Requirements:\n"
-            "• Start with the concept in plain language.\n"
-            "• Show a quick example or rule/equation if relevant.\n"
-            "• Briefly refute each incorrect option.\n"
-            "• Keep it factual and grounded in the given context.\n\n"
-            f"Question: {q.get('q')}\n"
-            f"Choices: {q.get('choices')}\n"
-            f"Correct answer: {q.get('answer')}\n\n"
-            f"Existing explanation (may be short): {exp}\n\n"
-            f"Context:\n{ctx_text or '(no context)'}"
+def _enrich_one(q: Dict, ctx_text: str) -> Dict:
+    exp = (q.get("explanation") or "").strip()
+    prompt = (
+        "Expand the explanation for this MCQ into a 120–220 word mini-lesson.\n"
+        "Requirements:\n"
+        "• Start with the concept in plain language.\n"
+        "• Show a quick example or rule/equation if relevant.\n"
+        "• Briefly refute each incorrect option.\n"
+        "• Keep it factual and grounded in the given context.\n\n"
+        f"Question: {q.get('q')}\n"
+        f"Choices: {q.get('choices')}\n"
+        f"Correct answer: {q.get('answer')}\n\n"
+        f"Existing explanation (may be short): {exp}\n\n"
+        f"Context:\n{ctx_text or '(no context)'}"
+    )
+    with span("quiz.enrich_one") as sp:
+        resp = get_client().chat.completions.create(
+            model="gpt-4o",
+            temperature=0.2,
+            messages=[{"role":"system","content":"You improve explanations for MCQs, following instructions precisely."},
+                      {"role":"user","content":prompt}],
+            timeout=ENRICH_TIMEOUT,
         )
-        try:
-            resp = client.chat.completions.create(
-                model="gpt-4o",
-                temperature=0.2,
-                messages=[{"role":"system","content":"You improve explanations for MCQs, following instructions precisely."},
-                          {"role":"user","content":prompt}]
-            )
-            new_exp = resp.choices[0].message.content.strip()
-            q = dict(q); q["explanation"] = new_exp
-        except Exception:
-            # if enrichment fails, keep original
-            pass
+        sp.set(**usage(resp))
+    q = dict(q); q["explanation"] = resp.choices[0].message.content.strip()
+    return q
+
+@traced("quiz.enrich")
+def _enrich_explanations(qs: List[Dict], ctx_text: str | List[str], min_words: int = 110) -> List[Dict]:
+    """Ensure each MCQ has a detailed explanation; expand short ones using context
+    (one text for all, or the text each question was written from).
+
+    Short explanations are expanded concurrently, so the wall time is about one call
+    (per QUIZ_CONCURRENCY questions) rather than one call per question.
+    """
+    ctxs = [ctx_text] * len(qs) if isinstance(ctx_text, str) else ctx_text
+    futs = {i: _POOL.submit(bind(_enrich_one), q, ctxs[i]) for i, q in enumerate(qs)
+            if len((q.get("explanation") or "").split()) < min_words}
+    if not futs:
+        return list(qs)
+    # per-call timeouts bound each call; this bounds the batch if the pool is saturated
+    rounds = math.ceil(len(futs) / QUIZ_CONCURRENCY)
+    wait(futs.values(), timeout=ENRICH_TIMEOUT * rounds + 5)
+    enriched = []
+    for i, q in enumerate(qs):
+        f = futs.get(i)
+        if f is not None and f.done() and f.exception() is None:
+            q = f.result()
+        # if enrichment failed or timed out, keep original
         enriched.append(q)
     return enriched
 
-def make_quiz(topic: str, n: int = 5, difficulty: str = "easy", fast: bool = True) -> Dict:
-    n = max(1, int(n))
-    ctx = retrieve(topic, k=8)                        # smaller k -> faster
-    ctx_text = _ctx_to_text(ctx, limit_chars=2500)    # tighter context -> faster
+def _valid(qs: List[Dict]) -> List[Dict]:
+    return [m for m in (_normalize_mcq(x) for x in qs) if m]
 
-    # Single fast shot
-    qs = _ask_for_mcqs_fast(topic, difficulty, n, ctx_text)
-    normalized = [m for m in (_normalize_mcq(x) for x in qs) if m]
-    normalized = _dedup(normalized)
+@traced("quiz.generate")
+def _generate(topic: str, difficulty: str, n: int, ctx_text: str) -> List[Dict]:
+    """Up to n normalized, deduplicated MCQs from the LLM."""
+    # Main shot, plus a small topic-only top-up issued speculatively alongside it
+    # so an underfilled answer does not cost a second round-trip.
+    main = _POOL.submit(bind(_ask_for_mcqs_fast), topic, difficulty, n, ctx_text)
+    extra = math.ceil(n * TOPUP_RATIO) if TOPUP_RATIO > 0 else 0
+    spec = _POOL.submit(bind(_ask_for_mcqs_fast), topic, difficulty, extra, "") if extra else None
 
-    # If underfilled, do ONE tiny topic-only top-up (still fast)
+    normalized = _dedup(_valid(main.result()))
+
+    if spec is not None and len(normalized) < n:
+        try:
+            normalized = _dedup(normalized + _valid(spec.result()))
+        except Exception:
+            pass
+    elif spec is not None:
+        spec.cancel()   # not needed; a call already in flight just finishes in the background
+
+    # Still underfilled (larger gap than the speculative shot covered):
+    # do ONE tiny topic-only top-up (still fast)
     if len(normalized) < n:
-        missing = n - len(normalized)
-        qs2 = _ask_for_mcqs_fast(topic, difficulty, missing, ctx_text="")
-        normalized.extend([m for m in (_normalize_mcq(x) for x in qs2) if m])
-        normalized = _dedup(normalized)
+        qs2 = _ask_for_mcqs_fast(topic, difficulty, n - len(normalized), ctx_text="")
+        normalized = _dedup(normalized + _valid(qs2))
+
+    return normalized[:n]
+
+def _shares(n: int, sizes: List[int]) -> List[int]:
+    """n questions split over clusters in proportion to their sizes, at least one each."""
+    out = [1] * len(sizes)
+    for _ in range(n - len(sizes)):
+        j = max(range(len(sizes)), key=lambda j: sizes[j] / (out[j] + 1))
+        out[j] += 1
+    return out
+
+@traced("quiz.map_reduce")
+def _generate_clustered(topic: str, difficulty: str, n: int, course: str) -> Tuple[List[Dict], List[str]]:
+    """Up to n MCQs spread over the whole topic, and the context each one was written from.
+
+    Map: a wide candidate set is clustered by embedding (spherical k-means) into about
+    n / QUIZ_PER_CALL subtopics, and each cluster gets its own small generation call, all
+    in parallel, so the wall time stays near one small call. Reduce: questions are taken
+    round-robin across clusters and paraphrases dropped, so every subtopic is represented.
+    """
+    hits = [h for h in retrieve(topic, k=MAP_CANDIDATES, course=course, where=topic_filter(topic, course))
+            if (h.get("text") or "").strip()]
+    c = min(math.ceil(n / max(1, PER_CALL)), QUIZ_CONCURRENCY, len(hits) // 2)
+    vecs = hit_vectors(hits, course) if c > 1 else None
+    if vecs is None:    # too little material to split (or the index was swapped meanwhile)
+        ctx_text = _ctx_to_text(hits[:8], course=course)
+        qs = _generate(topic, difficulty, n, ctx_text)
+        return qs, [ctx_text] * len(qs)
+
+    labels = np.argmax(vecs @ ann.kmeans(vecs, c).T, axis=1)
+    groups = [g for g in ([h for h, l in zip(hits, labels) if l == j] for j in range(c)) if g]
+    texts = [_ctx_to_text(g, course=course) for g in groups]
+    shares = _shares(n, [len(g) for g in groups])
+    # one spare per call covers the odd invalid question without another round-trip
+    futs = [_POOL.submit(bind(_ask_for_mcqs_fast), topic, difficulty, k + 1, t) for k, t in zip(shares, texts)]
+    per = []
+    for f in futs:
+        try:
+            per.append(_valid(f.result()))
+        except Exception:
+            log.exception("quiz cluster call failed for %r", topic)
+            per.append([])
+
+    # round-robin merge: cluster j's i-th question before anyone's (i+1)-th
+    merged = [(p[i], j) for i in range(max(map(len, per), default=0)) for j, p in enumerate(per) if i < len(p)]
+    qs, ctxs = [q for q, _ in merged], [texts[j] for _, j in merged]
+    if qs:
+        pos = {id(q): i for i, q in enumerate(qs)}
+        keep = _dedup(qs, _embed_queries([q["q"] for q in qs]))[:n]
+        qs, ctxs = keep, [ctxs[pos[id(q)]] for q in keep]
+    if len(qs) < n:     # whole clusters failed: one topic-only top-up
+        more = _dedup(qs + _valid(_ask_for_mcqs_fast(topic, difficulty, n - len(qs), ctx_text="")))[len(qs):n]
+        qs, ctxs = qs + more, ctxs + [""] * len(more)
+    return qs, ctxs
+
+def _live(topic: str, difficulty: str, n: int, course: str) -> Tuple[List[Dict], str | List[str]]:
+    """Up to n new MCQs and their context: one call for small n, fanned out over clusters
+    of the topic's material from QUIZ_MAP_MIN questions on."""
+    if MAP_MIN and n >= MAP_MIN:
+        return _generate_clustered(topic, difficulty, n, course)
+    ctx_text = _ctx_to_text(_topic_ctx(topic, course), course=course)   # tighter context -> faster
+    return _generate(topic, difficulty, n, ctx_text), ctx_text
+
+# --- question bank: served instantly, refilled in the background
+
+_BANK_ADD_LOCK = threading.Lock()   # dedup-against-bank + insert must not interleave
+
+@traced("quiz.bank_add")
+def _bank_add(topic_id: int, qs: List[Dict]) -> List[Dict]:
+    """Store the questions that are not (near-)duplicates of the cluster's bank; returns them with ids."""
+    if not qs:
+        return []
+    vecs = _embed_queries([q["q"] for q in qs])
+    pos = {id(q): i for i, q in enumerate(qs)}
+    bank = get_quiz_bank()
+    with _BANK_ADD_LOCK:
+        keep = _dedup(qs, vecs, bank.vectors(topic_id))
+        return bank.add(topic_id, keep, vecs[[pos[id(q)] for q in keep]])
+
+_REFILL_Q: "queue.Queue" = queue.Queue()
+_REFILL_PENDING: Set[int] = set()
+_REFILL_LOCK = threading.Lock()
+_REFILL_THREAD = None
+
+@traced("quiz.refill")
+def _refill(topic_id: int, label: str, difficulty: str, course: str = courses.DEFAULT):
+    qs, ctx_text = _live(label, difficulty, REFILL_BATCH, course)
+    # off the request path, so banked questions always get the full explanations
+    added = _bank_add(topic_id, _enrich_explanations(qs, ctx_text))
+    log.info("quiz bank refill %r (%s, %s): +%d of %d", label, difficulty, course, len(added), len(qs))
+
+def _refill_worker():
+    while True:
+        topic_id, label, difficulty, course = _REFILL_Q.get()
+        try:
+            _refill(topic_id, label, difficulty, course)
+        except Exception:
+            log.exception("quiz bank refill failed for %r", label)
+        finally:
+            with _REFILL_LOCK:
+                _REFILL_PENDING.discard(topic_id)
+
+def _schedule_refill(topic_id: int, label: str, difficulty: str, course: str):
+    global _REFILL_THREAD
+    with _REFILL_LOCK:
+        if topic_id in _REFILL_PENDING:
+            return
+        _REFILL_PENDING.add(topic_id)
+        if _REFILL_THREAD is None:
+            _REFILL_THREAD = threading.Thread(target=_refill_worker, name="quiz-refill", daemon=True)
+            _REFILL_THREAD.start()
+    _REFILL_Q.put((topic_id, label, difficulty, course))
+
+def prefill(topics: List[str], difficulty: str = "easy", course: str = courses.DEFAULT):
+    """Fill the bank for these topics now (blocking), e.g. for popular chapters before class."""
+    version = _index_mtime(course)
+    for topic in topics:
+        topic_id, label = get_quiz_bank().topic_for(version, difficulty, topic, _embed_query(topic), course)
+        while get_quiz_bank().count(topic_id) < BANK_TARGET:
+            before = get_quiz_bank().count(topic_id)
+            _refill(topic_id, label, difficulty.lower(), course)
+            if get_quiz_bank().count(topic_id) == before:   # the topic is exhausted
+                break
+
+def _serve_live(topic_id: int, live: List[Dict], out: List[Dict], seen: Set[int]):
+    """Bank the live questions and append them to out with their ids.
+
+    A question rejected as a paraphrase of the bank is served as the banked question it
+    matched (an unseen one first, else a repeat from an earlier quiz), and dropped when that
+    one is already in out: every question has an id and none appears twice.
+    """
+    bank = get_quiz_bank()
+    added = {q["q"]: q for q in _bank_add(topic_id, live)}
+    for q in live:
+        if q["q"] in added:   # once: a repeat in the batch is matched like any paraphrase
+            out.append(added.pop(q["q"]))
+            continue
+        vec, in_quiz = _embed_query(q["q"]), {x["id"] for x in out}
+        match = (bank.nearest(topic_id, vec, exclude=seen | in_quiz, min_sim=DUP_SIM)
+                 or bank.nearest(topic_id, vec, exclude=in_quiz, min_sim=DUP_SIM))
+        if match is not None:
+            out.append(match)
+
+def _top_up(topic_id: int, out: List[Dict], n: int, seen: Set[int]):
+    """Fill out up to n questions with banked ones not in seen or already in out."""
+    if len(out) < n:
+        out += get_quiz_bank().sample(topic_id, n - len(out), exclude=seen | {x["id"] for x in out})
+
+def make_quiz(topic: str, n: int = 5, difficulty: str = "easy", fast: bool = True,
+              seen: Set[int] | None = None, course: str = courses.DEFAULT) -> Dict:
+    """n MCQs on topic from the course's materials, from the bank when it has enough unseen
+    ones, else generated live.
+
+    seen holds the bank ids already shown in this session; served ids are added to it,
+    so repeated quizzes on a topic do not repeat questions until the bank runs dry.
+    """
+    n = max(1, int(n))
+    difficulty = difficulty.lower()
+    with span("quiz.make_quiz", n=n, difficulty=difficulty, course=course) as sp:
+        seen = set() if seen is None else seen
+        bank = get_quiz_bank()
+        topic_id, label = bank.topic_for(_index_mtime(course), difficulty, topic, _embed_query(topic), course)
+
+        normalized = bank.sample(topic_id, n, exclude=seen)
+        source = "bank"
+        if len(normalized) < n:
+            # miss: generate the rest live and bank it for the next student. Paraphrases that
+            # cannot be served leave gaps: filled from the bank, then by one more live round,
+            # and only then with questions from earlier quizzes
+            for _ in range(2):
+                live, ctx_text = _live(topic, difficulty, n - len(normalized), course)
+                if not fast:
+                    live = _enrich_explanations(live, ctx_text)
+                _serve_live(topic_id, live, normalized, seen)
+                _top_up(topic_id, normalized, n, seen)
+                if len(normalized) >= n:
+                    break
+            _top_up(topic_id, normalized, n, set())
+            if len(normalized) < n:
+                log.warning("quiz on %r (%s): only %d of %d questions", label, course, len(normalized), n)
+            source = "live"
 
-    normalized = normalized[:n]
-    return {"questions": normalized, "count": len(normalized), "requested": n, "type": "mcq"}
+        normalized = normalized[:n]
+        seen.update(q["id"] for q in normalized if "id" in q)
+        if bank.count(topic_id) < BANK_TARGET:
+            _schedule_refill(topic_id, label, difficulty, course)
+        sp.set(source=source, count=len(normalized))
+        return {"questions": normalized, "count": len(normalized), "requested": n, "type": "mcq",
+                "source": source}
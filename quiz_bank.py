@@ -0,0 +1,167 @@
+# quiz_bank.py — persistent bank of pre-generated MCQs (SQLite)
+#
+# Questions belong to a topic cluster: the first topic text asked for a difficulty
+# seeds a cluster, and later topics whose embedding has cosine >= QUIZ_TOPIC_SIM with
+# the seed share its questions. Everything is tied to the index version (the manifest
+# mtime); clusters of other versions are dropped on the next lookup. Each question keeps
+# the embedding of its text so paraphrases can be rejected across the whole cluster.
+# Clusters belong to one course; a course's new index version only drops its own clusters.
+import os, json, random, sqlite3, threading, time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+import numpy as np
+import courses
+
+APP = Path(__file__).resolve().parent
+BANK_PATH = Path(os.getenv("QUIZ_BANK_PATH", APP / "data" / "cache" / "quiz_bank.sqlite"))
+TOPIC_SIM = float(os.getenv("QUIZ_TOPIC_SIM", "0.85"))   # cosine for "same topic"
+BANK_TARGET = int(os.getenv("QUIZ_BANK_TARGET", "30"))   # questions kept ready per cluster
+
+class QuizBank:
+    def __init__(self, path: Path = BANK_PATH, topic_sim: float = TOPIC_SIM):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.topic_sim = topic_sim
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS topics ("
+            " id INTEGER PRIMARY KEY, version REAL NOT NULL, difficulty TEXT NOT NULL,"
+            " label TEXT NOT NULL, vec BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS questions ("
+            " id INTEGER PRIMARY KEY, topic INTEGER NOT NULL, data TEXT NOT NULL,"
+            " vec BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS questions_topic ON questions(topic)")
+        cols = [r[1] for r in self._db.execute("PRAGMA table_info(topics)")]
+        if "course" not in cols:   # banks written before courses existed hold the default course
+            self._db.execute(f"ALTER TABLE topics ADD COLUMN course TEXT NOT NULL DEFAULT '{courses.DEFAULT}'")
+        self._db.commit()
+
+    def _purge(self, course: str, version: float):
+        old = self._db.execute("SELECT id FROM topics WHERE course=? AND version<>?", (course, version)).fetchall()
+        if old:
+            self._db.executemany("DELETE FROM questions WHERE topic=?", old)
+            self._db.executemany("DELETE FROM topics WHERE id=?", old)
+            self._db.commit()
+
+    def topic_for(self, version: float, difficulty: str, topic: str, vec: np.ndarray,
+                  course: str = courses.DEFAULT) -> Tuple[int, str]:
+        """(cluster id, seed topic text) for topic in course; creates a cluster when nothing is close."""
+        difficulty = difficulty.lower()
+        with self._lock:
+            self._purge(course, version)
+            rows = self._db.execute(
+                "SELECT id, label, vec FROM topics WHERE course=? AND version=? AND difficulty=?",
+                (course, version, difficulty)).fetchall()
+            if rows:
+                sims = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]) @ vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.topic_sim:
+                    return rows[best][0], rows[best][1]
+            cur = self._db.execute(
+                "INSERT INTO topics (course, version, difficulty, label, vec, created) VALUES (?,?,?,?,?,?)",
+                (course, version, difficulty, topic, np.asarray(vec, dtype=np.float32).tobytes(), time.time()))
+            self._db.commit()
+            return cur.lastrowid, topic
+
+    def count(self, topic_id: int) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM questions WHERE topic=?", (topic_id,)).fetchone()[0]
+
+    def vectors(self, topic_id: int) -> np.ndarray:
+        """[n, D] embeddings of the cluster's question texts (for near-duplicate checks)."""
+        with self._lock:
+            rows = self._db.execute("SELECT vec FROM questions WHERE topic=?", (topic_id,)).fetchall()
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([np.frombuffer(r[0], dtype=np.float32) for r in rows])
+
+    def add(self, topic_id: int, qs: List[Dict], vecs: np.ndarray) -> List[Dict]:
+        """Store questions (already deduplicated by the caller); returns them with their bank "id"."""
+        now, out = time.time(), []
+        with self._lock:
+            for q, vec in zip(qs, vecs):
+                q = {k: v for k, v in q.items() if k != "id"}
+                cur = self._db.execute(
+                    "INSERT INTO questions (topic, data, vec, created) VALUES (?,?,?,?)",
+                    (topic_id, json.dumps(q, ensure_ascii=False),
+                     np.asarray(vec, dtype=np.float32).tobytes(), now))
+                out.append({**q, "id": cur.lastrowid})
+            self._db.commit()
+        return out
+
+    def nearest(self, topic_id: int, vec: np.ndarray, exclude: Set[int] = frozenset(),
+                min_sim: float = -1.0) -> Dict | None:
+        """The cluster's question closest to vec whose id is not in exclude, if its cosine is >= min_sim."""
+        with self._lock:
+            rows = self._db.execute("SELECT id, data, vec FROM questions WHERE topic=?", (topic_id,)).fetchall()
+        rows = [r for r in rows if r[0] not in exclude]
+        if not rows:
+            return None
+        sims = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]) @ vec
+        best = int(np.argmax(sims))
+        if sims[best] < min_sim:
+            return None
+        return {**json.loads(rows[best][1]), "id": rows[best][0]}
+
+    def sample(self, topic_id: int, n: int, exclude: Set[int] = frozenset()) -> List[Dict]:
+        """Up to n random questions of the cluster whose ids are not in exclude."""
+        with self._lock:
+            rows = self._db.execute("SELECT id, data FROM questions WHERE topic=?", (topic_id,)).fetchall()
+        rows = [r for r in rows if r[0] not in exclude]
+        picked = random.sample(rows, min(n, len(rows)))
+        if len(picked) >= n: self.hits += 1
+        else: self.misses += 1
+        return [{**json.loads(data), "id": qid} for qid, data in picked]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM questions")
+            self._db.execute("DELETE FROM topics")
+            self._db.commit()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            topics = self._db.execute("SELECT COUNT(*) FROM topics").fetchone()[0]
+            questions = self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "topics": topics,
+            "questions": questions,
+        }
+
+_BANK = None
+_BANK_LOCK = threading.Lock()
+
+def get_quiz_bank() -> QuizBank:
+    global _BANK
+    with _BANK_LOCK:
+        if _BANK is None:
+            _BANK = QuizBank()
+        return _BANK
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Quiz bank stats / maintenance")
+    ap.add_argument("--clear", action="store_true", help="delete every banked question")
+    ap.add_argument("--fill", nargs="+", metavar="TOPIC", help="pre-generate questions for these topics")
+    ap.add_argument("--difficulty", default="easy")
+    ap.add_argument("--course", default=courses.DEFAULT, help="course whose index the topics come from")
+    args = ap.parse_args()
+    b = get_quiz_bank()
+    if args.clear:
+        b.clear()
+        print("Cleared quiz bank")
+    if args.fill:
+        from quiz import prefill
+        prefill(args.fill, args.difficulty, args.course)
+    print(json.dumps(b.stats(), indent=1))
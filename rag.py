@@ -1,78 +1,381 @@
 # rag.py — simple NumPy index (no Chroma)
-import os, json
+import os, threading, time, logging, weakref
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
 from typing import List, Dict
 from dotenv import load_dotenv
 import numpy as np
-from openai import OpenAI
-from rapidfuzz import fuzz
+from embed_cache import get_cache
+from embedders import get_embedder, check_index
+from answer_cache import get_answer_cache
+from tracing import span, usage, milestone
+from utils import get_client
+import store, ann, bm25, context, courses, shards, filters
 
 load_dotenv()
+log = logging.getLogger("rag")
 APP = Path(__file__).resolve().parent
-OUTDIR = APP / "data" / "simple"
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
+QUERY_LRU = int(os.getenv("QUERY_LRU", "1024"))   # in-memory query vectors per process
+QUERY_BLOCK = 64   # queries scored per matrix product in retrieve_many (bounds the [N, B] buffer)
+HYBRID = os.getenv("HYBRID_SEARCH", "1") != "0"   # fuse BM25 with dense results when postings exist
+HYBRID_DEPTH = int(os.getenv("HYBRID_DEPTH", "50"))   # candidates per ranking fed into the fusion
+RRF_K = 60
+FILTER_CACHE = 256   # resolved metadata filters kept per open index
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1500"))         # prompt budget for retrieved chunks
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "12"))   # hits the packer chooses from
+INDEX_MEMORY_MB = float(os.getenv("INDEX_MEMORY_MB", "2048"))     # resident course indexes, all courses
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_LOAD_RETRIES = 3
 
-# lazy globals
-APP = Path(__file__).resolve().parent
-OUTDIR = APP / "data" / "simple"
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
+def _index_mtime(course: str = courses.DEFAULT):
+    vdir = store.current_dir(courses.index_root(course))  # CURRENT names the published version
+    man = vdir / "manifest.json"     # written last by ingest: the commit point
+    paths = [man] if man.exists() else [vdir / "index.npy", vdir / "meta.jsonl"]
+    if not all(p.exists() for p in paths):
+        return 0.0
+    return max(p.stat().st_mtime for p in paths)
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def _alive_rows(idx: store.Index) -> np.ndarray:
+    """Rows owned by a file in the ingest manifest; the rest are tombstones."""
+    files = idx.manifest.get("files")
+    if files is None:
+        return np.ones(len(idx), dtype=bool)
+    alive = np.zeros(len(idx), dtype=bool)
+    for e in files.values():
+        a, b = e["rows"]
+        alive[a:b] = True
+    return alive
 
-_VEC = None
-_META = None
-_LAST_MTIME = 0.0
+class _Resident:
+    """Open indexes by course, least recently used first.
 
-def _index_mtime():
-    idx = OUTDIR / "index.npy"
-    meta = OUTDIR / "meta.jsonl"
-    if not idx.exists() or not meta.exists():
-        return 0.0
-    return max(idx.stat().st_mtime, meta.stat().st_mtime)
+    get() reopens a course whose published version is newer than the open one (mtime
+    check on every call) and, after each open, closes the least recently used other
+    courses until the resident indexes fit in budget bytes. Evicting only drops the
+    reference: a query holding the index finishes on it, then its mmaps are released.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.loads = self.evictions = 0
+        self._d: "OrderedDict[str, tuple]" = OrderedDict()   # course -> (index, mtime)
+        self._lock = threading.Lock()                        # guards _d
+        self._loading: Dict[str, threading.Lock] = {}        # one open at a time per course
+
+    def _fresh(self, course: str, mtime: float, force: bool):
+        with self._lock:
+            ent = self._d.get(course)
+            if ent is None or force or mtime > ent[1]:
+                return None
+            self._d.move_to_end(course)
+            return ent[0]
+
+    def get(self, course: str, force: bool = False) -> store.Index:
+        mtime = _index_mtime(course)
+        if not mtime:
+            hint = "" if course == courses.DEFAULT else f" --course {course}"
+            raise RuntimeError(f"Index for course {course!r} not found. Run `python ingest.py{hint}` first.")
+        idx = self._fresh(course, mtime, force)
+        if idx is not None:
+            return idx
+        with self._lock:
+            lock = self._loading.setdefault(course, threading.Lock())
+        with lock:                          # concurrent first queries wait for one open (e.g. preload's)
+            idx = self._fresh(course, mtime, force)
+            if idx is not None:
+                return idx
+            root = courses.index_root(course)
+            for attempt in range(_LOAD_RETRIES):
+                try:
+                    idx = _open_version(store.current_dir(root))
+                    break
+                except FileNotFoundError:
+                    # the version was pruned between reading CURRENT and opening it: re-read
+                    if attempt == _LOAD_RETRIES - 1: raise
+            check_index(idx.manifest, idx.dim, course)   # another model's vectors: not comparable
+            with self._lock:
+                self._d[course] = (idx, mtime)
+                self._d.move_to_end(course)
+                self.loads += 1
+                self._evict(keep=course)
+        return idx
+
+    def peek(self, course: str) -> store.Index | None:
+        """The open index of course, if resident (no mtime check, no load)."""
+        with self._lock:
+            ent = self._d.get(course)
+            return ent[0] if ent else None
+
+    def _evict(self, keep: str):
+        total = sum(ent[0].nbytes for ent in self._d.values())
+        for course in list(self._d):
+            if total <= self.budget:
+                break
+            if course == keep:
+                continue
+            idx, _ = self._d.pop(course)
+            total -= idx.nbytes
+            self.evictions += 1
+            log.info("evicted index of course %r (%.0f MB)", course, idx.nbytes / 2**20)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            resident = {c: {"rows": len(idx), "mb": round(idx.nbytes / 2**20, 1), "version": m,
+                            "shards": len(idx.shards.groups) if idx.shards else 0}
+                        for c, (idx, m) in self._d.items()}
+        return {"resident": resident, "budget_mb": self.budget / 2**20,
+                "used_mb": round(sum(r["mb"] for r in resident.values()), 1),
+                "loads": self.loads, "evictions": self.evictions}
+
+_INDEXES = _Resident(INDEX_MEMORY_MB * 2**20)
+
+def _load_index(course: str = courses.DEFAULT, force: bool = False) -> store.Index:
+    """The current index of course: resident, or opened now (evicting cold courses)."""
+    return _INDEXES.get(course, force)
 
-def _load_index(force: bool = False):
-    global _VEC, _META, _LAST_MTIME
-    idx_path = OUTDIR / "index.npy"
-    meta_path = OUTDIR / "meta.jsonl"
-    if not idx_path.exists() or not meta_path.exists():
-        raise RuntimeError("Simple index not found. Run `python ingest.py` first.")
+def _open_version(vdir: Path) -> store.Index:
+    with span("rag.load_index", version=vdir.name) as sp:
+        idx = store.open_index(vdir)        # zero-copy: pages are shared across processes
+        idx.version = vdir.name             # tags hits, so their row ids are read in this version
+        idx.alive = _alive_rows(idx)
+        idx.dead = np.flatnonzero(~idx.alive)
+        hdr = idx.manifest.get("ann")
+        idx.ivf = None
+        if hdr and hdr.get("name") and hdr.get("rows") == len(idx) and len(idx) >= ann.ANN_MIN_ROWS:
+            idx.ivf = ann.IVF.load(vdir, hdr["name"])
+        idx.bm25 = bm25.BM25.load(vdir, idx) if HYBRID else None
+        idx.selections = _LRU(FILTER_CACHE)   # filter key -> (row ranges, row ids)
+        idx.catalog = None                    # filters.Catalog, built on first topic lookup
+        idx.shards = None
+        # an index with IVF answers every unfiltered query from its probed lists: workers would
+        # only ever serve exact=True, so shards are for large indexes searched exactly (no IVF)
+        if shards.RETRIEVE_SHARDS > 1 and len(idx) >= shards.SHARD_MIN_ROWS and idx.ivf is None:
+            idx.shards = shards.ShardPool.for_index(vdir, idx, shards.RETRIEVE_SHARDS)
+            weakref.finalize(idx, idx.shards.close)   # workers exit when the version is dropped
+        # what the registry budgets: every file of the version may end up paged in
+        idx.nbytes = sum(p.stat().st_size for p in vdir.iterdir() if p.is_file())
+        sp.set(rows=len(idx), ivf=idx.ivf is not None, bm25=idx.bm25 is not None,
+               shards=len(idx.shards.groups) if idx.shards else 0)
+    return idx
 
-    mtime = _index_mtime()
-    if force or _VEC is None or mtime > _LAST_MTIME:
-        _VEC = np.load(idx_path).astype(np.float32)
-        with open(meta_path, "r", encoding="utf-8") as f:
-            _META = [json.loads(line) for line in f]
-        _LAST_MTIME = mtime
+def reload_index(course: str = courses.DEFAULT):
+    _load_index(course, force=True)
 
-def reload_index():
-    _load_index(force=True)
+def index_stats() -> Dict:
+    return _INDEXES.stats()
+
+_PRELOAD: Dict[str, threading.Thread] = {}
+_PRELOAD_LOCK = threading.Lock()
+
+def preload(course: str = courses.DEFAULT) -> threading.Thread:
+    """Open the course's index (and create the OpenAI client and the embedder, e.g. load the local
+    model) on a background thread, once per process, so the first question does not pay for it.
+    Missing index -> logged, queries still raise."""
+    def run():
+        try:
+            get_client()
+            get_embedder()
+            _load_index(course)
+            milestone("index_ready")
+        except Exception as e:
+            log.warning("index preload failed: %s", e)
+    with _PRELOAD_LOCK:
+        if course not in _PRELOAD:
+            _PRELOAD[course] = threading.Thread(target=run, name="index-preload", daemon=True)
+            _PRELOAD[course].start()
+        return _PRELOAD[course]
+
+class _LRU:
+    """Small thread-safe LRU for query vectors (probe-able, unlike functools.lru_cache)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            v = self._d.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._d.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key, v):
+        with self._lock:
+            self._d[key] = v
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+_QUERY_LRU = _LRU(QUERY_LRU)
+
+def _embed_queries(queries: List[str]) -> np.ndarray:
+    """[B, D] unit vectors: in-memory LRU -> disk cache -> one embeddings call for the rest."""
+    emb = get_embedder()
+    with span("rag.embed_query", queries=len(queries), provider=emb.provider) as sp:
+        out = [_QUERY_LRU.get((emb.name, q)) for q in queries]
+        todo = [i for i, v in enumerate(out) if v is None]
+        sp.set(lru_hits=len(queries) - len(todo), cache_hit=not todo)
+        if todo:
+            found = get_cache().get_many(emb.name, [queries[i] for i in todo])
+            for j, i in enumerate(todo):
+                if j in found: out[i] = found[j]
+            missing = list(dict.fromkeys(queries[i] for i in todo if out[i] is None))
+            fresh = {}
+            if missing:
+                arr = emb.embed(missing, sp)
+                get_cache().put_many(emb.name, missing, arr)
+                fresh = dict(zip(missing, arr))
+                sp.set(api_texts=len(missing))
+            sp.set(disk_hits=len(found))
+            for i in todo:
+                if out[i] is None: out[i] = fresh[queries[i]]
+                out[i].flags.writeable = False   # shared between callers via the LRU
+                _QUERY_LRU.put((emb.name, queries[i]), out[i])
+    return np.stack(out) if out else np.zeros((0, 0), dtype=np.float32)
 
 def _embed_query(q: str):
-    resp = client.embeddings.create(model=EMBED_MODEL, input=q)
-    v = np.array(resp.data[0].embedding, dtype=np.float32)
-    v /= (np.linalg.norm(v) + 1e-12)
-    return v
-
-def retrieve(query: str, k: int = 8) -> List[Dict]:
-    _load_index()
-    qv = _embed_query(query)                # [D]
-    sims = (_VEC @ qv)                      # cosine via dot (both normalized)
-    topk_idx = np.argsort(-sims)[:max(k, 4)]
-    hits = []
-    for i in topk_idx:
-        m = _META[int(i)]
-        hits.append({
-            "id": i.item(),
-            "text": m["text"],
-            "source": m.get("source"),
-            "chunk": m.get("chunk"),
-            "score": float(sims[int(i)]),
-        })
-    # light lexical rerank to bubble literal matches
-    hits.sort(key=lambda h: (h["score"], fuzz.token_set_ratio(query, h["text"])), reverse=True)
-    return hits[:k]
+    return _embed_queries([q])[0]
+
+def embed_cache_stats() -> Dict:
+    lru = _QUERY_LRU
+    lookups = lru.hits + lru.misses
+    return {
+        "query_lru": {"hits": lru.hits, "misses": lru.misses, "size": len(lru._d),
+                      "hit_rate": (lru.hits / lookups) if lookups else 0.0},
+        "store": get_cache().stats(),
+    }
+
+def _hit(idx: store.Index, i: int, score: float) -> Dict:
+    m = idx.meta(i)                         # metadata is read only for the top hits
+    return {
+        "id": i,
+        "text": m["text"],
+        "source": m.get("source"),
+        "chunk": m.get("chunk"),
+        "score": float(score),
+        "version": idx.version,
+    }
+
+def _hits(idx: store.Index, query: str, ids: np.ndarray, scores: np.ndarray, k: int) -> List[Dict]:
+    from rapidfuzz import fuzz              # imported on the first query, not at startup
+    with span("rag.rerank"):
+        hits = [_hit(idx, int(i), sc) for i, sc in zip(ids, scores) if np.isfinite(sc)]
+        # light lexical rerank to bubble literal matches
+        hits.sort(key=lambda h: (h["score"], fuzz.token_set_ratio(query, h["text"])), reverse=True)
+        return hits[:k]
+
+def _fused(idx: store.Index, query: str, ids: np.ndarray, scores: np.ndarray, k: int,
+           ranges=None) -> List[Dict]:
+    """Reciprocal-rank fusion of the dense ranking (ids, best first) with BM25's ranking
+    (restricted to the row ranges of a filter, if any)."""
+    with span("rag.bm25") as sp:
+        lex_ids, _ = idx.bm25.search(query, HYBRID_DEPTH, dead=idx.dead, ranges=ranges)
+        sp.set(hits=len(lex_ids))
+    with span("rag.fuse"):
+        fused: Dict[int, float] = {}
+        for ranking in (ids[np.isfinite(scores)], lex_ids):
+            for r, i in enumerate(ranking.tolist()):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (RRF_K + r + 1)
+        best = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [_hit(idx, i, sc) for i, sc in best]
+
+def _selection(idx: store.Index, where: Dict):
+    """(row ranges, row ids) matching a checked filter, resolved once per index version."""
+    key = filters.key(where)
+    sel = idx.selections.get(key)
+    if sel is None:
+        ranges = filters.resolve(idx.manifest, where)
+        rowids = (np.concatenate([np.arange(a, b, dtype=np.int64) for a, b in ranges])
+                  if ranges else np.zeros(0, dtype=np.int64))
+        sel = (ranges, rowids)
+        idx.selections.put(key, sel)
+    return sel
+
+def _filtered(idx: store.Index, queries: List[str], Q: np.ndarray, k: int, kk: int, rank,
+              ranges, rowids: np.ndarray) -> List[List[Dict]]:
+    """Exact search of the selected row ranges only (cost proportional to the selection)."""
+    out = []
+    for a in range(0, len(queries), QUERY_BLOCK):
+        qs, Qb = queries[a:a+QUERY_BLOCK], Q[a:a+QUERY_BLOCK]
+        with span("rag.search", kind="filtered", rows=len(rowids), queries=len(qs)):
+            sims = np.concatenate([idx.scores(Qb.T, slice(x, y)) for x, y in ranges])   # [n, b]
+            top = store.topk(sims, kk)
+        for j, q in enumerate(qs):
+            out.append(rank(idx, q, rowids[top[:, j]], sims[top[:, j], j], k))
+    return out
+
+def retrieve_many(queries: List[str], k: int = 8, exact: bool = False,
+                  course: str = courses.DEFAULT, where: Dict | None = None) -> List[List[Dict]]:
+    """Top-k hits for each query in the course's index: one embeddings call, one matrix
+    product per query block.
+
+    Indexes with at least ANN_MIN_ROWS rows and a built IVF are searched approximately
+    (ANN_NPROBE lists per query) unless exact=True. Exact search of an index with at least
+    SHARD_MIN_ROWS rows is scattered over RETRIEVE_SHARDS worker processes when that is
+    above 1 (shards.py). When the index has BM25 postings,
+    the dense and lexical rankings are merged by reciprocal-rank fusion; "score" is
+    then the fused score.
+
+    where = {"source", "section", "pages": [first, last]} (any subset, see filters.py)
+    restricts the search to matching rows; only those rows are scored.
+    """
+    where = filters.check(where)
+    with span("rag.retrieve", queries=len(queries), k=k, course=course, filtered=where is not None):
+        idx = _load_index(course)           # stable snapshot if a reload happens meanwhile
+        if where is not None:
+            ranges, rowids = _selection(idx, where)
+            if not len(rowids):
+                return [[] for _ in queries]
+        Q = _embed_queries(queries)         # [B, D]
+        if idx.bm25 is not None:
+            kk, rank = max(k, HYBRID_DEPTH), _fused
+        else:
+            kk, rank = max(k, 4), _hits
+        if where is not None:
+            if rank is _fused:
+                rank = partial(_fused, ranges=ranges)
+            return _filtered(idx, queries, Q, k, kk, rank, ranges, rowids)
+        if idx.ivf is not None and not exact:
+            with span("rag.search", kind="ivf", rows=len(idx)):
+                found = idx.ivf.search(idx, Q, kk, alive=idx.alive)
+            return [rank(idx, q, ids, sc, k) for q, (ids, sc) in zip(queries, found)]
+        if idx.shards is not None and not idx.shards.broken:
+            try:
+                found = []
+                for a in range(0, len(queries), QUERY_BLOCK):
+                    with span("rag.search", kind="shards", rows=len(idx), shards=len(idx.shards.groups)):
+                        found += idx.shards.search(Q[a:a+QUERY_BLOCK], kk)
+                return [rank(idx, q, ids, sc, k) for q, (ids, sc) in zip(queries, found)]
+            except RuntimeError as e:
+                log.warning("sharded search failed (%s); scoring in-process from now on", e)
+        out = []
+        for a in range(0, len(queries), QUERY_BLOCK):
+            qs = queries[a:a+QUERY_BLOCK]
+            with span("rag.search", kind="exact", rows=len(idx), queries=len(qs)):
+                sims = idx.scores(Q[a:a+QUERY_BLOCK].T)   # [N, b] cosine via dot (both normalized)
+                sims[idx.dead] = -np.inf    # tombstoned rows never surface
+                top = store.topk(sims, kk)
+            for j, q in enumerate(qs):
+                out.append(rank(idx, q, top[:, j], sims[top[:, j], j], k))
+        return out
+
+def retrieve(query: str, k: int = 8, exact: bool = False, course: str = courses.DEFAULT,
+             where: Dict | None = None) -> List[Dict]:
+    return retrieve_many([query], k, exact=exact, course=course, where=where)[0]
+
+def topic_filter(topic: str, course: str = courses.DEFAULT) -> Dict | None:
+    """{"source": ...} or {"section": ...} when topic names a file or a section heading of the
+    course's index (e.g. "Chapter 3: Linear Regression"); else None."""
+    idx = _load_index(course)
+    if idx.catalog is None:
+        idx.catalog = filters.Catalog(idx.manifest)
+    return idx.catalog.match(topic)
 
 SYSTEM = (
     "You are a helpful subject tutor. "
@@ -81,29 +384,143 @@ SYSTEM = (
     "Keep answers concise, structured, and include inline citations like (source.pdf #chunk)."
 )
 
+def hit_vectors(hits: List[Dict], course: str = courses.DEFAULT) -> np.ndarray | None:
+    """[n, D] float32 embeddings of hits from the course's open index (None unless it is the
+    version every hit was read from: row ids of another version name other chunks)."""
+    idx = _INDEXES.peek(course)
+    if idx is None or not hits or any(h.get("version") != idx.version for h in hits):
+        return None
+    return idx.rows_f32(np.array([h["id"] for h in hits], dtype=np.int64))
+
+def pack_context(hits: List[Dict], budget: int = CONTEXT_TOKENS, cite: bool = True,
+                 course: str = courses.DEFAULT) -> List[Dict]:
+    """The hits (of course's index, as ranked by retrieve) worth sending: MMR-diverse,
+    overlap-aware and within budget tokens (context.py)."""
+    if not hits:
+        return hits
+    with span("rag.pack", hits=len(hits), budget=budget) as sp:
+        vecs = hit_vectors(hits, course)    # None: reloaded since retrieval -> no redundancy term
+        out = context.select(hits, vecs, budget, cite=cite)
+        sp.set(picked=len(out))
+    return out
+
 def _format_context(ctx: List[Dict]) -> str:
-    blocks = []
-    for i, c in enumerate(ctx, 1):
-        text = c["text"]
-        if len(text) > 1200:
-            text = text[:1200] + "…"
-        src = c.get("source") or "unknown"
-        blk = f"[{i}] ({src} #{c.get('chunk')}): {text}"
-        blocks.append(blk)
-    return "\n\n".join(blocks)
-
-def answer(query: str):
-    ctx = retrieve(query)
+    # adjacent chunks of one source become one block without their repeated overlap
+    return context.render(ctx)
+
+CHAT_MODEL = "gpt-4o"          # or "gpt-4o-mini" if you prefer cheaper
+
+def _messages(query: str, ctx: List[Dict]) -> List[Dict]:
     context_block = _format_context(ctx) if ctx else "[no context found]"
-    messages = [
+    return [
         {"role": "system", "content": SYSTEM},
         {"role": "user", "content": f"Question: {query}\n\nContext:\n{context_block}"}
     ]
-    # NOTE: the variable name is *client*, not clie...
-    resp = client.chat.completions.create(
-        model="gpt-4o",          # or "gpt-4o-mini" if you prefer cheaper
-        messages=messages,
-        temperature=0.2,
-    )
-    return resp.choices[0].message.content, ctx
 
+def _scope(course: str = courses.DEFAULT) -> str:
+    return f"{course}|{CHAT_MODEL}|{get_embedder().name}"
+
+def _cached_ctx(refs: List[Dict], cached_query: str, course: str = courses.DEFAULT) -> List[Dict]:
+    idx = _load_index(course)
+    ctx = []
+    for r in refs:
+        m = idx.meta(r["id"])
+        ctx.append({"id": r["id"], "text": m["text"], "source": m.get("source"),
+                    "chunk": m.get("chunk"), "score": r["score"], "version": idx.version,
+                    "cached": True, "cached_query": cached_query})
+    return ctx
+
+def _cache_lookup(query: str, course: str = courses.DEFAULT):
+    """(answer, ctx, version, query vector) — answer/ctx are None on a miss.
+
+    The exact-text check needs no embedding; the near-duplicate check reuses the query
+    vector that retrieval would compute anyway (it lands in the query LRU).
+    """
+    with span("rag.answer_cache") as sp:
+        cache, scope, version = get_answer_cache(), _scope(course), _index_mtime(course)
+        hit = cache.lookup_exact(scope, version, query)
+        vec = None
+        if hit is None:
+            vec = _embed_query(query)
+            hit = cache.lookup_similar(scope, version, vec)
+        sp.set(cache_hit=hit is not None)
+    if hit is None:
+        return None, None, version, vec
+    ans, refs, cached_query = hit
+    return ans, _cached_ctx(refs, cached_query, course), version, vec
+
+def _cache_store(query: str, vec, version: float, ans: str, ctx: List[Dict],
+                 course: str = courses.DEFAULT):
+    if version != _index_mtime(course):   # reindexed meanwhile: chunk ids may be stale
+        return
+    refs = [{"id": c["id"], "score": c["score"]} for c in ctx]
+    get_answer_cache().put(_scope(course), version, query, vec, ans, refs)
+
+def _context(query: str, course: str) -> List[Dict]:
+    hits = retrieve(query, k=CONTEXT_CANDIDATES, course=course)
+    return pack_context(hits, course=course)
+
+def answer(query: str, course: str = courses.DEFAULT):
+    """(answer text, ctx) from the course's materials. Served from the answer cache when the
+    same or a near-identical question was answered against the current index; then every ctx
+    item has cached=True."""
+    with span("rag.answer", course=course):
+        ans, ctx, version, vec = _cache_lookup(query, course)
+        if ans is not None:
+            milestone("first_answer")
+            return ans, ctx
+        ctx = _context(query, course)
+        with span("rag.chat", model=CHAT_MODEL) as sp:
+            resp = get_client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=_messages(query, ctx),
+                temperature=0.2,
+            )
+            sp.set(**usage(resp))
+        ans = resp.choices[0].message.content
+        _cache_store(query, vec, version, ans, ctx, course)
+        milestone("first_answer")           # cold start -> first answer, once per process
+        return ans, ctx
+
+def answer_stream(query: str, course: str = courses.DEFAULT):
+    """(generator of answer text deltas, ctx); ctx is ready as soon as retrieval finishes.
+
+    Time-to-first-token is measured from the call (retrieval included) and logged.
+    Cache hits yield the whole answer at once and flag ctx items with cached=True.
+    """
+    t0 = time.perf_counter()
+    with span("rag.answer", stream=True, course=course):
+        ans, ctx, version, vec = _cache_lookup(query, course)
+        if ans is not None:
+            log.info("answer cache hit in %.3fs", time.perf_counter() - t0)
+            milestone("first_answer")
+            return iter([ans]), ctx
+        ctx = _context(query, course)
+    t_ctx = time.perf_counter() - t0
+
+    def deltas():
+        with span("rag.chat", model=CHAT_MODEL, stream=True) as sp:
+            stream = get_client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=_messages(query, ctx),
+                temperature=0.2,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            ttft, parts = None, []
+            for ev in stream:
+                if getattr(ev, "usage", None):   # final event carries the token counts
+                    sp.set(**usage(ev))
+                delta = ev.choices[0].delta.content if ev.choices else None
+                if not delta: continue
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                    sp.set(ttft_ms=round(ttft * 1e3, 1))
+                    log.info("answer ttft=%.3fs (retrieval %.3fs)", ttft, t_ctx)
+                parts.append(delta)
+                yield delta
+        log.info("answer done total=%.3fs", time.perf_counter() - t0)
+        milestone("first_answer")
+        _cache_store(query, vec, version, "".join(parts), ctx, course)
+
+    return deltas(), ctx
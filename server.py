@@ -0,0 +1,292 @@
+# server.py — headless asyncio HTTP service over rag/quiz (aiohttp)
+#
+#   python server.py [--host 127.0.0.1] [--port 8000]
+#
+#   POST /retrieve {"query", "k"?, "exact"?, "where"?} -> {"hits": [...]}
+#   POST /answer   {"query"}                          -> {"answer", "ctx", "cached"}
+#   POST /quiz     {"topic", "n"?, "difficulty"?, "seen"?: [ids]} -> make_quiz() result
+#   GET  /health?course=, GET /stats
+#
+# Every POST takes an optional "course" id (default "default"); one process serves all
+# courses, keeping the recently used indexes open within INDEX_MEMORY_MB (see rag.py).
+# "where" filters retrieval by {"source", "section", "pages": [first, last]} (see filters.py).
+#
+# Queries arriving within SERVER_BATCH_MS of each other are micro-batched: one embeddings
+# request and one matrix product per batch (rag.retrieve_many). Identical requests in flight
+# at the same time are coalesced (singleflight) and share one result, so a class asking the
+# same question makes one LLM call. Chat calls use the async OpenAI client, so hundreds of
+# open requests cost coroutines, not threads; numpy/SQLite work runs on a bounded thread pool.
+import os, json, asyncio, logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+from dotenv import load_dotenv
+from aiohttp import web
+import rag, quiz, courses, filters
+from answer_cache import get_answer_cache, normalize
+from tracing import span, bind, usage, milestone, MILESTONES
+from utils import get_async_client
+
+load_dotenv()
+log = logging.getLogger("server")
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "16"))        # numpy / SQLite / quiz work
+BATCH_MS = float(os.getenv("SERVER_BATCH_MS", "5"))            # micro-batch window for queries
+BATCH_MAX = int(os.getenv("SERVER_BATCH_MAX", str(rag.QUERY_BLOCK)))
+CHAT_CONCURRENCY = int(os.getenv("SERVER_CHAT_CONCURRENCY", "64"))   # chat calls in flight
+RETRIEVE_K = 8
+
+_POOL = ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix="server")
+
+async def _run(fn: Callable, *args):
+    """fn(*args) on the worker pool, inside the caller's trace."""
+    return await asyncio.get_running_loop().run_in_executor(_POOL, bind(fn), *args)
+
+class MicroBatcher:
+    """Collects submit(key, item) calls for `window` seconds (or max_items) per key, then
+    runs fn(key, items) -> results once on the worker pool and hands each caller its result."""
+
+    def __init__(self, fn: Callable[[Hashable, List], List], window: float = BATCH_MS / 1e3,
+                 max_items: int = BATCH_MAX):
+        self.fn, self.window, self.max_items = fn, window, max_items
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self.batches = self.items = 0
+
+    async def submit(self, key: Hashable, item):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            loop.call_later(self.window, self._flush, key, batch)
+        batch.append((item, fut))
+        if len(batch) >= self.max_items:
+            self._flush(key, batch)
+        return await fut
+
+    def _flush(self, key: Hashable, batch: List):
+        if self._pending.get(key) is not batch:   # already flushed when it filled up
+            return
+        del self._pending[key]
+        asyncio.ensure_future(self._execute(key, batch))
+
+    async def _execute(self, key: Hashable, batch: List):
+        self.batches += 1; self.items += len(batch)
+        try:
+            results = await _run(self.fn, key, [item for item, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done(): fut.set_exception(e)
+            return
+        for (_, fut), r in zip(batch, results):
+            if not fut.done(): fut.set_result(r)   # done = caller went away (cancelled)
+
+    def stats(self) -> Dict:
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch": (self.items / self.batches) if self.batches else 0.0}
+
+class SingleFlight:
+    """do(key, fn): concurrent calls with the same key share one run of fn()."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key) if self._inflight.get(key) is t else None)
+        else:
+            self.coalesced += 1
+        # shield: one caller disconnecting must not cancel the work the others wait for
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+def _embed_batch(_key, queries: List[str]) -> List:
+    return list(rag._embed_queries(queries))
+
+def _retrieve_batch(key: Tuple[str, int, bool, Tuple], queries: List[str]) -> List[List[Dict]]:
+    course, k, exact, where = key
+    return rag.retrieve_many(queries, k, exact=exact, course=course, where=dict(where) or None)
+
+class Service:
+    def __init__(self):
+        self.embeds = MicroBatcher(_embed_batch)
+        self.searches = MicroBatcher(_retrieve_batch)
+        self.flights = SingleFlight()
+        self.chat_slots = asyncio.Semaphore(CHAT_CONCURRENCY)
+
+    async def retrieve(self, query: str, k: int = RETRIEVE_K, exact: bool = False,
+                       course: str = courses.DEFAULT, where: Dict | None = None) -> List[Dict]:
+        # queries batch together when they share course, k, exact and filter
+        return await self.searches.submit((course, k, exact, filters.key(where)), query)
+
+    async def answer(self, query: str, course: str = courses.DEFAULT) -> Dict:
+        return await self.flights.do(("answer", course, normalize(query)), lambda: self._answer(query, course))
+
+    async def _answer(self, query: str, course: str) -> Dict:
+        # rag.answer() step by step, with the embedding, search and chat calls made async
+        with span("server.answer", course=course):
+            cache, scope, version = get_answer_cache(), rag._scope(course), rag._index_mtime(course)
+            hit = await _run(cache.lookup_exact, scope, version, query)
+            vec = None
+            if hit is None:
+                vec = await self.embeds.submit(None, query)    # lands in rag's query LRU
+                hit = await _run(cache.lookup_similar, scope, version, vec)
+            if hit is not None:
+                ans, refs, cached_query = hit
+                ctx = await _run(rag._cached_ctx, refs, cached_query, course)
+                milestone("first_answer")
+                return {"answer": ans, "ctx": ctx, "cached": True}
+            ctx = await self.retrieve(query, rag.CONTEXT_CANDIDATES, course=course)
+            ctx = await _run(partial(rag.pack_context, ctx, course=course))
+            async with self.chat_slots:
+                with span("rag.chat", model=rag.CHAT_MODEL) as sp:
+                    resp = await get_async_client().chat.completions.create(
+                        model=rag.CHAT_MODEL,
+                        messages=rag._messages(query, ctx),
+                        temperature=0.2,
+                    )
+                    sp.set(**usage(resp))
+            ans = resp.choices[0].message.content
+            await _run(rag._cache_store, query, vec, version, ans, ctx, course)
+            milestone("first_answer")
+            return {"answer": ans, "ctx": ctx, "cached": False}
+
+    async def quiz(self, topic: str, n: int, difficulty: str, seen: List[int],
+                   course: str = courses.DEFAULT) -> Dict:
+        key = ("quiz", course, normalize(topic), n, difficulty.lower(), tuple(sorted(seen)))
+        # a private copy of seen per flight: make_quiz adds the ids it serves
+        return await self.flights.do(
+            key, lambda: _run(quiz.make_quiz, topic, n, difficulty, True, set(seen), course))
+
+    def stats(self) -> Dict:
+        return {"embed_batches": self.embeds.stats(), "search_batches": self.searches.stats(),
+                "singleflight": self.flights.stats(), "answer_cache": get_answer_cache().stats(),
+                "query_embeddings": rag.embed_cache_stats(), "indexes": rag.index_stats(),
+                "startup_s": dict(MILESTONES)}
+
+# --- HTTP layer
+
+def _error(status: int, msg: str) -> web.Response:
+    return web.json_response({"error": msg}, status=status)
+
+async def _body(request: web.Request) -> Dict:
+    try:
+        body = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "body must be JSON"}), content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "body must be a JSON object"}),
+                                 content_type="application/json")
+    return body
+
+def _text(body: Dict, field: str) -> str:
+    v = body.get(field)
+    if not isinstance(v, str) or not v.strip():
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{field}' is required"}),
+                                 content_type="application/json")
+    return v.strip()
+
+def _int(body: Dict, field: str, default: int, lo: int, hi: int) -> int:
+    v = body.get(field)
+    if v is None:
+        return default
+    try:
+        if isinstance(v, bool): raise TypeError
+        return max(lo, min(int(v), hi))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{field}' must be an integer"}),
+                                 content_type="application/json")
+
+def _ids(body: Dict, field: str) -> List[int]:
+    v = body.get(field) or []
+    if not isinstance(v, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in v):
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{field}' must be a list of integer ids"}),
+                                 content_type="application/json")
+    return v
+
+def _course(course) -> str:
+    try:
+        return courses.check(course or courses.DEFAULT)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=json.dumps({"error": str(e)}), content_type="application/json")
+
+def _where(where) -> Dict | None:
+    try:
+        return filters.check(where)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=json.dumps({"error": str(e)}), content_type="application/json")
+
+@web.middleware
+async def _errors(request: web.Request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except RuntimeError as e:       # e.g. no index built yet
+        return _error(503, str(e))
+    except Exception as e:
+        log.exception("%s %s failed", request.method, request.path)
+        return _error(500, f"{type(e).__name__}: {e}")
+
+async def handle_retrieve(request: web.Request) -> web.Response:
+    body = await _body(request)
+    k = _int(body, "k", RETRIEVE_K, 1, 50)
+    hits = await request.app["service"].retrieve(_text(body, "query"), k, bool(body.get("exact")),
+                                                 _course(body.get("course")), _where(body.get("where")))
+    return web.json_response({"hits": hits})
+
+async def handle_answer(request: web.Request) -> web.Response:
+    body = await _body(request)
+    res = await request.app["service"].answer(_text(body, "query"), _course(body.get("course")))
+    return web.json_response(res)
+
+async def handle_quiz(request: web.Request) -> web.Response:
+    body = await _body(request)
+    n = _int(body, "n", 5, 1, 20)
+    seen = _ids(body, "seen")
+    res = await request.app["service"].quiz(_text(body, "topic"), n, str(body.get("difficulty") or "easy"), seen,
+                                            _course(body.get("course")))
+    return web.json_response(res)
+
+async def handle_health(request: web.Request) -> web.Response:
+    course = _course(request.query.get("course"))
+    version = rag._index_mtime(course)
+    idx = rag._INDEXES.peek(course)
+    return web.json_response({"status": "ok" if version else "no index", "course": course,
+                              "index_version": version, "rows": len(idx) if idx is not None else None})
+
+async def handle_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["service"].stats())
+
+async def _on_startup(app: web.Application):
+    app["service"] = Service()
+    rag.preload()   # opens the default course's index in the background; others open on first use
+    milestone("server_listening")
+
+def make_app() -> web.Application:
+    app = web.Application(middlewares=[_errors], client_max_size=1 << 20)
+    app.on_startup.append(_on_startup)
+    app.router.add_post("/retrieve", handle_retrieve)
+    app.router.add_post("/answer", handle_answer)
+    app.router.add_post("/quiz", handle_quiz)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/stats", handle_stats)
+    return app
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Learning Coach query service")
+    ap.add_argument("--host", default=SERVER_HOST)
+    ap.add_argument("--port", type=int, default=SERVER_PORT)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    web.run_app(make_app(), host=args.host, port=args.port, backlog=1024)
@@ -0,0 +1,262 @@
+# shards.py — scatter-gather exact search over index shards served by worker processes
+#
+# A shard is a run of consecutive source files: their row ranges from the ingest manifest, cut
+# into equal shares (a file crossing a cut, e.g. one big textbook, is split between shards).
+# Tombstoned rows belong to no file, so no shard ever scores them. Each shard is served by a
+# persistent worker process that memory-maps the published version once and only touches the
+# pages of its own rows. A query block is sent to every shard, each returns its local top-k,
+# and the parent merges them. Shards score on separate cores, so exact-search latency drops
+# with the core count and the parent process never pages in the whole vector matrix.
+# rag only shards indexes without an IVF index (below ANN_MIN_ROWS, or ANN_MIN_ROWS raised to
+# keep search exact): with IVF, unfiltered queries never score the whole matrix.
+#
+#   python shards.py [--course ID | --synthetic N] [--shards 1 2 4 8] [--queries 200] [--json out.json]
+#
+# reports exact-search latency per shard count against in-process scoring (shards=1).
+import os, time, threading, logging
+import multiprocessing as mp
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+import store
+
+log = logging.getLogger("shards")
+RETRIEVE_SHARDS = int(os.getenv("RETRIEVE_SHARDS", "0"))     # worker processes per index; 0/1 = in-process
+SHARD_MIN_ROWS = int(os.getenv("SHARD_MIN_ROWS", "50000"))   # smaller indexes are scored in-process
+_BLAS_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+Ranges = List[Tuple[int, int]]
+
+def live_ranges(idx: store.Index) -> Ranges:
+    """Row ranges [a, b) of the files in idx's manifest in row order (all rows for legacy indexes)."""
+    files = idx.manifest.get("files")
+    if files is None:
+        return [(0, len(idx))] if len(idx) else []
+    return sorted((a, b) for a, b in (e["rows"] for e in files.values()) if b > a)
+
+def partition(ranges: Ranges, n: int) -> List[Ranges]:
+    """Up to n groups of consecutive ranges with about equal row counts; a range crossing a
+    group boundary (one big textbook) is split there. Adjacent ranges of a group are merged,
+    so without tombstones every shard is one contiguous slice of the index."""
+    share = max(1, -(-sum(b - a for a, b in ranges) // max(1, n)))
+    groups, cur, used = [], [], 0
+    for a, b in ranges:
+        while a < b:
+            take = min(b - a, share - used)
+            if cur and cur[-1][1] == a:
+                cur[-1] = (cur[-1][0], a + take)
+            else:
+                cur.append((a, a + take))
+            a += take; used += take
+            if used == share:
+                groups.append(cur); cur, used = [], 0
+    if cur:
+        groups.append(cur)
+    return groups
+
+def _serve(conn, vdir: str, ranges: Ranges):
+    """Worker loop: (Q [B, D], k) -> (global row ids [k, B], scores [k, B]) of its shard."""
+    idx = store.open_index(Path(vdir))
+    rowids = np.concatenate([np.arange(a, b, dtype=np.int64) for a, b in ranges])
+    conn.send(len(rowids))   # ready
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:     # parent went away
+            return
+        if msg is None:
+            return
+        Q, k = msg
+        try:
+            sims = np.concatenate([idx.scores(Q.T, slice(a, b)) for a, b in ranges])
+            top = store.topk(sims, k)
+            conn.send((rowids[top], np.take_along_axis(sims, top, axis=0)))
+        except Exception as e:
+            conn.send(e)
+
+@contextmanager
+def _single_threaded_blas():
+    # one core per worker: workers inherit the environment at start, the parent keeps its own
+    saved = {v: os.environ.get(v) for v in _BLAS_VARS}
+    os.environ.update({v: "1" for v in _BLAS_VARS})
+    try:
+        yield
+    finally:
+        for v, old in saved.items():
+            if old is None: os.environ.pop(v, None)
+            else: os.environ[v] = old
+
+class ShardPool:
+    """One persistent worker process per shard of one index version.
+
+    Workers are started with "spawn" (nothing inherited from the parent's threads) and
+    open the version in the background; the first search waits until they are ready.
+    Searches are serialized per pool. A dead worker makes every later search raise
+    RuntimeError, so the caller can fall back to scoring in-process.
+    """
+
+    def __init__(self, vdir: Path, groups: List[Ranges]):
+        ctx = mp.get_context("spawn")
+        self.groups = groups
+        self.rows = [sum(b - a for a, b in g) for g in groups]
+        self.searches = 0
+        self.broken = False
+        self._ready = False
+        self._lock = threading.Lock()
+        self._conns, self._procs = [], []
+        with _single_threaded_blas():
+            for i, g in enumerate(groups):
+                parent, child = ctx.Pipe()
+                p = ctx.Process(target=_serve, args=(child, str(vdir), g), name=f"shard-{i}", daemon=True)
+                p.start()
+                child.close()
+                self._conns.append(parent); self._procs.append(p)
+
+    @classmethod
+    def for_index(cls, vdir: Path, idx: store.Index, n: int) -> "ShardPool":
+        return cls(vdir, partition(live_ranges(idx), n))
+
+    def wait_ready(self):
+        with self._lock:
+            self._wait_ready()
+
+    def _wait_ready(self):
+        if not self._ready:
+            for c in self._conns:
+                c.recv()
+            self._ready = True
+
+    def search(self, Q: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Per query (ids, scores) of the best k rows over all shards, best first."""
+        with self._lock:
+            if self.broken:
+                raise RuntimeError("shard worker exited")
+            try:
+                self._wait_ready()
+                for c in self._conns:
+                    c.send((np.ascontiguousarray(Q, dtype=np.float32), k))
+                parts = [c.recv() for c in self._conns]
+            except (EOFError, OSError) as e:
+                self.broken = True
+                raise RuntimeError(f"shard worker exited: {e!r}") from e
+            self.searches += 1
+        err = next((p for p in parts if isinstance(p, Exception)), None)
+        if err is not None:
+            raise RuntimeError(f"shard search failed: {err!r}")
+        ids = np.concatenate([p[0] for p in parts])   # [shards * k, B]
+        sc = np.concatenate([p[1] for p in parts])
+        top = store.topk(sc, k)
+        ids, sc = np.take_along_axis(ids, top, axis=0), np.take_along_axis(sc, top, axis=0)
+        return [(ids[:, j], sc[:, j]) for j in range(Q.shape[0])]
+
+    def close(self):
+        for c in self._conns:
+            try:
+                c.send(None); c.close()
+            except OSError:
+                pass
+        for p in self._procs:
+            p.join(timeout=1)
+            if p.is_alive():
+                p.terminate()
+        self.broken = True
+
+    def stats(self) -> Dict:
+        return {"shards": len(self.groups), "rows": self.rows, "searches": self.searches,
+                "alive": sum(p.is_alive() for p in self._procs)}
+
+# --- latency vs shard count
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-12)
+
+def _synthetic(outdir: Path, n: int, dim: int, rows_per_file: int = 2000, seed: int = 0) -> Path:
+    """A published-style version directory of n random clustered rows in files of rows_per_file."""
+    import json
+    rng = np.random.default_rng(seed)
+    centers = _unit(rng.normal(size=(max(1, n // 500), dim)))
+    segs, files = [], {}
+    for a in range(0, n, store.SEGMENT_ROWS):
+        b = min(n, a + store.SEGMENT_ROWS)
+        x = centers[rng.integers(0, len(centers), b - a)] + rng.normal(0, 0.05, (b - a, dim))
+        segs.append(store.write_segment(outdir, _unit(x).astype(np.float32), ({"text": ""} for _ in range(b - a))))
+    for a in range(0, n, rows_per_file):
+        files[f"file{a // rows_per_file:05d}.md"] = {"rows": [a, min(n, a + rows_per_file)]}
+    with open(outdir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump({"rows": n, "files": files, "store": {"segments": segs}}, f)
+    return outdir
+
+def report(vdir: Path, shard_counts=(1, 2, 4, 8), k: int = 10, n_queries: int = 200,
+           batch: int = 1, seed: int = 0) -> Dict:
+    idx = store.open_index(vdir)
+    rng = np.random.default_rng(seed)
+    qids = np.sort(rng.choice(len(idx), min(len(idx), n_queries), replace=False))
+    Q = _unit(idx.rows_f32(qids) + rng.normal(0, 0.02, (len(qids), idx.dim))).astype(np.float32)
+    blocks = [Q[a:a + batch] for a in range(0, len(Q), batch)]
+    alive = np.zeros(len(idx), dtype=bool)
+    for a, b in live_ranges(idx):
+        alive[a:b] = True
+
+    def in_process(q):
+        sims = idx.scores(q.T)
+        sims[~alive] = -np.inf
+        top = store.topk(sims, k)
+        return [top[:, j] for j in range(len(q))]
+
+    out = {"rows": len(idx), "dim": idx.dim, "k": k, "queries": len(Q), "batch": batch,
+           "cpus": os.cpu_count(), "runs": []}
+    exact = None
+    for n in shard_counts:
+        pool, start_s = None, 0.0
+        if n > 1:
+            t0 = time.perf_counter()
+            pool = ShardPool.for_index(vdir, idx, n)
+            pool.wait_ready()
+            start_s = time.perf_counter() - t0
+        search = in_process if pool is None else (lambda q: [ids for ids, _ in pool.search(q, k)])
+        search(blocks[0])   # warm the page cache / workers
+        ms, got = [], []
+        for q in blocks:
+            t0 = time.perf_counter()
+            got += search(q)
+            ms.append((time.perf_counter() - t0) * 1e3)
+        if pool is not None:
+            pool.close()
+        if exact is None:
+            exact = in_process(Q) if n > 1 else got
+        agree = float(np.mean([set(a.tolist()) == set(b.tolist()) for a, b in zip(got, exact)]))
+        out["runs"].append({"shards": n, "p50_ms": float(np.percentile(ms, 50)),
+                            "p99_ms": float(np.percentile(ms, 99)), "start_s": start_s, "agree": agree})
+    base = out["runs"][0]["p50_ms"]
+    for r in out["runs"]:
+        r["speedup"] = base / r["p50_ms"] if r["p50_ms"] else 0.0
+    return out
+
+if __name__ == "__main__":
+    import argparse, json, tempfile
+    ap = argparse.ArgumentParser(description="Exact-search latency vs shard count")
+    ap.add_argument("--course", default="default", help="course whose index to measure")
+    ap.add_argument("--synthetic", type=int, default=0, help="use N random clustered rows instead of a course index")
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=1, help="queries per search (the server micro-batches)")
+    ap.add_argument("--json", help="also write the report here")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            vdir = _synthetic(Path(tmp), args.synthetic, args.dim)
+        else:
+            import courses
+            vdir = store.current_dir(courses.index_root(args.course))
+        r = report(vdir, args.shards, k=args.k, n_queries=args.queries, batch=args.batch)
+    print(f"rows={r['rows']} dim={r['dim']} k={r['k']} batch={r['batch']} cpus={r['cpus']}")
+    print(f"{'shards':>6} {'p50 ms':>8} {'p99 ms':>8} {'speedup':>8} {'start s':>8} {'agree':>6}")
+    for row in r["runs"]:
+        print(f"{row['shards']:>6} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['speedup']:>7.2f}x "
+              f"{row['start_s']:>8.2f} {row['agree']:>6.3f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, indent=1)
@@ -0,0 +1,341 @@
+# store.py — on-disk index format: memory-mapped vector segments + offset-indexed metadata
+#
+# An index directory holds immutable segments plus manifest.json, which is written
+# last and is the single commit point. Each segment <seg> is:
+#   vectors.<seg>.npy   [n, D] float32 | float16 | int8 (opened with mmap_mode="r")
+#   scales.<seg>.npy    [n] float32 per-row scales (int8 only)
+#   meta.<seg>.bin      concatenated UTF-8 JSON records (source, chunk, text, ...)
+#   metaidx.<seg>.npy   [n+1] int64 byte offsets into meta.<seg>.bin
+# Global row ids run through the segments in manifest order. Readers only touch the
+# metadata of rows they actually return.
+#
+# Versions: the index root (data/simple) holds one directory per published version,
+# v<hex>/, and a CURRENT file naming the live one. A reindex builds the next version
+# in a staging directory (named by NEXT so a crashed build resumes there) that starts
+# as hard links to the current version's files. Replacing CURRENT publishes it in one
+# rename; readers keep the version they opened until they reload.
+import os, json, mmap, shutil, time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List
+import numpy as np
+
+DTYPES = ("float32", "float16", "int8")
+BLOCK_ROWS = 65536   # rows converted to float32 at a time when scoring quantized data
+SEGMENT_ROWS = int(os.getenv("SEGMENT_ROWS", "8192"))
+
+def _seg_files(outdir: Path, seg: str) -> Dict[str, Path]:
+    return {
+        "vectors": outdir / f"vectors.{seg}.npy",
+        "scales": outdir / f"scales.{seg}.npy",
+        "meta": outdir / f"meta.{seg}.bin",
+        "metaidx": outdir / f"metaidx.{seg}.npy",
+    }
+
+def new_name(prefix: str = "s") -> str:
+    return f"{prefix}{time.time_ns():x}"
+
+def quantize(vecs: np.ndarray, dtype: str):
+    """Return (stored array, per-row scales or None)."""
+    if dtype == "float32":
+        return np.ascontiguousarray(vecs, dtype=np.float32), None
+    if dtype == "float16":
+        return vecs.astype(np.float16), None
+    if dtype == "int8":
+        scales = (np.abs(vecs).max(axis=1) / 127.0).astype(np.float32)
+        scales[scales == 0] = 1.0
+        q = np.rint(vecs / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return q, scales
+    raise ValueError(f"Unknown index dtype {dtype!r}; expected one of {DTYPES}")
+
+def write_segment(outdir: Path, vecs: np.ndarray, metas: Iterable[Dict], dtype: str = "float32") -> Dict:
+    """Write one immutable segment and return its header for the manifest."""
+    outdir.mkdir(parents=True, exist_ok=True)
+    seg = new_name()
+    files = _seg_files(outdir, seg)
+    data, scales = quantize(vecs, dtype)
+    # metadata first and vectors last: a segment without vectors is never listed
+    offsets = [0]
+    with open(files["meta"], "wb") as f:
+        for m in metas:
+            b = json.dumps(m, ensure_ascii=False).encode("utf-8")
+            f.write(b); offsets.append(offsets[-1] + len(b))
+    if len(offsets) - 1 != len(data):
+        raise ValueError(f"{len(data)} vectors but {len(offsets) - 1} metadata records")
+    with open(files["metaidx"], "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64))
+    if scales is not None:
+        with open(files["scales"], "wb") as f:
+            np.save(f, scales)
+    with open(files["vectors"], "wb") as f:
+        np.save(f, data)
+    return {"name": seg, "dtype": dtype, "rows": int(len(data))}
+
+class SegmentWriter:
+    """Buffers rows and writes a segment every segment_rows rows; on_flush(header) commits it."""
+
+    def __init__(self, outdir: Path, dtype: str = "float32", segment_rows: int | None = None,
+                 on_flush: Callable[[Dict], None] | None = None):
+        self.outdir, self.dtype, self.segment_rows = outdir, dtype, segment_rows or SEGMENT_ROWS
+        self.on_flush = on_flush
+        self.rows = 0          # rows added so far
+        self.flushed = 0       # rows written to segments so far
+        self._vecs: List[np.ndarray] = []
+        self._metas: List[Dict] = []
+        self._pending = 0
+
+    def add(self, vecs: np.ndarray, metas: List[Dict]):
+        start = 0
+        while start < len(metas):
+            take = min(len(metas) - start, self.segment_rows - self._pending)
+            self._vecs.append(vecs[start:start+take]); self._metas.extend(metas[start:start+take])
+            self._pending += take; self.rows += take; start += take
+            if self._pending >= self.segment_rows:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        hdr = write_segment(self.outdir, np.concatenate(self._vecs), self._metas, self.dtype)
+        self._vecs, self._metas, self._pending = [], [], 0
+        self.flushed += hdr["rows"]
+        if self.on_flush:
+            self.on_flush(hdr)
+
+def cleanup(outdir: Path, keep: Iterable[str]):
+    """Best-effort removal of files of unlisted segments (may still be mapped elsewhere)."""
+    keep = set(keep)
+    for p in outdir.glob("*.*.*"):
+        parts = p.name.split(".")
+        if len(parts) == 3 and parts[2] in ("npy", "bin") and parts[1] not in keep:
+            try: p.unlink()
+            except OSError: pass
+    for name in ("index.npy", "meta.jsonl"):   # legacy format
+        try: (outdir / name).unlink()
+        except OSError: pass
+
+def _read_pointer(root: Path, name: str) -> Path | None:
+    try:
+        v = (root / name).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return root / v if v and (root / v).is_dir() else None
+
+def _write_pointer(root: Path, name: str, vdir: Path):
+    tmp = root / (name + ".tmp")
+    tmp.write_text(vdir.name, encoding="utf-8")
+    os.replace(tmp, root / name)
+
+def current_dir(root: Path) -> Path:
+    """Directory of the published index version (root itself for the flat, unversioned layout)."""
+    return _read_pointer(root, "CURRENT") or root
+
+def staging_dir(root: Path) -> Path:
+    """The unpublished version being built: resumed if a build was interrupted, else a new
+    directory seeded with hard links to the current version's files (copies if links fail)."""
+    vdir = _read_pointer(root, "NEXT")
+    if vdir is not None:
+        return vdir
+    base = current_dir(root)
+    vdir = root / new_name("v")
+    vdir.mkdir(parents=True)
+    if base.is_dir():
+        for p in base.iterdir():
+            if not p.is_file() or p.name in ("CURRENT", "NEXT") or p.name.endswith(".tmp"):
+                continue
+            try:
+                os.link(p, vdir / p.name)
+            except OSError:
+                shutil.copy2(p, vdir / p.name)
+    _write_pointer(root, "NEXT", vdir)
+    return vdir
+
+def publish(root: Path, vdir: Path, keep: int = 2):
+    """Make vdir the live version (atomic rename of CURRENT) and prune older versions."""
+    _write_pointer(root, "CURRENT", vdir)
+    abandon(root)
+    prune(root, keep)
+
+def abandon(root: Path):
+    """Forget the staging version (after publishing it, or when it holds no changes)."""
+    try: (root / "NEXT").unlink()
+    except OSError: pass
+
+def prune(root: Path, keep: int = 2):
+    """Delete all but the newest `keep` versions (never CURRENT or NEXT), plus flat-layout files."""
+    live = {p for p in (_read_pointer(root, "CURRENT"), _read_pointer(root, "NEXT")) if p}
+    if not live:
+        return
+    versions = sorted((p for p in root.glob("v*") if p.is_dir()), key=lambda p: p.name, reverse=True)
+    for p in versions[keep:]:
+        if p not in live:
+            shutil.rmtree(p, ignore_errors=True)   # readers that mapped its files keep them
+    cleanup(root, [])
+    try: (root / "manifest.json").unlink()
+    except OSError: pass
+
+def _map_blob(path: Path):
+    if path.stat().st_size == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class Segment:
+    """One memory-mapped slice of the index."""
+
+    def __init__(self, vectors, scales=None, meta_blob=None, meta_offsets=None,
+                 meta_list: List[Dict] | None = None):
+        self.vectors = vectors
+        self.scales = scales
+        self._blob = meta_blob
+        self._offsets = meta_offsets
+        self._meta_list = meta_list
+
+    @classmethod
+    def open(cls, outdir: Path, hdr: Dict) -> "Segment":
+        files = _seg_files(outdir, hdr["name"])
+        vectors = np.load(files["vectors"], mmap_mode="r")
+        scales = np.load(files["scales"], mmap_mode="r") if hdr["dtype"] == "int8" else None
+        offsets = np.load(files["metaidx"], mmap_mode="r")
+        return cls(vectors, scales, _map_blob(files["meta"]), offsets)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def slice(self, a: int, b: int) -> "Segment":
+        """Rows a:b as a segment (views of the same maps; vectors and scales only)."""
+        return Segment(self.vectors[a:b], None if self.scales is None else self.scales[a:b])
+
+    def meta(self, i: int) -> Dict:
+        if self._meta_list is not None:
+            return self._meta_list[i]
+        a, b = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json.loads(self._blob[a:b])
+
+    def rows_f32(self, ids=None) -> np.ndarray:
+        v = self.vectors if ids is None else self.vectors[ids]
+        out = np.asarray(v, dtype=np.float32)
+        if self.scales is not None:
+            s = self.scales if ids is None else self.scales[ids]
+            out = out * s[:, None]
+        return out
+
+    def scores(self, q: np.ndarray) -> np.ndarray:
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ q
+        n = len(self)
+        out = np.empty((n,) + q.shape[1:], dtype=np.float32)
+        for a in range(0, n, BLOCK_ROWS):
+            b = min(n, a + BLOCK_ROWS)
+            s = self.vectors[a:b].astype(np.float32) @ q
+            if self.scales is not None:
+                s *= self.scales[a:b].reshape((-1,) + (1,) * (q.ndim - 1))
+            out[a:b] = s
+        return out
+
+class Index:
+    """Read-only view over the segments of one manifest; global row ids span all segments."""
+
+    def __init__(self, segments: List[Segment], manifest: Dict | None = None):
+        self.segments = segments
+        self.manifest = manifest or {}
+        self.bounds = np.cumsum([0] + [len(s) for s in segments])   # [S+1] row offsets
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    @property
+    def dim(self) -> int:
+        for s in self.segments:
+            if s.vectors.ndim == 2: return s.vectors.shape[1]
+        return 0
+
+    def _locate(self, i: int):
+        s = int(np.searchsorted(self.bounds, i, side="right")) - 1
+        return self.segments[s], i - int(self.bounds[s])
+
+    def meta(self, i: int) -> Dict:
+        seg, j = self._locate(i)
+        return seg.meta(j)
+
+    def iter_meta(self) -> Iterator[Dict]:
+        for seg in self.segments:
+            for j in range(len(seg)):
+                yield seg.meta(j)
+
+    def rows_f32(self, ids=None) -> np.ndarray:
+        """Dequantized float32 copies of the given rows (a slice, an id array, or all rows)."""
+        if ids is None:
+            ids = slice(0, len(self))
+        if isinstance(ids, slice):
+            a, b, _ = ids.indices(len(self))
+            parts = []
+            for s, seg in enumerate(self.segments):
+                lo, hi = max(a, self.bounds[s]), min(b, self.bounds[s + 1])
+                if lo < hi:
+                    parts.append(seg.rows_f32(slice(lo - self.bounds[s], hi - self.bounds[s])))
+            return np.concatenate(parts) if parts else np.zeros((0, self.dim), dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.empty((len(ids), self.dim), dtype=np.float32)
+        which = np.searchsorted(self.bounds, ids, side="right") - 1
+        for s in np.unique(which):
+            m = which == s
+            out[m] = self.segments[s].rows_f32(ids[m] - self.bounds[s])
+        return out
+
+    def scores(self, q: np.ndarray, rows: slice | None = None) -> np.ndarray:
+        """Dot products of every row (or of rows a:b) with q ([D] or [D, B]); float32 segments
+        use the map directly."""
+        a, b = (0, len(self)) if rows is None else rows.indices(len(self))[:2]
+        if len(self.segments) == 1 and (a, b) == (0, len(self)):
+            return self.segments[0].scores(q)
+        out = np.empty((max(0, b - a),) + q.shape[1:], dtype=np.float32)
+        for s, seg in enumerate(self.segments):
+            lo, hi = max(a, self.bounds[s]), min(b, self.bounds[s + 1])
+            if lo >= hi:
+                continue
+            if (lo, hi) != (self.bounds[s], self.bounds[s + 1]):
+                seg = seg.slice(lo - self.bounds[s], hi - self.bounds[s])
+            out[lo - a:hi - a] = seg.scores(q)
+        return out
+
+def topk(sims: np.ndarray, k: int) -> np.ndarray:
+    """Row positions of the k best scores per column of sims [N, B], best first -> [k, B]."""
+    n = sims.shape[0]
+    k = min(k, n)
+    if k == 0:
+        return np.zeros((0, sims.shape[1]), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-sims, k - 1, axis=0)[:k]      # O(N) selection
+    else:
+        part = np.broadcast_to(np.arange(n)[:, None], sims.shape)
+    order = np.argsort(-np.take_along_axis(sims, part, axis=0), axis=0)  # sort only k rows
+    return np.take_along_axis(part, order, axis=0)
+
+def segment_headers(man: Dict) -> List[Dict]:
+    hdr = man.get("store") or {}
+    if "segments" in hdr:
+        return hdr["segments"]
+    if "generation" in hdr:   # single-generation layout written before segments
+        return [{"name": hdr["generation"], "dtype": hdr["dtype"], "rows": hdr["rows"]}]
+    return []
+
+def open_segments(outdir: Path, man: Dict) -> Index:
+    """Index over the segments listed in man (which need not be committed yet)."""
+    return Index([Segment.open(outdir, h) for h in segment_headers(man)], man)
+
+def open_index(outdir: Path) -> Index:
+    man_path = outdir / "manifest.json"
+    man = {}
+    if man_path.exists():
+        with open(man_path, "r", encoding="utf-8") as f:
+            man = json.load(f)
+    if man.get("store"):
+        return open_segments(outdir, man)
+
+    # legacy index.npy + meta.jsonl (pre-manifest or pre-store ingest)
+    idx_path, meta_path = outdir / "index.npy", outdir / "meta.jsonl"
+    if not idx_path.exists() or not meta_path.exists():
+        raise FileNotFoundError(outdir)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        metas = [json.loads(line) for line in f]
+    return Index([Segment(np.load(idx_path, mmap_mode="r"), meta_list=metas)], man)
@@ -9,11 +9,18 @@ except Exception as e:
     print("dotenv/load error:", e, flush=True)
     print(traceback.format_exc(), flush=True)
 
+# --offline: every OpenAI call goes to the deterministic local stand-in (fake_openai.py)
+OFFLINE = "--offline" in sys.argv[1:]
+if OFFLINE:
+    import fake_openai
+    fake = fake_openai.install()
+    print("Offline: using fake_openai", flush=True)
+
 # 1) OpenAI sanity
 print("\n[1] OpenAI chat sanity …", flush=True)
 try:
     from openai import OpenAI
-    oc = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    oc = fake if OFFLINE else OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     reply = oc.chat.completions.create(
         model="gpt-4o-mini",
         messages=[{"role":"user","content":"Say OK if you can see this."}]
@@ -23,26 +30,26 @@ except Exception as e:
     print("OpenAI chat failed:", e, flush=True)
     print(traceback.format_exc(), flush=True)
 
-# 2) Manual query embedding + Chroma query
-print("\n[2] Manual query embedding + Chroma …", flush=True)
+# 2) Manual query embedding + NumPy index query
+print("\n[2] Manual query embedding + NumPy index …", flush=True)
 try:
-    from openai import OpenAI
-    oc = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    import numpy as np
+    from embedders import get_embedder
     print("Embedding…", flush=True)
-    emb = oc.embeddings.create(model="text-embedding-3-large", input="gradient descent vs sgd").data[0].embedding
+    emb = get_embedder().embed(["gradient descent vs sgd"])[0]
     print("Embedding len:", len(emb), flush=True)
 
-    import chromadb
-    print("Connecting to Chroma…", flush=True)
-    col = chromadb.PersistentClient(path="data/chroma").get_collection("course")
-    print("Querying with query_embeddings…", flush=True)
-    res = col.query(query_embeddings=[emb], n_results=3)
-    print("IDs:", res.get("ids"), flush=True)
-    docs = res.get("documents", [[]])
-    snippet = (docs[0][0] or "")[:200] if docs and docs[0] else ""
+    import store, courses
+    print("Opening index…", flush=True)
+    idx = store.open_index(store.current_dir(courses.index_root()))
+    print("Rows:", len(idx), "dim:", idx.dim, flush=True)
+    sims = idx.scores(emb / (np.linalg.norm(emb) + 1e-12))
+    top = np.argsort(-sims)[:3]
+    print("IDs:", [int(i) for i in top], flush=True)
+    snippet = (idx.meta(int(top[0])).get("text") or "")[:200] if len(top) else ""
     print("First doc snippet:", snippet, flush=True)
 except Exception as e:
-    print("Chroma query failed:", e, flush=True)
+    print("Index query failed:", e, flush=True)
     print(traceback.format_exc(), flush=True)
 
 # 3) Full RAG answer()
@@ -1,15 +1,22 @@
-import os, traceback
+import os, sys, traceback
 from dotenv import load_dotenv
 
 print("Step 0: loading .env …")
 load_dotenv()
 print("Has OPENAI_API_KEY?", bool(os.getenv("OPENAI_API_KEY")))
 
+# --offline: every OpenAI call goes to the deterministic local stand-in (fake_openai.py)
+OFFLINE = "--offline" in sys.argv[1:]
+if OFFLINE:
+    import fake_openai
+    fake = fake_openai.install()
+    print("Offline: using fake_openai")
+
 # 1) OpenAI chat sanity check
 print("\nStep 1: OpenAI chat sanity check …")
 try:
     from openai import OpenAI
-    oc = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    oc = fake if OFFLINE else OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     mini_model = "gpt-4o-mini"  # cheaper; if unavailable, we'll try gpt-4o
     try:
         msg = oc.chat.completions.create(model=mini_model, messages=[{"role":"user","content":"Say OK if you can see this."}])
@@ -21,28 +28,15 @@ except Exception as e:
     print("OpenAI chat failed:", e)
     print(traceback.format_exc())
 
-# 2) Chroma retrieval sanity check
-print("\nStep 2: Chroma retrieval sanity check …")
+# 2) Index retrieval sanity check
+print("\nStep 2: index retrieval sanity check …")
 try:
-    import chromadb
-    from chromadb.utils import embedding_functions
-    ef = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model_name="text-embedding-3-large",  # MUST match ingest.py
-    )
-    client = chromadb.PersistentClient(path="data/chroma")
-    try:
-        col = client.get_collection("course", embedding_function=ef)
-        print("Got collection: course")
-    except Exception as e:
-        print("get_collection failed, creating:", e)
-        col = client.get_or_create_collection("course", embedding_function=ef)
-        print("Created collection: course (may be empty)")
-    qr = col.query(query_texts=["gradient descent"], n_results=3)
-    print("Query IDs:", qr.get("ids"))
-    print("Query docs len:", len(qr.get("documents", [[]])[0]) if qr.get("documents") else 0)
+    from rag import retrieve
+    hits = retrieve("gradient descent", k=3)
+    print("Hit ids:", [(h["source"], h["chunk"]) for h in hits])
+    print("Hits:", len(hits))
 except Exception as e:
-    print("Chroma retrieval failed:", e)
+    print("Index retrieval failed:", e)
     print(traceback.format_exc())
 
 # 3) Full RAG answer() test
@@ -0,0 +1,48 @@
+# Offline test setup: the fake OpenAI client, and every cache and index under a temp dir.
+import os, sys, tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# cache paths are read at import time: set them before any app module is imported
+_TMP = Path(tempfile.mkdtemp(prefix="learning-coach-tests-"))
+os.environ.update({
+    "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "sk-test",
+    "EMBED_PROVIDER": "openai",
+    "EMBED_CACHE_PATH": str(_TMP / "embeddings.sqlite"),
+    "ANSWER_CACHE_PATH": str(_TMP / "answers.sqlite"),
+    "QUIZ_BANK_PATH": str(_TMP / "quiz_bank.sqlite"),
+    "RETRIEVE_SHARDS": "0",
+})
+
+DIM = 64
+
+@pytest.fixture
+def fake():
+    import fake_openai
+    return fake_openai.install(dim=DIM)
+
+@pytest.fixture
+def course(tmp_path, monkeypatch, fake):
+    """Sources dir of the default course in a fresh data dir; small chunks, no background compaction."""
+    import courses, ingest, rag
+    monkeypatch.setattr(courses, "DATA", tmp_path / "data")
+    monkeypatch.setattr(ingest, "EXTRACT_CACHE", tmp_path / "data" / "cache" / "extract")
+    monkeypatch.setattr(ingest, "CHUNK_TOKENS", 40)
+    monkeypatch.setattr(ingest, "CHUNK_OVERLAP", 0)
+    monkeypatch.setattr(ingest, "COMPACT_RATIO", 2.0)   # tests call compact_index() themselves
+    monkeypatch.setattr(rag, "_INDEXES", rag._Resident(rag.INDEX_MEMORY_MB * 2**20))
+    src = courses.sources_dir()
+    src.mkdir(parents=True)
+    return src
+
+WORDS = ("gradient descent matrix vector loss neuron layer regression variance bias kernel margin "
+         "entropy tree split probability prior posterior sample estimate error model data").split()
+
+def text(topic: str, sentences: int = 12) -> str:
+    """Distinct sentences that all mention topic, so a query for topic finds this text."""
+    return " ".join(f"{topic.capitalize()} {WORDS[i % len(WORDS)]} {WORDS[(i * 7) % len(WORDS)]} "
+                    f"note number {i} about {topic}." for i in range(sentences))
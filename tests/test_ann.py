@@ -0,0 +1,44 @@
+import numpy as np
+
+import ann, ingest, rag, store
+from conftest import text
+
+def test_ivf_lists_partition_rows_and_full_probe_is_exact(tmp_path):
+    idx = ann._synthetic(3000, 16)
+    hdr = ann.build(idx, tmp_path, "a1", nlist=20)
+    ivf = ann.IVF.load(tmp_path, "a1")
+    assert hdr["nlist"] == 20 and hdr["rows"] == hdr["trained"] == 3000
+    assert sorted(np.asarray(ivf.rows).tolist()) == list(range(3000))
+    Q = idx.rows_f32(np.arange(0, 3000, 300)) + 0.01
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    exact = store.topk(idx.scores(Q.T), 5)
+    for j, (ids, _) in enumerate(ivf.search(idx, Q, 5, nprobe=20)):
+        assert ids.tolist() == exact[:, j].tolist()
+    # dead rows are skipped; a few probed lists still find the query's own cluster
+    alive = np.ones(3000, dtype=bool); alive[exact[0, 0]] = False
+    ids, _ = ivf.search(idx, Q[:1], 5, nprobe=3, alive=alive)[0]
+    assert exact[0, 0] not in ids and len(ids) == 5
+
+def test_ivf_is_extended_on_upsert_and_retrained_on_compaction(course, monkeypatch):
+    monkeypatch.setattr(ann, "ANN_MIN_ROWS", 10)
+    monkeypatch.setattr(ann, "ANN_NPROBE", 10**6)   # probe every list: IVF results == exact
+    monkeypatch.setattr(ann, "ANN_RETRAIN_DRIFT", 10.0)   # tiny indexes drift a lot: extend regardless
+    for name in ("a", "b", "c"):
+        (course / f"{name}.txt").write_text(text(name, 20), encoding="utf-8")
+    ingest.upsert_files()
+    first = ingest.load_manifest()["ann"]
+    (course / "d.txt").write_text(text("delta", 10), encoding="utf-8")
+    ingest.upsert_files()
+    man = ingest.load_manifest()
+    assert man["ann"]["rows"] == man["rows"] > first["rows"]
+    assert man["ann"]["trained"] == first["trained"]   # extended, not retrained
+    idx = rag._load_index()
+    assert idx.ivf is not None and sorted(idx.ivf.rows.tolist()) == list(range(man["rows"]))
+    assert rag.retrieve("delta", k=4) == rag.retrieve("delta", k=4, exact=True)
+
+    (course / "a.txt").unlink()
+    ingest.upsert_files()
+    ingest.compact_index()
+    man = ingest.load_manifest()
+    assert man["ann"]["rows"] == man["ann"]["trained"] == man["rows"]
+    assert all(h["source"] != "a.txt" for h in rag.retrieve("a", k=50))
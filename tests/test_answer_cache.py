@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+
+from answer_cache import AnswerCache, normalize
+
+def _unit(*xs):
+    v = np.array(xs, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+def test_answer_cache_exact_and_similar(tmp_path):
+    c = AnswerCache(tmp_path / "a.sqlite", sim=0.95)
+    v = _unit(1, 0, 0)
+    c.put("ml|model", 1.0, "What is  Bias?", v, "answer", [{"source": "a", "chunk": 0}])
+    assert normalize("  what is BIAS? ") == normalize("What is  Bias?")
+    assert c.lookup_exact("ml|model", 1.0, "what is bias?") == \
+        ("answer", [{"source": "a", "chunk": 0}], "What is  Bias?")
+    assert c.lookup_exact("ml|model", 1.0, "what is variance?") is None
+    assert c.lookup_similar("ml|model", 1.0, _unit(1, 0.1, 0))[0] == "answer"
+    assert c.lookup_similar("ml|model", 1.0, _unit(1, 1, 0)) is None
+    assert c.lookup_exact("other|model", 1.0, "what is bias?") is None
+
+def test_answer_cache_drops_other_versions_of_the_course(tmp_path):
+    c = AnswerCache(tmp_path / "a.sqlite")
+    c.put("ml|model", 1.0, "q", _unit(1, 0), "old", [])
+    c.put("art|model", 1.0, "q", _unit(1, 0), "art", [])
+    assert c.lookup_exact("ml|model", 2.0, "q") is None
+    assert c.lookup_exact("ml|model", 1.0, "q") is None     # purged when version 2 was seen
+    assert c.lookup_exact("art|model", 1.0, "q")[0] == "art"
+    assert c.stats()["entries"] == 1
+
+def test_answer_cache_expiry(tmp_path):
+    c = AnswerCache(tmp_path / "a.sqlite", ttl=0.05)
+    c.put("ml|m", 1.0, "q", _unit(1, 0), "a", [])
+    assert c.lookup_exact("ml|m", 1.0, "q") is not None
+    time.sleep(0.1)
+    assert c.lookup_exact("ml|m", 1.0, "q") is None
+    assert c.lookup_similar("ml|m", 1.0, _unit(1, 0)) is None
+
+def test_answer_cache_evicts_least_recently_hit(tmp_path):
+    c = AnswerCache(tmp_path / "a.sqlite", max_entries=2)
+    c.put("ml|m", 1.0, "first", None, "1", [])
+    time.sleep(0.01)
+    c.put("ml|m", 1.0, "second", None, "2", [])
+    time.sleep(0.01)
+    assert c.lookup_exact("ml|m", 1.0, "first")[0] == "1"
+    c.put("ml|m", 1.0, "third", None, "3", [])
+    assert c.lookup_exact("ml|m", 1.0, "second") is None
+    assert c.lookup_exact("ml|m", 1.0, "first")[0] == "1"
+    assert c.lookup_exact("ml|m", 1.0, "third")[0] == "3"
+
+def test_answer_cache_lookups_do_not_write(tmp_path):
+    c = AnswerCache(tmp_path / "a.sqlite")
+    c.put("ml|m", 1.0, "q", _unit(1, 0), "a", [])
+    c.lookup_exact("ml|m", 1.0, "q")                 # first lookup of this version may purge
+    writes = c._db.total_changes
+    for _ in range(5):
+        assert c.lookup_exact("ml|m", 1.0, "q") is not None
+        assert c.lookup_similar("ml|m", 1.0, _unit(1, 0)) is not None
+        assert c.lookup_exact("ml|m", 1.0, "other") is None
+    assert c._db.total_changes == writes
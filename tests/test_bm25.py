@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import bm25, store
+
+def _index(tmp_path, *segments):
+    hdrs = []
+    for texts in segments:
+        hdrs.append(store.write_segment(tmp_path, np.zeros((len(texts), 4), dtype=np.float32),
+                                        [{"text": t} for t in texts]))
+    idx = store.open_segments(tmp_path, {"store": {"segments": hdrs}})
+    assert bm25.build_missing(tmp_path, idx) == len(hdrs)
+    return bm25.BM25.load(tmp_path, idx)
+
+def test_scores_map_to_global_rows(tmp_path):
+    b = _index(tmp_path, ["the kernel trick", "gradient descent steps"],
+               ["a margin and a kernel", "kernel kernel kernel", "unrelated words"])
+    s = b.scores("kernel")
+    assert s.shape == (5,)
+    assert np.flatnonzero(s).tolist() == [0, 2, 3]
+    assert int(np.argmax(s)) == 3                   # highest term frequency
+    assert b.scores("nothing matches").sum() == 0
+    assert b.scores("").sum() == 0
+
+def test_search_skips_dead_rows(tmp_path):
+    b = _index(tmp_path, ["kernel one", "kernel two"], ["kernel three", "margin only"])
+    ids, sc = b.search("kernel", 10)
+    assert sorted(ids.tolist()) == [0, 1, 2] and np.all(np.diff(sc) <= 0)
+    ids, _ = b.search("kernel", 10, dead=np.array([1]))
+    assert sorted(ids.tolist()) == [0, 2]
+    ids, _ = b.search("kernel", 1)
+    assert len(ids) == 1
+
+def test_search_respects_ranges(tmp_path):
+    b = _index(tmp_path, ["kernel one", "kernel two"], ["kernel three", "margin only"])
+    ids, _ = b.search("kernel", 10, ranges=[(1, 4)])
+    assert sorted(ids.tolist()) == [1, 2]
+    ids, _ = b.search("kernel", 10, ranges=[])
+    assert len(ids) == 0
+
+def test_tokenize_keeps_compound_terms():
+    assert bm25.tokenize("The L2-norm, f1-score and e.g. 3.14!") == ["the", "l2-norm", "f1-score", "and", "e.g", "3.14"]
+
+def test_missing_postings_disable_bm25(tmp_path):
+    hdr = store.write_segment(tmp_path, np.zeros((1, 4), dtype=np.float32), [{"text": "x"}])
+    idx = store.open_segments(tmp_path, {"store": {"segments": [hdr]}})
+    assert bm25.BM25.load(tmp_path, idx) is None
+
+def test_range_search_scores_only_the_ranges(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(30)]
+    segs = [[" ".join(rng.choice(words, int(rng.integers(3, 12)))) for _ in range(n)] for n in (40, 25, 60)]
+    b = _index(tmp_path, *segs)
+    full = {q: b.scores(q) for q in ("w1", "w2 w3", "w4 w5 w6 w7", "w1 nope")}
+    monkeypatch.setattr(bm25.BM25, "scores", lambda self, q: pytest.fail("full-index scoring"))
+    for ranges in ([(0, 125)], [(5, 30), (38, 47), (90, 125)], [(64, 66)], [(70, 70)], []):
+        for q, s in full.items():
+            ref = np.zeros_like(s)
+            for a, c in ranges:
+                ref[a:c] = s[a:c]
+            want = np.flatnonzero(ref > 0)
+            ids, sc = b.search(q, 1000, ranges=ranges)
+            assert sorted(ids.tolist()) == want.tolist()
+            np.testing.assert_allclose(sc, ref[ids], rtol=1e-5)
+            top, _ = b.search(q, 3, ranges=ranges)
+            assert sorted(ref[top].tolist(), reverse=True) == sorted(ref[want].tolist(), reverse=True)[:3]
@@ -0,0 +1,56 @@
+import chunker
+
+SENTS = [f"Sentence {i} talks about topic {i % 5} at some length." for i in range(40)]
+
+def _units(*texts, **attrs):
+    return [{"text": t, **attrs} for t in texts]
+
+def test_iter_sentences_splits_on_punctuation_and_blank_lines():
+    assert list(chunker.iter_sentences("One. Two?  Three!\n\nFour\nstill four")) == \
+        ["One.", "Two?", "Three!", "Four\nstill four"]
+    assert list(chunker.iter_sentences("  ")) == []
+
+def test_chunks_stay_within_budget_and_keep_every_sentence():
+    chunks = chunker.chunk_units(_units(" ".join(SENTS)), "sentence", max_tokens=50, overlap=0)
+    assert len(chunks) > 1
+    assert all(c["tokens"] <= 50 for c in chunks)
+    assert " ".join(c["text"] for c in chunks) == " ".join(SENTS)
+
+def test_overlap_carries_trailing_sentences():
+    chunks = chunker.chunk_units(_units(" ".join(SENTS)), "sentence", max_tokens=50, overlap=20)
+    assert all(c["tokens"] <= 50 for c in chunks)
+    for prev, cur in zip(chunks, chunks[1:]):
+        first = next(chunker.iter_sentences(cur["text"]))
+        assert prev["text"].endswith(first)                    # starts with the previous tail
+        assert chunker._tokens(first) <= 20
+    # every sentence appears, and the last one exactly once
+    text = " ".join(c["text"] for c in chunks)
+    assert all(s in text for s in SENTS) and text.count(SENTS[-1]) == 1
+
+def test_overlap_larger_than_budget_does_not_repeat_chunks():
+    chunks = chunker.chunk_units(_units(" ".join(SENTS[:6])), "sentence", max_tokens=15, overlap=15)
+    assert len({c["text"] for c in chunks}) == len(chunks)
+
+def test_long_sentence_is_split():
+    long = "word " * 400
+    chunks = chunker.chunk_units(_units(long), "sentence", max_tokens=30, overlap=0)
+    assert len(chunks) > 1 and all(c["tokens"] <= 30 for c in chunks)
+    assert "".join(c["text"].replace(" ", "") for c in chunks) == long.replace(" ", "")
+
+def test_markdown_never_crosses_sections():
+    units = [{"text": " ".join(SENTS[:8]), "section": "A"}, {"text": SENTS[8], "section": "A > B"},
+             {"text": " ".join(SENTS[9:12])}]
+    chunks = chunker.chunk_units(units, "markdown", max_tokens=60, overlap=10)
+    assert [c.get("section") for c in chunks][-2:] == ["A > B", None]
+    b = [c for c in chunks if c.get("section") == "A > B"]
+    assert len(b) == 1 and b[0]["text"] == SENTS[8]   # no overlap carried in from section A
+
+def test_pages_record_first_and_last_page():
+    units = [{"text": " ".join(SENTS[:3]), "page": 1}, {"text": " ".join(SENTS[3:6]), "page": 2},
+             {"text": SENTS[6], "page": 4}]
+    chunks = chunker.chunk_units(units, "page", max_tokens=10**4, overlap=0)
+    assert len(chunks) == 1 and (chunks[0]["page"], chunks[0]["page_end"]) == (1, 4)
+
+def test_strategy_for():
+    assert [chunker.strategy_for(n) for n in ("a.PDF", "b.md", "c.markdown", "d.txt", "README")] == \
+        ["page", "markdown", "markdown", "sentence", "sentence"]
@@ -0,0 +1,72 @@
+import numpy as np
+
+import context
+from utils import count_tokens
+
+BODY = "the bias variance tradeoff explains why larger models can overfit small datasets"
+
+def _hit(chunk, text, source="a.txt"):
+    return {"source": source, "chunk": chunk, "text": text, "score": 1.0}
+
+def test_overlap():
+    a, b = "intro " + BODY, BODY + " and more"
+    assert context.overlap(a, b) == len(BODY)
+    assert context.overlap("short tail", "short tail next") == 0     # under the probe length
+    assert context.overlap(a, "something else entirely, long enough to probe") == 0
+
+def test_render_merges_adjacent_chunks_without_repeating_overlap():
+    ctx = [_hit(1, BODY + " second part"), _hit(0, "first part " + BODY), _hit(0, "other", "b.txt")]
+    blocks = context.blocks(ctx)
+    assert [(b["source"], b["first"], b["last"]) for b in blocks] == [("a.txt", 0, 1), ("b.txt", 0, 0)]
+    assert blocks[0]["text"] == "first part " + BODY + " second part"
+    out = context.render(ctx)
+    assert out.startswith("[1] (a.txt #0-1): first part") and "[2] (b.txt #0): other" in out
+    assert context.render(ctx, cite=False).split("\n\n")[1] == "other"
+
+def test_select_fits_budget():
+    hits = [_hit(i, f"chunk {i} " + "lorem ipsum dolor " * 20, f"s{i}.txt") for i in range(10)]
+    for budget in (40, 100, 250):
+        ctx = context.select(hits, None, budget)
+        assert ctx and count_tokens(context.render(ctx)) <= budget
+    assert context.select(hits, None, 0) == []
+    # not even the best hit fits: it comes back truncated
+    ctx = context.select(hits, None, 10)
+    assert len(ctx) == 1 and ctx[0]["chunk"] == 0 and len(ctx[0]["text"]) < len(hits[0]["text"])
+
+def test_select_mmr_prefers_a_diverse_second_hit():
+    vecs = np.array([[1.0, 0.0, 0.0], [0.99, 0.1, 0.0], [0.0, 0.0, 1.0]])
+    hits = [_hit(0, "alpha text", "x"), _hit(0, "alpha copy", "y"), _hit(0, "another view", "z")]
+    relevance_only = context.select(hits, vecs, 1000, lam=1.0)
+    assert [h["source"] for h in relevance_only] == ["x", "y", "z"]
+    diverse = context.select(hits, vecs, 1000, lam=0.5)
+    assert [h["source"] for h in diverse] == ["x", "z", "y"]
+
+def test_select_keeps_the_top_ranked_hit_whatever_its_cosine():
+    # rank 1 came from BM25 alone (an exact term); its embedding is unlike the dense hits'
+    hits = [_hit(0, "zq-17 regularizer " + "lorem " * 20, "exact.txt")] + \
+           [_hit(i, f"dense {i} " + "ipsum " * 20, f"d{i}.txt") for i in range(1, 6)]
+    vecs = np.vstack([[0.0, 1.0], np.tile([1.0, 0.0], (5, 1))])
+    one = count_tokens(context.render(hits[:1])) + 2
+    assert [h["source"] for h in context.select(hits, vecs, one)] == ["exact.txt"]
+    assert context.select(hits, vecs, 2 * one)[0]["source"] == "exact.txt"
+
+def test_select_counts_a_duplicate_chunk_once():
+    hits = [_hit(0, "same chunk " * 10), _hit(0, "same chunk " * 10)]
+    assert len(context.select(hits, None, 1000)) == 1
+
+def test_pack_context_keeps_a_bm25_only_top_hit_under_a_tight_budget(course):
+    import ingest, rag
+    # BM25 keeps "l2-norm" as one term, which only exact.txt contains; the dense side (words
+    # l2 and norm) prefers dense.txt, so exact.txt is fused rank 1 with the lowest cosine
+    (course / "dense.txt").write_text(
+        " ".join(f"Note {i}: the l2 penalty bounds the norm of the weights." for i in range(30)), encoding="utf-8")
+    (course / "exact.txt").write_text(
+        "Shrinkage estimators pull every fitted coefficient toward zero, and the l2-norm constraint "
+        "trades a little bias for much lower variance on noisy small samples.", encoding="utf-8")
+    ingest.upsert_files()
+    hits = rag.retrieve("l2-norm", k=8)
+    assert hits[0]["source"] == "exact.txt"
+    cos = rag._load_index().rows_f32(np.array([h["id"] for h in hits])) @ rag._embed_query("l2-norm")
+    assert int(np.argmin(cos)) == 0
+    budget = count_tokens(context.render(hits[:1])) + 2
+    assert [h["id"] for h in rag.pack_context(hits, budget=budget)] == [hits[0]["id"]]
@@ -0,0 +1,37 @@
+import time
+
+import numpy as np
+
+import embed_cache
+from embed_cache import EmbeddingCache
+
+def test_embedding_cache_is_keyed_by_model_and_text(tmp_path):
+    c = EmbeddingCache(tmp_path / "e.sqlite")
+    c.put_many("m1", ["a", "b"], np.eye(2, dtype=np.float32))
+    got = c.get_many("m1", ["b", "x", "a", "b"])
+    assert sorted(got) == [0, 2, 3]
+    np.testing.assert_array_equal(got[0], [0, 1])
+    np.testing.assert_array_equal(got[2], [1, 0])
+    assert c.get_many("m2", ["a"]) == {}
+    assert c.stats()["entries"] == 2 and c.stats()["hits"] == 3
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    c = EmbeddingCache(tmp_path / "e.sqlite")
+    for t in ("old", "used", "new"):
+        c.put_many("m", [t], np.ones((1, 4), dtype=np.float32))
+        time.sleep(0.01)
+    c.get_many("m", ["used"])
+    assert c.evict(max_bytes=32) == 1                # room for two 16-byte vectors
+    assert sorted(c.get_many("m", ["old", "used", "new"])) == [1, 2]
+
+def test_embedding_cache_lookups_do_not_write(tmp_path, monkeypatch):
+    c = EmbeddingCache(tmp_path / "e.sqlite")
+    c.put_many("m", ["a", "b"], np.eye(2, dtype=np.float32))
+    writes = c._db.total_changes
+    for _ in range(5):
+        assert len(c.get_many("m", ["a", "b", "c"])) == 2
+    assert c._db.total_changes == writes
+    # pending access times are written once enough accumulate (or with the next insert)
+    monkeypatch.setattr(embed_cache, "TOUCH_FLUSH", 2)
+    c.get_many("m", ["a", "b"])
+    assert c._db.total_changes == writes + 2 and not c._touched
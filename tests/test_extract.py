@@ -0,0 +1,19 @@
+import threading
+
+import ingest
+
+def test_extraction_pool_runs_from_a_background_thread_and_caches(course, monkeypatch):
+    monkeypatch.setattr(ingest, "EXTRACT_WORKERS", 2)
+    (course / "a.txt").write_text("Plain text file.", encoding="utf-8")
+    (course / "b.md").write_text("# Title\nIntro.\n## Part\nDetails here.", encoding="utf-8")
+    items = [(p, ingest.file_hash(p)) for p in sorted(course.iterdir())]
+    out = {}
+    # the reindex job extracts from a worker thread: the pool must not fork this process
+    t = threading.Thread(target=lambda: out.update(ingest.extract_files(items)))
+    t.start(); t.join(timeout=120)
+    assert not t.is_alive()
+    assert out["a.txt"] == [{"text": "Plain text file."}]
+    assert [u["section"] for u in out["b.md"]] == ["Title", "Title > Part"]
+    for p, _ in items:
+        p.write_text("changed on disk", encoding="utf-8")   # the cache is keyed by the old hash
+    assert ingest.extract_files(items) == out
@@ -0,0 +1,89 @@
+import pytest
+
+import filters
+
+def _manifest():
+    # a.md: 6 chunks under two sections; b.pdf: 5 chunks over pages 1-9; rows 0-3 are tombstones
+    a = [{"section": "Chapter 3: Linear Regression"}] * 2 + \
+        [{"section": "Chapter 3: Linear Regression > Assumptions"}] * 2 + [{"section": "Trees"}] * 2
+    b = [{"page": 1}, {"page": 1, "page_end": 3}, {"page": 3}, {"page": 5, "page_end": 8}, {"page": 9}]
+    return {"rows": 15, "files": {
+        "a.md": {"rows": [4, 10], **filters.describe(a)},
+        "b.pdf": {"rows": [10, 15], **filters.describe(b)},
+    }}
+
+def test_describe_records_section_runs_and_page_spans():
+    d = filters.describe([{"section": "A"}, {"section": "A"}, {"section": "B"}, {"section": "A"}])
+    assert d == {"sections": {"A": [[0, 2], [3, 4]], "B": [[2, 3]]}}
+    d = filters.describe([{"page": 1}, {"page": 1}, {"page": 2, "page_end": 4}])
+    assert d == {"pages": [[1, 1, 0], [2, 4, 2]]}
+    assert filters.describe([{"text": "x"}]) == {}
+
+def test_resolve_source():
+    man = _manifest()
+    assert filters.resolve(man, {"source": "a.md"}) == [(4, 10)]
+    assert filters.resolve(man, {"source": "B"}) == [(10, 15)]   # stem, any case
+    assert filters.resolve(man, {"source": "c"}) == []
+
+def test_resolve_section_includes_subsections():
+    man = _manifest()
+    assert filters.resolve(man, {"section": "Chapter 3: Linear Regression"}) == [(4, 8)]
+    assert filters.resolve(man, {"section": "linear regression"}) == [(4, 8)]   # numbering ignored
+    assert filters.resolve(man, {"section": "Assumptions"}) == [(6, 8)]
+    assert filters.resolve(man, {"section": "3. Trees"}) == [(8, 10)]
+
+def test_resolve_pages_overlapping_spans():
+    man = _manifest()
+    assert filters.resolve(man, {"pages": (2, 2)}) == [(11, 12)]
+    assert filters.resolve(man, {"pages": (3, 6)}) == [(11, 14)]
+    assert filters.resolve(man, {"pages": (9, 20)}) == [(14, 15)]
+    assert filters.resolve(man, {"pages": (10, 20)}) == []
+
+def test_resolve_intersects_keys():
+    man = _manifest()
+    assert filters.resolve(man, {"source": "a", "section": "Trees"}) == [(8, 10)]
+    assert filters.resolve(man, {"source": "a", "pages": (1, 9)}) == []   # a.md has no pages
+    assert filters.resolve(man, {"source": "b", "pages": (1, 1)}) == [(10, 12)]
+
+def test_merge_and_intersect():
+    assert filters.merge([(5, 7), (0, 2), (2, 3), (6, 9), (4, 4)]) == [(0, 3), (5, 9)]
+    assert filters._intersect([(0, 4), (6, 10)], [(3, 7), (9, 12)]) == [(3, 4), (6, 7), (9, 10)]
+
+def test_check():
+    assert filters.check(None) is None and filters.check({}) is None
+    assert filters.check({"pages": 4, "source": " a.md "}) == {"source": "a.md", "pages": (4, 4)}
+    for bad in ({"author": "x"}, {"section": ""}, {"pages": [3, 1]}, {"pages": "1-2"}, ["source"]):
+        with pytest.raises(ValueError):
+            filters.check(bad)
+    assert filters.key({"pages": (1, 2), "source": "a"}) == (("source", "a"), ("pages", (1, 2)))
+
+def test_catalog_matches_sources_and_headings():
+    cat = filters.Catalog(_manifest())
+    assert cat.match("B.pdf") == {"source": "b.pdf"}
+    assert cat.match("a") == {"source": "a.md"}
+    assert cat.match("linear regression") == {"section": "Chapter 3: Linear Regression"}
+    assert cat.match("Chapter 7: Assumptions") == {"section": "Assumptions"}
+    assert cat.match("neural networks") is None
+
+def test_filtered_retrieval_returns_only_matching_rows(course, monkeypatch):
+    import ann, ingest, rag
+    monkeypatch.setattr(ann, "ANN_MIN_ROWS", 10)
+    (course / "book.md").write_text(
+        "# Chapter 3: Linear Regression\n" + "Least squares fits a line to data points. " * 12 +
+        "\n## Assumptions\n" + "Residuals of a linear fit should look like noise. " * 12 +
+        "\n# Trees\n" + "A tree splits the data on one feature at a time. " * 12, encoding="utf-8")
+    (course / "notes.txt").write_text("Least squares and residuals again, in plain notes. " * 20, encoding="utf-8")
+    ingest.upsert_files()
+    idx = rag._load_index()
+    assert idx.ivf is not None
+
+    def sections(hits):
+        return {idx.meta(h["id"]).get("section") for h in hits}
+    for exact in (True, False):
+        hits = rag.retrieve("least squares residuals", k=50, exact=exact,
+                            where={"source": "book", "section": "linear regression"})
+        assert {h["source"] for h in hits} == {"book.md"}
+        assert sections(hits) == {"Chapter 3: Linear Regression", "Chapter 3: Linear Regression > Assumptions"}
+        assert rag.retrieve("trees", k=5, exact=exact, where={"source": "missing.md"}) == []
+    hits = rag.retrieve("least squares", k=50, where={"section": "Assumptions"})
+    assert sections(hits) == {"Chapter 3: Linear Regression > Assumptions"}
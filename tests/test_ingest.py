@@ -0,0 +1,76 @@
+import numpy as np
+
+import ingest, rag, store, courses
+from conftest import text
+
+def _index():
+    return store.open_index(store.current_dir(courses.index_root()))
+
+def _rows(man, name):
+    a, b = man["files"][name]["rows"]
+    return list(range(a, b))
+
+def test_compaction_renumbers_file_rows(course, monkeypatch):
+    monkeypatch.setattr(store, "SEGMENT_ROWS", 8)   # several segments, some partly dead
+    for name in ("a", "b", "c", "d"):
+        (course / f"{name}.txt").write_text(text(name, 20), encoding="utf-8")
+    ingest.upsert_files()
+    (course / "b.txt").unlink()
+    (course / "c.txt").write_text(text("cherry", 15), encoding="utf-8")
+    ingest.upsert_files()
+
+    man = ingest.load_manifest()
+    idx = _index()
+    before = {n: [(idx.meta(i)["chunk"], idx.rows_f32(np.array([i]))[0]) for i in _rows(man, n)]
+              for n in man["files"]}
+    assert ingest.dead_rows(man) > 0 and len(store.segment_headers(man)) > 2
+    del idx
+
+    ingest.compact_index()
+    man = ingest.load_manifest()
+    assert ingest.dead_rows(man) == 0
+    assert "ann" not in man or man["ann"]["rows"] == man["rows"]
+    # file ranges tile [0, rows) and each row still holds that file's chunk, in order
+    spans = sorted(tuple(e["rows"]) for e in man["files"].values())
+    assert spans[0][0] == 0 and spans[-1][1] == man["rows"]
+    assert all(x[1] == y[0] for x, y in zip(spans, spans[1:]))
+    idx = _index()
+    assert len(idx) == man["rows"]
+    for name, old in before.items():
+        rows = _rows(man, name)
+        assert [idx.meta(i)["source"] for i in rows] == [name] * len(old)
+        assert [idx.meta(i)["chunk"] for i in rows] == [c for c, _ in old]
+        np.testing.assert_allclose(idx.rows_f32(np.array(rows)), np.stack([v for _, v in old]))
+    hits = rag.retrieve("cherry", k=3, exact=True)
+    assert hits[0]["source"] == "c.txt"
+
+def test_a_failed_run_keeps_committed_files(course, monkeypatch, capsys):
+    monkeypatch.setattr(store, "SEGMENT_ROWS", 4)
+    for name in ("a", "b", "c"):
+        (course / f"{name}.txt").write_text(text(name, 20), encoding="utf-8")
+    embed, calls = ingest.embed_texts, []
+
+    def failing(texts):
+        calls.append(len(texts))
+        if len(calls) == 4:
+            raise RuntimeError("embeddings API down")
+        return embed(texts)
+    monkeypatch.setattr(ingest, "embed_texts", failing)
+    try:
+        ingest.upsert_files()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("the embedding failure was swallowed")
+    monkeypatch.setattr(ingest, "embed_texts", embed)
+    capsys.readouterr()
+    ingest.upsert_files()
+    # the files completed by committed segments are not redone
+    out = capsys.readouterr().out
+    redone = int(out.split(" new/changed")[0].rsplit("\n", 1)[-1])
+    assert 0 < redone < 3
+    man = ingest.load_manifest()
+    assert set(man["files"]) == {"a.txt", "b.txt", "c.txt"}
+    idx = _index()
+    for name in man["files"]:
+        assert {idx.meta(i)["source"] for i in _rows(man, name)} == {name}
@@ -0,0 +1,50 @@
+import os
+
+import ingest, rag, store, courses
+from conftest import text
+
+def test_upsert_classifies_unchanged_touched_changed_removed(course, capsys):
+    for name in ("a", "b", "c"):
+        (course / f"{name}.txt").write_text(text(name), encoding="utf-8")
+    ingest.upsert_files()
+    man = ingest.load_manifest()
+    assert set(man["files"]) == {"a.txt", "b.txt", "c.txt"}
+    assert ingest.dead_rows(man) == 0
+    rows = {n: e["rows"] for n, e in man["files"].items()}
+
+    # nothing changed: no new version
+    version = store.current_dir(courses.index_root())
+    capsys.readouterr()
+    ingest.upsert_files()
+    assert "Index up to date" in capsys.readouterr().out
+    assert store.current_dir(courses.index_root()) == version
+
+    # a: same bytes, new mtime (recorded, not re-embedded); b: new text; c: gone
+    st = (course / "a.txt").stat()
+    os.utime(course / "a.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    (course / "b.txt").write_text(text("banana"), encoding="utf-8")
+    (course / "c.txt").unlink()
+    capsys.readouterr()
+    ingest.upsert_files()
+    assert "1 new/changed, 1 removed" in capsys.readouterr().out
+
+    man = ingest.load_manifest()
+    assert set(man["files"]) == {"a.txt", "b.txt"}
+    assert man["files"]["a.txt"]["rows"] == rows["a.txt"]
+    assert man["files"]["a.txt"]["mtime_ns"] == (course / "a.txt").stat().st_mtime_ns
+    # the new rows of b are appended; its old rows and all of c's are tombstones
+    assert man["files"]["b.txt"]["rows"][0] == max(r[1] for r in rows.values())
+    dead = sum(b - a for n, (a, b) in rows.items() if n != "a.txt")
+    assert ingest.dead_rows(man) == dead
+
+def test_tombstoned_rows_are_never_retrieved(course):
+    (course / "keep.txt").write_text(text("kernel"), encoding="utf-8")
+    (course / "gone.txt").write_text(text("entropy"), encoding="utf-8")
+    ingest.upsert_files()
+    assert any(h["source"] == "gone.txt" for h in rag.retrieve("entropy", k=5, exact=True))
+    (course / "gone.txt").unlink()
+    ingest.upsert_files()
+    assert ingest.dead_rows(ingest.load_manifest()) > 0
+    for exact in (True, False):
+        hits = rag.retrieve("entropy", k=50, exact=exact)
+        assert hits and all(h["source"] == "keep.txt" for h in hits)
@@ -0,0 +1,54 @@
+import logging
+
+import pytest
+
+import ingest, quiz
+from conftest import text
+
+def _mcq(tag: str) -> dict:
+    # unique words per question, so distinct questions are never near-duplicates of each other
+    return {"type": "mcq", "q": f"Which {tag}alpha {tag}beta {tag}gamma holds?",
+            "choices": ["a", "b", "c"], "answer": "a", "explanation": "Because."}
+
+@pytest.fixture
+def generator(course, monkeypatch):
+    """Patch quiz._live with batches(call, n) -> questions; returns the list of requested n."""
+    (course / "ml.txt").write_text(text("regression", 30), encoding="utf-8")
+    ingest.upsert_files()
+    monkeypatch.setattr(quiz, "_schedule_refill", lambda *a: None)   # no background _live calls
+    calls = []
+
+    def use(batches):
+        def live(topic, difficulty, n, course):
+            calls.append(n)
+            return batches(len(calls), n), ""
+        monkeypatch.setattr(quiz, "_live", live)
+        return calls
+    return use
+
+def _ids(res):
+    ids = [q.get("id") for q in res["questions"]]
+    assert None not in ids and len(set(ids)) == len(ids)
+    return ids
+
+def test_dropped_paraphrases_are_topped_up(generator):
+    # first round: 6 new questions and 4 copies of them; the second round fills the gap
+    calls = generator(lambda call, n: [_mcq(f"c{call}q{i % 6 if call == 1 else i}z") for i in range(n)])
+    res = quiz.make_quiz("regression", n=10, seen=set())
+    assert res["count"] == res["requested"] == 10
+    assert len(_ids(res)) == 10 and calls == [10, 4]
+
+def test_top_up_prefers_unseen_then_repeats_earlier_questions(generator, caplog):
+    calls = generator(lambda call, n: [_mcq(f"c{call}q{i}z") for i in range(n)] if call == 1
+                      else [_mcq("only")] * n)
+    seen = set()
+    first = quiz.make_quiz("regression", n=3, seen=seen)
+    assert len(_ids(first)) == 3 and seen == set(_ids(first))
+    # the generator now repeats itself: one new question, then the earlier quiz's three
+    with caplog.at_level(logging.WARNING, logger="quiz"):
+        res = quiz.make_quiz("regression", n=6, seen=seen)
+    ids = _ids(res)
+    assert res["count"] == 4 and res["requested"] == 6
+    assert set(ids) >= set(_ids(first))
+    assert "only 4 of 6 questions" in caplog.text
+    assert calls == [3, 6, 5]
@@ -0,0 +1,53 @@
+import ingest, rag, store, courses
+from conftest import text
+
+def _index():
+    return store.open_index(store.current_dir(courses.index_root()))
+
+def _run(monkeypatch):
+    monkeypatch.setattr(ingest, "_JOB", None)
+    job = ingest.start_reindex()
+    assert ingest.start_reindex() is job and ingest.current_job() is job   # one job at a time
+    job._thread.join(timeout=60)
+    assert not job.running
+    return job
+
+def test_background_reindex_swaps_versions_atomically(course, monkeypatch):
+    (course / "a.txt").write_text(text("kernel"), encoding="utf-8")
+    assert _run(monkeypatch).stage == "done"
+    old = rag._load_index()
+    first = store.current_dir(courses.index_root())
+    (course / "b.txt").write_text(text("entropy"), encoding="utf-8")
+    job = _run(monkeypatch)
+    assert job.stage == "done" and job.error is None and job.files_total == 1
+    assert store.current_dir(courses.index_root()) != first
+    # the open snapshot still reads its own version; new searches see the new one
+    assert {old.meta(i)["source"] for i in range(len(old))} == {"a.txt"}
+    assert rag.retrieve("entropy", k=1)[0]["source"] == "b.txt"
+
+def test_failed_reindex_keeps_serving_the_live_version(course, monkeypatch):
+    (course / "a.txt").write_text(text("kernel"), encoding="utf-8")
+    _run(monkeypatch)
+    live = store.current_dir(courses.index_root())
+
+    def down(texts):
+        raise RuntimeError("embeddings API down")
+    monkeypatch.setattr(ingest, "embed_texts", down)
+    (course / "b.txt").write_text(text("entropy"), encoding="utf-8")
+    job = _run(monkeypatch)
+    assert job.stage == "failed" and "embeddings API down" in job.lines[-1]
+    assert store.current_dir(courses.index_root()) == live
+    assert {h["source"] for h in rag.retrieve("entropy", k=5)} == {"a.txt"}
+
+def test_sources_without_text_leave_no_staging_version(course):
+    (course / "empty.txt").write_text("   \n", encoding="utf-8")
+    ingest.upsert_files()
+    root = courses.index_root()
+    assert not store.current_dir(root).joinpath("manifest.json").exists()
+    assert not (root / "NEXT").exists()
+    (course / "real.txt").write_text(text("margin"), encoding="utf-8")
+    ingest.upsert_files()
+    man = ingest.load_manifest()
+    assert man["rows"] == len(_index()) > 0
+    a, b = man["files"]["empty.txt"]["rows"]   # recorded with no rows, so it is not re-read
+    assert a == b
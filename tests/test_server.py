@@ -0,0 +1,59 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import ingest, server
+from conftest import text
+
+def _requests(*calls):
+    """[(status, json)] of (method, path, json body or raw str) calls against a fresh app."""
+    async def run():
+        out = []
+        async with TestClient(TestServer(server.make_app())) as client:
+            for method, path, body in calls:
+                kw = {"data": body} if isinstance(body, str) else {"json": body}
+                resp = await client.request(method, path, **kw)
+                out.append((resp.status, await resp.json()))
+        return out
+    return asyncio.run(run())
+
+def test_bad_requests_get_400(course):
+    bad = [("POST", "/retrieve", "not json"), ("POST", "/retrieve", "[1, 2]"),
+           ("POST", "/retrieve", {}), ("POST", "/retrieve", {"query": "  "}),
+           ("POST", "/retrieve", {"query": "x", "k": "many"}), ("POST", "/retrieve", {"query": "x", "k": True}),
+           ("POST", "/retrieve", {"query": "x", "course": "../etc"}),
+           ("POST", "/retrieve", {"query": "x", "where": {"author": "me"}}),
+           ("POST", "/quiz", {"topic": "x", "n": [3]}), ("POST", "/quiz", {"topic": "x", "seen": ["1"]}),
+           ("POST", "/quiz", {"topic": "x", "seen": 3}), ("POST", "/answer", {"question": "x"})]
+    for (status, body), call in zip(_requests(*bad), bad):
+        assert status == 400 and "error" in body, call
+
+def test_missing_index_is_503(course):
+    (status, body), (hstatus, health) = _requests(("POST", "/retrieve", {"query": "kernel"}),
+                                                  ("GET", "/health", None))
+    assert status == 503 and "error" in body
+    assert hstatus == 200 and health["status"] == "no index"
+
+def test_retrieve_answer_quiz(course):
+    (course / "svm.txt").write_text(text("kernel", 20), encoding="utf-8")
+    (course / "trees.txt").write_text(text("entropy", 20), encoding="utf-8")
+    ingest.upsert_files()
+    res = _requests(
+        ("POST", "/retrieve", {"query": "kernel", "k": 3}),
+        ("POST", "/retrieve", {"query": "kernel", "k": 100, "where": {"source": "trees"}}),
+        ("POST", "/answer", {"query": "What is a kernel?"}),
+        ("POST", "/answer", {"query": "what is a  KERNEL?"}),
+        ("POST", "/quiz", {"topic": "entropy", "n": 3, "seen": []}),
+        ("GET", "/health", None),
+        ("GET", "/stats", None),
+    )
+    assert all(status == 200 for status, _ in res), res
+    (_, top), (_, filtered), (_, first), (_, again), (_, qz), (_, health), (_, stats) = res
+    assert len(top["hits"]) == 3 and top["hits"][0]["source"] == "svm.txt"
+    assert filtered["hits"] and {h["source"] for h in filtered["hits"]} == {"trees.txt"}
+    assert first["cached"] is False and first["ctx"]
+    assert again["cached"] is True and again["answer"] == first["answer"]
+    assert qz["count"] == len(qz["questions"]) == 3
+    assert all(q.get("id") is not None for q in qz["questions"])
+    assert health["status"] == "ok"
+    assert stats["answer_cache"]["hits"] >= 1
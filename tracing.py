@@ -0,0 +1,218 @@
+# tracing.py — lightweight spans with a rotating JSONL sink
+#
+#   with span("rag.search", rows=n) as sp:
+#       ...
+#       sp.set(hits=len(out))
+#
+# Each finished span is one JSON line {ts, trace, id, parent, name, ms, ...attrs}.
+# Spans nest through a context variable. Work submitted to thread pools joins the
+# caller's trace when wrapped with bind(). With TRACE unset and no collect() block
+# active, span() returns a shared no-op object, so instrumented code pays one call
+# and a flag check.
+import os, json, time, itertools, logging, threading, contextvars
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Callable, Dict, List
+
+APP = Path(__file__).resolve().parent
+TRACE = os.getenv("TRACE", "0") not in ("0", "", "false", "False")
+TRACE_PATH = Path(os.getenv("TRACE_PATH", APP / "data" / "traces" / "trace.jsonl"))
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "20"))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+
+_current: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+_collector: contextvars.ContextVar = contextvars.ContextVar("collector", default=None)
+_ids = itertools.count(1)
+_sink = None
+_sink_lock = threading.Lock()
+_collecting = 0   # collect() blocks open in this process
+
+def _process_start() -> float:
+    """Wall-clock start of this process; Linux reads it from /proc (10 ms resolution),
+    elsewhere the time this module was imported stands in."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])   # starttime, since boot
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+STARTED = _process_start()
+MILESTONES: Dict[str, float] = {}   # name -> seconds after process start, first occurrence
+
+def _get_sink() -> logging.Logger:
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            TRACE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            h = RotatingFileHandler(TRACE_PATH, maxBytes=int(TRACE_MAX_MB * 2**20),
+                                    backupCount=TRACE_BACKUPS, encoding="utf-8")
+            h.setFormatter(logging.Formatter("%(message)s"))
+            lg = logging.getLogger("tracing.sink")
+            lg.propagate = False
+            lg.setLevel(logging.INFO)
+            lg.addHandler(h)
+            _sink = lg
+        return _sink
+
+class _NoSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def set(self, **attrs): pass
+
+NOOP = _NoSpan()
+
+class Span:
+    __slots__ = ("name", "attrs", "id", "trace", "parent", "t0", "ms", "_token")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name, self.attrs = name, attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current.get()
+        self.id = next(_ids)
+        self.parent = parent.id if parent else None
+        self.trace = parent.trace if parent else f"{os.getpid():x}-{self.id:x}"
+        self._token = _current.set(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        self.ms = (time.perf_counter() - self.t0) * 1e3
+        try:
+            _current.reset(self._token)
+        except ValueError:   # exited from another context (e.g. a generator resumed elsewhere)
+            _current.set(None)
+        if etype is not None:
+            self.attrs["error"] = etype.__name__
+        rec = {"ts": round(time.time(), 3), "trace": self.trace, "id": self.id, "parent": self.parent,
+               "name": self.name, "ms": round(self.ms, 3), **self.attrs}
+        sink = _collector.get()
+        if sink is not None:
+            sink.append(rec)
+        if TRACE:
+            _get_sink().info(json.dumps(rec, ensure_ascii=False, default=str))
+        return False
+
+def span(name: str, **attrs):
+    """Context manager timing one stage; a no-op unless tracing or collect() is on."""
+    if not TRACE and not _collecting:
+        return NOOP
+    return Span(name, attrs)
+
+def traced(name: str):
+    """Decorator form of span() for whole functions."""
+    def deco(fn):
+        def wrapper(*a, **kw):
+            with span(name):
+                return fn(*a, **kw)
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = fn.__name__, fn.__doc__, fn
+        return wrapper
+    return deco
+
+def bind(fn: Callable) -> Callable:
+    """fn bound to the caller's context, so spans it opens on a pool thread join the caller's trace."""
+    if not TRACE and not _collecting:
+        return fn
+    ctx = contextvars.copy_context()
+    return lambda *a, **kw: ctx.run(fn, *a, **kw)
+
+@contextmanager
+def collect():
+    """Gather the span records finished inside the block (e.g. for a timing panel)."""
+    global _collecting
+    out: List[Dict] = []
+    token = _collector.set(out)
+    with _sink_lock:
+        _collecting += 1
+    try:
+        yield out
+    finally:
+        with _sink_lock:
+            _collecting -= 1
+        _collector.reset(token)
+
+def milestone(name: str) -> float:
+    """Record (once per process) how long after process start `name` was first reached,
+    e.g. "first_answer". Logged always; written to the trace as span "startup.<name>"."""
+    t = MILESTONES.get(name)
+    if t is not None:
+        return t
+    with _sink_lock:
+        if name in MILESTONES:
+            return MILESTONES[name]
+        t = MILESTONES[name] = time.time() - STARTED
+    logging.getLogger("startup").info("%s %.3fs after process start", name, t)
+    rec = {"ts": round(time.time(), 3), "trace": f"{os.getpid():x}-start", "id": next(_ids), "parent": None,
+           "name": f"startup.{name}", "ms": round(t * 1e3, 3)}
+    sink = _collector.get()
+    if sink is not None:
+        sink.append(rec)
+    if TRACE:
+        _get_sink().info(json.dumps(rec))
+    return t
+
+def usage(resp) -> Dict:
+    """Token counts of an OpenAI response (or final stream event), when it reports them."""
+    u = getattr(resp, "usage", None)
+    if u is None:
+        return {}
+    return {k: getattr(u, k) for k in ("prompt_tokens", "completion_tokens", "total_tokens")
+            if isinstance(getattr(u, k, None), int)}
+
+# --- summary CLI
+
+def _pct(xs: List[float], p: float) -> float:
+    xs = sorted(xs)
+    i = min(len(xs) - 1, max(0, int(round(p / 100 * (len(xs) - 1)))))
+    return xs[i]
+
+def summarize(paths: List[Path], since: float = 0.0) -> List[Dict]:
+    by: Dict[str, List[float]] = {}
+    hits: Dict[str, List[int]] = {}
+    for p in paths:
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue
+                if r.get("ts", 0) < since: continue
+                by.setdefault(r["name"], []).append(r["ms"])
+                if "cache_hit" in r:
+                    hits.setdefault(r["name"], []).append(bool(r["cache_hit"]))
+    rows = []
+    for name, ms in sorted(by.items()):
+        h = hits.get(name)
+        rows.append({"stage": name, "n": len(ms), "p50": _pct(ms, 50), "p95": _pct(ms, 95),
+                     "p99": _pct(ms, 99), "total_s": sum(ms) / 1e3,
+                     "hit_rate": (sum(h) / len(h)) if h else None})
+    return rows
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="p50/p95/p99 latency per traced stage")
+    ap.add_argument("path", nargs="?", default=str(TRACE_PATH), help="trace file (rotated backups are included)")
+    ap.add_argument("--hours", type=float, default=0, help="only spans from the last N hours")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+    base = Path(args.path)
+    paths = [p for p in [base] + [base.with_name(f"{base.name}.{i}") for i in range(1, 100)] if p.exists()]
+    if not paths:
+        raise SystemExit(f"No trace files at {base} (run with TRACE=1)")
+    rows = summarize(paths, time.time() - args.hours * 3600 if args.hours else 0.0)
+    if args.json:
+        print(json.dumps(rows, indent=1))
+    else:
+        print(f"{'stage':<28} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total s':>9} {'hits':>6}")
+        for r in rows:
+            hit = f"{r['hit_rate']:.0%}" if r["hit_rate"] is not None else ""
+            print(f"{r['stage']:<28} {r['n']:>7} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['p99']:>9.1f} "
+                  f"{r['total_s']:>9.1f} {hit:>6}")
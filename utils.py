@@ -1,6 +1,64 @@
-from typing import List
+import os, threading
+from functools import lru_cache
+
+# one OpenAI client per process (sync and async), created on first use: importing the SDK
+# costs ~1s, and a shared client keeps one pool of keep-alive connections for every caller
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))       # seconds per request
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))  # SDK retries (backoff) on 429/5xx/connect
+OPENAI_POOL = int(os.getenv("OPENAI_POOL", "64"))               # pooled connections
+OPENAI_KEEPALIVE = float(os.getenv("OPENAI_KEEPALIVE", "120"))  # idle seconds a connection is kept
+
+_CLIENTS = {}
+_CLIENT_LOCK = threading.Lock()
 
 def safe_truncate(text: str, n: int = 1200) -> str:
     if len(text) <= n:
         return text
     return text[:n] + "…"
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = "cl100k_base"):
+    """tiktoken encoding, or None when tiktoken/its BPE files are unavailable (offline)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+def count_tokens(text: str) -> int:
+    enc = get_encoding()
+    if enc is None:
+        return max(1, len(text) // 4)   # rough estimate
+    return len(enc.encode(text, disallowed_special=()))
+
+def _make_client(kind: str):
+    import httpx, openai
+    limits = httpx.Limits(max_connections=OPENAI_POOL, max_keepalive_connections=OPENAI_POOL,
+                          keepalive_expiry=OPENAI_KEEPALIVE)
+    kw = dict(api_key=os.getenv("OPENAI_API_KEY"), timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
+    if kind == "async":
+        return openai.AsyncOpenAI(**kw, http_client=httpx.AsyncClient(limits=limits, timeout=OPENAI_TIMEOUT))
+    return openai.OpenAI(**kw, http_client=httpx.Client(limits=limits, timeout=OPENAI_TIMEOUT))
+
+def get_client():
+    """The shared openai.OpenAI client."""
+    c = _CLIENTS.get("sync")
+    if c is None:
+        with _CLIENT_LOCK:
+            c = _CLIENTS.get("sync") or _CLIENTS.setdefault("sync", _make_client("sync"))
+    return c
+
+def get_async_client():
+    """The shared openai.AsyncOpenAI client (server.py)."""
+    c = _CLIENTS.get("async")
+    if c is None:
+        with _CLIENT_LOCK:
+            c = _CLIENTS.get("async") or _CLIENTS.setdefault("async", _make_client("async"))
+    return c
+
+def set_client(client, async_client=None):
+    """Replace the shared clients (offline runs: see fake_openai.install)."""
+    with _CLIENT_LOCK:
+        _CLIENTS["sync"] = client
+        if async_client is not None:
+            _CLIENTS["async"] = async_client